@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the site's hot paths.
+
+    python -m benchmarks.generate CONFIG
+        fills the empty database CONFIG names with a synthetic market
+    python -m benchmarks CONFIG
+        times the hot paths against it and writes the results as JSON
+        
+analytics.py and cache_contention.py are standalone comparisons with
+designs the site has since replaced.
+"""
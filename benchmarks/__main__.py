@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Times the site's hot paths against the database CONFIG names, which should
+hold a generated market, and writes the results as JSON.
+
+Usage: python -m benchmarks CONFIG [--repetitions N] [--output PATH] [--baseline PATH] [BENCHMARK ...]
+
+With --baseline, each benchmark's best time is also compared with that of
+an earlier run's results.
+"""
+import argparse
+import collections
+import json
+import logging
+import platform
+import subprocess
+import sys
+import time
+
+import numpy
+
+def _get_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.STDOUT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+        
+def _compare(results, baseline):
+    for (name, timings) in results.iteritems():
+        previous = baseline['results'].get(name)
+        if previous is None:
+            continue
+        sys.stderr.write("{name}: {before:.6f}s -> {after:.6f}s per operation ({ratio:.2f}x)\n".format(
+            name=name,
+            before=previous['per_operation'],
+            after=timings['per_operation'],
+            ratio=(previous['per_operation'] / timings['per_operation']),
+        ))
+        
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description="Time the site's hot paths.")
+    parser.add_argument('config', help="the server configuration naming the database to run against")
+    parser.add_argument('benchmarks', nargs='*', help="the benchmarks to run; all of them by default")
+    parser.add_argument('--repetitions', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="where to write the results; standard output by default")
+    parser.add_argument('--baseline', help="earlier results to compare against")
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.WARN)
+    import ffxiv_market.common
+    ffxiv_market.common.CONFIG = json.loads(open(args.config).read())
+    from benchmarks import suite
+    
+    unknown = set(args.benchmarks).difference(suite.BENCHMARKS)
+    if unknown:
+        parser.error("unknown benchmarks: {names}; choose from {known}".format(
+            names=', '.join(sorted(unknown)),
+            known=', '.join(suite.BENCHMARKS),
+        ))
+        
+    started = int(time.time())
+    results = suite.run(args.benchmarks, args.repetitions, args.seed)
+    report = json.dumps(collections.OrderedDict((
+        ('started', started),
+        ('revision', _get_revision()),
+        ('python', platform.python_version()),
+        ('numpy', numpy.__version__),
+        ('dataset', suite.describe_dataset()),
+        ('results', results),
+    )), indent=4, separators=(',', ': '))
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(report)
+            output.write('\n')
+    else:
+        print(report)
+        
+    if args.baseline:
+        _compare(results, json.loads(open(args.baseline).read()))
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+"""
+Compares the item page's original pure-Python analytics with the NumPy
+analytics module over synthetic 28-day histories.
+
+Usage: benchmarks/analytics.py [items [prices-per-item]]
+"""
+import collections
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from ffxiv_market import analytics
+
+_DAYS = 28
+_DATA_POINTS = 168
+
+_ONE_MINUTE = 60
+_ONE_HOUR = _ONE_MINUTE * 60
+_ONE_DAY = _ONE_HOUR * 24
+_ONE_WEEK = _ONE_DAY * 7
+_ONE_MONTH = _ONE_WEEK * 4
+
+ItemPrice = collections.namedtuple('Price', ['timestamp', 'value', 'reporter', 'flagged'])
+
+#The analysis ItemHandler used to run, unchanged but for being lifted out of the class
+def _legacy_normalise_data(price_data, current_time):
+    data_points = _DATA_POINTS
+    timescale = int(_ONE_DAY * _DAYS / float(data_points))
+    
+    ages = collections.defaultdict(list)
+    for price in price_data:
+        age = int((current_time - price.timestamp) / timescale)
+        if age >= data_points: #Data is too old to be relevant
+            break
+        ages[age].append(price.value)
+        
+    prices = []
+    for (age, pricing) in sorted(ages.items()):
+        prices.append((age, int((max(pricing) + min(pricing)) / 2)))
+    return (prices, timescale)
+    
+def _legacy_compute_maxmin(price_data, current_time):
+    low_24h = low_week = low_month = None
+    low_24h_value = low_week_value = low_month_value = 999999999
+    high_24h = high_week = high_month = None
+    high_24h_value = high_week_value = high_month_value = 0
+    
+    timestamp_cutoff_month = current_time - _ONE_MONTH
+    timestamp_cutoff_week = current_time - _ONE_WEEK
+    timestamp_cutoff_24h = current_time - _ONE_DAY
+    
+    for datum in price_data:
+        datum_value = datum.value
+        datum_timestamp = datum.timestamp
+        if datum_timestamp >= timestamp_cutoff_month:
+            if datum_timestamp >= timestamp_cutoff_week:
+                if datum_timestamp >= timestamp_cutoff_24h:
+                    if datum_value < low_24h_value:
+                        low_24h = datum
+                        low_24h_value = datum_value
+                    elif datum_value > high_24h_value:
+                        high_24h = datum
+                        high_24h_value = datum_value
+                if datum_value < low_week_value:
+                    low_week = datum
+                    low_week_value = datum_value
+                elif datum_value > high_week_value:
+                    high_week = datum
+                    high_week_value = datum_value
+            if datum_value < low_month_value:
+                low_month = datum
+                low_month_value = datum_value
+            elif datum_value > high_month_value:
+                high_month = datum
+                high_month_value = datum_value
+        else:
+            break
+            
+    return (
+        low_24h, low_week, low_month,
+        high_24h, high_week, high_month,
+    )
+    
+def _legacy_compute_timeblock_averages(normalised_data, normalised_data_timescale):
+    slices_per_day = int((3600.0 * 24) / normalised_data_timescale)
+    
+    days = collections.defaultdict(list)
+    for datum in normalised_data:
+        days[int(datum[0] / slices_per_day)].append(datum[1])
+    weeks = collections.defaultdict(list)
+    for (day, prices) in days.iteritems():
+        weeks[int(day / 7)].append(int(sum(prices) / len(prices)))
+        
+    return (days, weeks)
+    
+def _legacy_compute_averages(timeblock_days, timeblock_weeks):
+    return (
+        0 in timeblock_days and int(sum(timeblock_days[0]) / len(timeblock_days[0])) or None,
+        0 in timeblock_weeks and int(sum(timeblock_weeks[0]) / len(timeblock_weeks[0])) or None,
+        int(sum(int(sum(prices) / len(prices)) for prices in timeblock_weeks.values()) / len(timeblock_weeks)),
+    )
+    
+def _legacy_compute_trends(normalised_data, timeblock_days, timeblock_weeks):
+    if 0 in timeblock_weeks and 1 in timeblock_weeks:
+        current_weekly_average = sum(timeblock_weeks[0]) / len(timeblock_weeks[0])
+        previous_weekly_average = sum(timeblock_weeks[1]) / len(timeblock_weeks[1])
+        trend_weekly = (current_weekly_average / float(previous_weekly_average)) - 1
+    else:
+        trend_weekly = None
+        
+    if 0 in timeblock_days and 1 in timeblock_days:
+        current_daily_average = sum(timeblock_days[0]) / len(timeblock_days[0])
+        previous_daily_average = sum(timeblock_days[1]) / len(timeblock_days[1])
+        trend_daily = (current_daily_average / float(previous_daily_average)) - 1
+    else:
+        trend_daily = None
+        
+    if len(normalised_data) > 1 and normalised_data[0][0] == 0 and normalised_data[1][0] == 1:
+        trend_current = (normalised_data[0][1] / float(normalised_data[1][1])) - 1        
+    else:
+        trend_current = None
+        
+    return (trend_current, trend_daily, trend_weekly)
+    
+def _legacy_pad(normalised_data):
+    #Reverse the data and pad holes
+    next_data_slice = normalised_data[-1][0]
+    last_value = None
+    new_normalised_data = []
+    for i in xrange(167, -1, -1):
+        if next_data_slice == i:
+            last_value = normalised_data.pop()[1]
+            if last_value == 0:
+                last_value = None
+            new_normalised_data.append(last_value)
+            if normalised_data:
+                next_data_slice = normalised_data[-1][0]
+            else:
+                new_normalised_data.extend(last_value for n in xrange(i))
+                break
+        else:
+            new_normalised_data.append(last_value)
+    return new_normalised_data
+    
+def _legacy_analyse(price_data, current_time):
+    (normalised_data, normalised_data_timescale) = _legacy_normalise_data(price_data, current_time)
+    if normalised_data:
+        _legacy_compute_maxmin(price_data, current_time)
+        (timeblock_days, timeblock_weeks) = _legacy_compute_timeblock_averages(normalised_data, normalised_data_timescale)
+        _legacy_compute_averages(timeblock_days, timeblock_weeks)
+        _legacy_compute_trends(normalised_data, timeblock_days, timeblock_weeks)
+    if len(normalised_data) > 1:
+        _legacy_pad(normalised_data)
+        
+def _analyse(timestamps, values, current_time, timescale):
+    result = analytics.analyse(analytics.reduce(timestamps, values, timescale), current_time, timescale, _DATA_POINTS)
+    if len(result.normalised_data) > 1:
+        analytics.pad(result.normalised_data, _DATA_POINTS)
+        
+def _generate_history(current_time, count):
+    timestamps = sorted((current_time - random.randint(0, _DAYS * _ONE_DAY) for i in xrange(count)), reverse=True)
+    return [ItemPrice(timestamp, random.randint(0, 50000), None, False) for timestamp in timestamps]
+    
+def _time(label, func, repetitions=3):
+    best = None
+    for i in xrange(repetitions):
+        start = time.time()
+        func()
+        duration = time.time() - start
+        best = best is None and duration or min(best, duration)
+    print("{label}: {duration:.4f}s".format(label=label, duration=best))
+    return best
+    
+if __name__ == '__main__':
+    items = len(sys.argv) >= 2 and int(sys.argv[1]) or 500
+    prices_per_item = len(sys.argv) >= 3 and int(sys.argv[2]) or 1000
+    random.seed(0)
+    current_time = int(time.time())
+    timescale = analytics.get_timescale(_DAYS, _DATA_POINTS)
+    
+    histories = [_generate_history(current_time, prices_per_item) for i in xrange(items)]
+    arrays = [
+        ([price.timestamp for price in history], [price.value for price in history])
+        for history in histories
+    ]
+    print("{items} items, {prices} prices each".format(items=items, prices=prices_per_item))
+    
+    legacy = _time("legacy, per item", lambda: [_legacy_analyse(history, current_time) for history in histories])
+    numpy_single = _time("numpy, per item", lambda: [_analyse(t, v, current_time, timescale) for (t, v) in arrays])
+    numpy_batch = _time("numpy, batched", lambda: analytics.analyse_many(arrays, current_time, timescale, _DATA_POINTS))
+    print("speed-up: {single:.1f}x per item, {batch:.1f}x batched".format(
+        single=(legacy / numpy_single),
+        batch=(legacy / numpy_batch),
+    ))
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+"""
+Compares the item cache's lock-free snapshots with the reader/writer lock
+they replaced, with reader threads looking items up in page-sized batches
+while writer threads record prices.
+
+Usage: benchmarks/cache_contention.py [readers [writers [seconds]]]
+"""
+import os
+import random
+import sys
+import threading
+import time
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from ffxiv_market import cache
+from ffxiv_market.cache import (
+    ItemName, ItemPrice, ItemRef, ItemState,
+)
+
+_ITEMS = 10000
+_LOOKUPS_PER_PAGE = 50
+
+#The lock and cache the snapshots replaced, unchanged but for being lifted out of db.py
+class _WritePriorityLock(object):
+    def __init__(self):
+        self._lock = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        
+    def read_start(self):
+        with self._lock:
+            while self._writer:
+                self._lock.wait()
+            self._readers += 1
+            
+    def read_stop(self):
+        with self._lock:
+            self._readers -= 1
+            if not self._readers:
+                self._lock.notify_all()
+                
+    def write_start(self):
+        self._lock.acquire()
+        self._writer = True
+        while self._readers:
+            self._lock.wait()
+            
+    def write_stop(self):
+        self._writer = False
+        self._lock.notify_all()
+        self._lock.release()
+        
+class _LegacyCache(object):
+    _lock = None
+    _columns = None
+    _name_rows = None
+    _names = None
+    
+    version = 0
+    
+    def __init__(self, item_data):
+        self._lock = _WritePriorityLock()
+        
+        item_states = []
+        averages = []
+        for item_ref in item_data:
+            item_states.append(item_ref.item_state)
+            averages.append(cache.NO_PRICE if item_ref.average is None else item_ref.average)
+        self._columns = cache.Columns(
+            numpy.array([i.id for i in item_states], dtype=numpy.int64),
+            numpy.array([i.hq for i in item_states], dtype=numpy.bool_),
+            numpy.array([i.price.timestamp if i.price else cache.NO_PRICE for i in item_states], dtype=numpy.int64),
+            numpy.array([i.price.value if i.price else cache.NO_PRICE for i in item_states], dtype=numpy.int64),
+            numpy.array(averages, dtype=numpy.int64),
+            numpy.zeros(len(item_states), dtype=numpy.int64),
+        )
+        
+        name_positions = {}
+        self._names = ItemName(*([] for language in ItemName._fields))
+        for item_state in item_states:
+            if item_state.name not in name_positions:
+                name_positions[item_state.name] = len(name_positions)
+                for (table, name) in zip(self._names, item_state.name):
+                    table.append(intern(name))
+        self._name_rows = numpy.array([name_positions[i.name] for i in item_states], dtype=numpy.int32)
+        
+    def _find_row(self, item_id):
+        row = int(numpy.searchsorted(self._columns.ids, item_id))
+        if row < len(self._columns.ids) and self._columns.ids[row] == item_id:
+            return row
+        return None
+        
+    def _materialise(self, row):
+        columns = self._columns
+        name_row = self._name_rows[row]
+        price = None
+        if columns.timestamps[row] != cache.NO_PRICE:
+            price = ItemPrice(int(columns.timestamps[row]), int(columns.values[row]), None, False)
+        average = int(columns.averages[row])
+        return ItemRef(
+            ItemState(
+                ItemName(*(table[name_row] for table in self._names)),
+                int(columns.ids[row]), bool(columns.hq[row]), price,
+            ),
+            None if average == cache.NO_PRICE else average,
+        )
+        
+    def update(self, item_id, timestamp, value, average):
+        self._lock.write_start()
+        try:
+            row = self._find_row(item_id)
+            self._columns.timestamps[row] = timestamp
+            self._columns.values[row] = value
+            self._columns.averages[row] = cache.NO_PRICE if average is None else average
+            self.version += 1
+        finally:
+            self._lock.write_stop()
+            
+    def get_item_by_id(self, item_id):
+        self._lock.read_start()
+        try:
+            row = self._find_row(item_id)
+            if row is None:
+                return None
+            return self._materialise(row)
+        finally:
+            self._lock.read_stop()
+            
+def _generate_items(count):
+    item_refs = []
+    for item_id in xrange(1, count + 1):
+        name = 'Item {id}'.format(id=(item_id + 1) // 2)
+        price = None
+        if random.random() < 0.8:
+            price = ItemPrice(1500000000 + random.randint(0, 86400 * 28), random.randint(0, 50000), None, False)
+        item_refs.append(ItemRef(
+            ItemState(ItemName(name, name, name, name), item_id, not item_id % 2, price),
+            price and price.value,
+        ))
+    return item_refs
+    
+def _run(item_cache, readers, writers, seconds):
+    """
+    Returns the pages read and prices written per second, and the 99th
+    percentile time to read a page.
+    """
+    stop = threading.Event()
+    pages = [[] for i in xrange(readers)]
+    prices = [0] * writers
+    def read(index):
+        local = random.Random(index)
+        while not stop.is_set():
+            start = time.time()
+            for i in xrange(_LOOKUPS_PER_PAGE):
+                item_cache.get_item_by_id(local.randint(1, _ITEMS))
+            pages[index].append(time.time() - start)
+    def write(index):
+        local = random.Random(-1 - index)
+        while not stop.is_set():
+            value = local.randint(0, 50000)
+            item_cache.update(local.randint(1, _ITEMS), int(time.time()), value, value)
+            prices[index] += 1
+            
+    threads = [threading.Thread(target=read, args=(i,)) for i in xrange(readers)]
+    threads.extend(threading.Thread(target=write, args=(i,)) for i in xrange(writers))
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    durations = sorted(duration for durations in pages for duration in durations)
+    return (
+        len(durations) / float(seconds), sum(prices) / float(seconds),
+        durations and durations[int(len(durations) * 0.99)] or 0.0,
+    )
+    
+if __name__ == '__main__':
+    readers = int(sys.argv[1]) if len(sys.argv) >= 2 else 8
+    writers = int(sys.argv[2]) if len(sys.argv) >= 3 else 2
+    seconds = float(sys.argv[3]) if len(sys.argv) >= 4 else 5.0
+    random.seed(0)
+    item_refs = _generate_items(_ITEMS)
+    print("{items} items; {readers} readers of {lookups} lookups per page, {writers} writers, {seconds}s each".format(
+        items=_ITEMS,
+        readers=readers,
+        lookups=_LOOKUPS_PER_PAGE,
+        writers=writers,
+        seconds=seconds,
+    ))
+    
+    results = []
+    for (label, factory) in (("reader/writer lock", _LegacyCache), ("snapshots", cache.Cache)):
+        (pages, prices, latency) = _run(factory(item_refs), readers, writers, seconds)
+        print("{label}: {pages:.0f} pages/s, {prices:.0f} prices/s, p99 page {latency:.2f}ms".format(
+            label=label,
+            pages=pages,
+            prices=prices,
+            latency=(latency * 1000),
+        ))
+        results.append((pages, prices))
+    print("speed-up: {pages:.1f}x pages, {prices:.1f}x prices".format(
+        pages=(results[1][0] / (results[0][0] or 1)),
+        prices=(results[1][1] / (results[0][1] or 1)),
+    ))
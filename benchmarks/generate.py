@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Fills an empty database with a synthetic market shaped like production's:
+the real catalogue from data/items.sql, prices piled onto a minority of
+popular items over several months, and users with watchlists.
+
+Usage: python -m benchmarks.generate CONFIG [--prices N] [--users N] [--days N] [--seed N]
+
+CONFIG is a server configuration file; the database it names is the one
+filled, so point it at a scratch database, never the live one.
+"""
+import argparse
+import cStringIO
+import json
+import logging
+import os
+import time
+
+import numpy
+import psycopg2
+
+_DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+
+_CHUNK_SIZE = 100000 #Rows per COPY
+_UNPRICED = 0.3 #The share of items nobody has ever priced
+_HQ_POPULARITY = 0.3 #How often HQ items are priced, relative to their NQ counterparts
+_NO_SUPPLY = 0.02 #The share of prices recording that nothing was for sale
+_LANGUAGES = (('en', 0.6), ('ja', 0.25), ('fr', 0.07), ('de', 0.08))
+
+_logger = logging.getLogger('benchmarks.generate')
+
+def _connect(config):
+    connection = psycopg2.connect(
+        host=config['server']['postgres']['host'],
+        database=config['server']['postgres']['database'],
+        user=config['server']['postgres']['username'],
+        password=config['server']['postgres']['password'],
+    )
+    connection.set_session(autocommit=True)
+    return connection
+    
+def _load_catalogue(cursor):
+    cursor.execute("""SELECT to_regclass('base_items')""")
+    if cursor.fetchone()[0] is None:
+        _logger.info("Creating schema...")
+        cursor.execute(open(os.path.join(_DATA_PATH, 'schema.sql')).read())
+    else:
+        cursor.execute("""SELECT EXISTS(SELECT 1 FROM prices) OR EXISTS(SELECT 1 FROM users)""")
+        if cursor.fetchone()[0]:
+            raise ValueError("The database already holds prices or users; generate into an empty one")
+            
+    cursor.execute("""SELECT EXISTS(SELECT 1 FROM base_items)""")
+    if not cursor.fetchone()[0]:
+        _logger.info("Loading catalogue...")
+        cursor.execute(open(os.path.join(_DATA_PATH, 'items.sql')).read())
+        
+    cursor.execute("""SELECT items.id, items.hq
+        FROM items
+        ORDER BY items.id ASC""")
+    rows = cursor.fetchall()
+    return (
+        numpy.array([item_id for (item_id, hq) in rows], dtype=numpy.int64),
+        numpy.array([hq for (item_id, hq) in rows], dtype=numpy.bool_),
+    )
+    
+def _popularity(rng, count, exponent=1.1):
+    """
+    Returns Zipf-like weights for `count` things, in random order.
+    """
+    return (rng.permutation(count) + 1.0) ** -exponent
+    
+def _copy(cursor, table, columns, rows):
+    """
+    Streams `rows`, tuples of values already formatted for COPY, into
+    `table` in chunks.
+    """
+    count = 0
+    chunk = cStringIO.StringIO()
+    for row in rows:
+        chunk.write('\t'.join(row))
+        chunk.write('\n')
+        count += 1
+        if not count % _CHUNK_SIZE:
+            chunk.seek(0)
+            cursor.copy_from(chunk, table, columns=columns)
+            chunk = cStringIO.StringIO()
+    chunk.seek(0)
+    cursor.copy_from(chunk, table, columns=columns)
+    return count
+    
+def _generate_users(cursor, rng, count):
+    languages = rng.choice([l for (l, share) in _LANGUAGES], size=count, p=[share for (l, share) in _LANGUAGES])
+    _copy(cursor, 'users', ('name', 'password_hash', 'password_salt', 'anonymous', 'status', 'language'), (
+        ('user-{number}'.format(number=number), '-', '-', 'false', '1', language)
+        for (number, language) in enumerate(languages.tolist())
+    ))
+    cursor.execute("""SELECT users.id
+        FROM users
+        ORDER BY users.id ASC""")
+    return numpy.array([user_id for (user_id,) in cursor.fetchall()], dtype=numpy.int64)
+    
+def _generate_prices(cursor, rng, item_ids, item_weights, user_ids, count, days):
+    current_time = int(time.time())
+    span = days * 86400
+    
+    items = rng.choice(len(item_ids), size=count, p=(item_weights / item_weights.sum()))
+    offsets = rng.randint(0, span, size=count)
+    #Each item's price is recorded once a second at most
+    keys = numpy.unique(items * span + offsets)
+    (items, offsets) = (keys // span, keys % span)
+    
+    #Every item hovers around its own price, with the odd empty market
+    base_values = numpy.exp(rng.normal(7.5, 1.8, size=len(item_ids)))
+    values = numpy.clip(base_values[items] * numpy.exp(rng.normal(0, 0.15, size=len(items))), 1, 2 ** 31 - 1).astype(numpy.int64)
+    values[rng.random_sample(len(items)) < _NO_SUPPLY] = 0
+    user_weights = _popularity(rng, len(user_ids))
+    users = user_ids[rng.choice(len(user_ids), size=len(items), p=(user_weights / user_weights.sum()))]
+    timestamps = numpy.datetime_as_string((current_time - span + offsets).astype('datetime64[s]'))
+    
+    return _copy(cursor, 'prices', ('item_id', 'ts', 'value', 'submitting_user'), (
+        (str(item_id), ts, str(value), str(user_id))
+        for (item_id, ts, value, user_id) in zip(
+            item_ids[items].tolist(), timestamps.tolist(), values.tolist(), users.tolist(),
+        )
+    ))
+    
+def _generate_watchlists(cursor, rng, item_ids, item_weights, user_ids, limit):
+    p = item_weights / item_weights.sum()
+    def entries():
+        for user_id in user_ids.tolist():
+            for item in numpy.unique(rng.choice(len(item_ids), size=rng.randint(0, limit + 1), p=p)).tolist():
+                yield (str(user_id), str(item_ids[item]))
+    return _copy(cursor, 'watchlist', ('user_id', 'item_id'), entries())
+    
+def generate(config, prices, users, days, seed):
+    rng = numpy.random.RandomState(seed)
+    connection = _connect(config)
+    try:
+        cursor = connection.cursor()
+        (item_ids, hq) = _load_catalogue(cursor)
+        
+        item_weights = _popularity(rng, len(item_ids))
+        item_weights[hq] *= _HQ_POPULARITY
+        item_weights[rng.random_sample(len(item_ids)) < _UNPRICED] = 0
+        
+        _logger.info("Generating {count} users...".format(count=users))
+        user_ids = _generate_users(cursor, rng, users)
+        _logger.info("Generating {count} prices over {days} days...".format(count=prices, days=days))
+        price_count = _generate_prices(cursor, rng, item_ids, item_weights, user_ids, prices, days)
+        _logger.info("Generating watchlists...")
+        watch_count = _generate_watchlists(cursor, rng, item_ids, item_weights, user_ids, config['lists']['item_watch']['limit'])
+        
+        _logger.info("Analysing...")
+        cursor.execute("""ANALYZE""")
+        _logger.info("Generated {prices} prices, {users} users and {watches} watchlist entries".format(
+            prices=price_count,
+            users=len(user_ids),
+            watches=watch_count,
+        ))
+    finally:
+        connection.close()
+        
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Fill an empty database with a synthetic market.")
+    parser.add_argument('config', help="the server configuration naming the database to fill")
+    parser.add_argument('--prices', type=int, default=3000000, help="prices to generate, before duplicates are dropped")
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--days', type=int, default=180, help="how far back prices go")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s:%(levelname)s:%(name)s:%(message)s")
+    generate(json.loads(open(args.config).read()), args.prices, args.users, args.days, args.seed)
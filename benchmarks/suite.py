@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+The benchmarks themselves. Importing this loads the site's cache from the
+configured database, so CONFIG must be installed first.
+
+Each benchmark is a setup function, given a seeded random.Random, that
+returns the callable to time; setup isn't timed.
+"""
+import collections
+import os
+import random
+import tempfile
+import time
+import timeit
+
+from ffxiv_market import cache
+from ffxiv_market import search
+from ffxiv_market import snapshot
+from ffxiv_market.analytics import pad
+from ffxiv_market.common import CONFIG
+from ffxiv_market.db import (
+    DATABASE,
+    ItemName,
+)
+from ffxiv_market.handlers import _common
+from ffxiv_market.handlers import items as items_handlers
+
+_ONE_DAY = 3600 * 24
+
+_LOOKUPS = 10000 #Cache lookups per repetition
+_QUERIES = 100 #Dashboard queries per repetition
+_SEARCHES = 100 #Terms typed per repetition
+_ITEM_PAGES = 20 #Items analysed per repetition
+_RENDERS = 10 #Pages rendered per repetition
+_POPULAR_ITEMS = 200 #The most-priced items, from which analysed items are drawn
+
+BENCHMARKS = collections.OrderedDict() #name: (setup, operations per repetition)
+
+def _benchmark(name, operations=1):
+    def register(setup):
+        BENCHMARKS[name] = (setup, operations)
+        return setup
+    return register
+    
+class _Page(_common.Handler):
+    """
+    Just enough of a handler to build the common context pages render with.
+    """
+    def __init__(self):
+        pass
+        
+_user_id = None
+def _get_context(page_title=None):
+    """
+    Returns the common context of an active, English-speaking user.
+    """
+    global _user_id
+    if _user_id is None:
+        with DATABASE._pool.get_cursor() as cursor:
+            cursor.execute("""SELECT users.id
+                FROM users
+                WHERE users.language = 'en'
+                ORDER BY users.id ASC
+                LIMIT 1""")
+            _user_id = cursor.fetchone()[0]
+    page = _Page()
+    return page._make_common_context(
+        page._format_identity(_user_id, DATABASE.users_get_identity(_user_id)), 0, page_title=page_title,
+    )
+    
+_popular_items = None
+def _get_popular_items():
+    global _popular_items
+    if _popular_items is None:
+        with DATABASE._pool.get_cursor() as cursor:
+            cursor.execute("""SELECT prices.item_id
+                FROM prices
+                GROUP BY prices.item_id
+                ORDER BY COUNT(*) DESC
+                LIMIT %(limit)s""", {
+                'limit': _POPULAR_ITEMS,
+            })
+            _popular_items = [item_id for (item_id,) in cursor.fetchall()]
+    return _popular_items
+    
+def _analyse_item(item_id, current_time):
+    """
+    The ItemHandler's path from an item to its prices, graph and statistics.
+    """
+    price_data = DATABASE.items_get_prices(item_id, limit=1000, max_age=(current_time - (CONFIG['graphing']['days'] * _ONE_DAY)))
+    analytics = DATABASE.items_get_analytics(item_id, current_time)
+    normalised_data = None
+    if len(analytics.normalised_data) > 1:
+        normalised_data = pad(analytics.normalised_data, CONFIG['graphing']['data_points'])
+    return (price_data, analytics, normalised_data)
+    
+@_benchmark('warmup.database')
+def _warmup_database(rng):
+    def warm_up():
+        item_cache = cache.Cache(DATABASE._get_cache_data())
+        search.NameIndex(item_cache.query(list), ItemName._fields)
+    return warm_up
+    
+_snapshot_path = None
+@_benchmark('warmup.snapshot')
+def _warmup_snapshot(rng):
+    global _snapshot_path
+    if _snapshot_path is None:
+        (descriptor, _snapshot_path) = tempfile.mkstemp(prefix='ffxiv-market-benchmark-')
+        os.close(descriptor)
+    snapshot.write(_snapshot_path, DATABASE._cache.query(list), DATABASE._catalogue_digest, time.time())
+    def warm_up():
+        item_cache = cache.Cache(DATABASE._get_snapshot_cache_data(_snapshot_path))
+        search.NameIndex(item_cache.query(list), ItemName._fields)
+    return warm_up
+    
+def _register_query(name, panel):
+    query = dict(items_handlers._SHARED_PANELS)[panel]
+    @_benchmark('query.{name}'.format(name=name), _QUERIES)
+    def _query(rng):
+        current_time = int(time.time())
+        def run():
+            for i in xrange(_QUERIES):
+                query(current_time)
+        return run
+for (name, panel) in (
+    ('no_supply', 'nst'),
+    ('stale', 'sta'),
+    ('most_valuable', 'val'),
+    ('recently_updated', 'rec'),
+):
+    _register_query(name, panel)
+    
+@_benchmark('cache.get_item_by_id', _LOOKUPS)
+def _cache_get_item_by_id(rng):
+    item_ids = DATABASE._cache.query(lambda item_refs: [i.item_state.id for i in item_refs])
+    lookups = [rng.choice(item_ids) for i in xrange(_LOOKUPS)]
+    def run():
+        for item_id in lookups:
+            DATABASE.items_get_latest_by_id(item_id)
+    return run
+    
+@_benchmark('items_search', _SEARCHES)
+def _items_search(rng):
+    """
+    Types part of a random name into autocomplete, a letter at a time.
+    """
+    names = DATABASE._cache.query(lambda item_refs: [i.item_state.name for i in item_refs])
+    keystrokes = []
+    for i in xrange(_SEARCHES):
+        language = rng.choice(ItemName._fields)
+        name = getattr(rng.choice(names), language).decode('utf-8')
+        start = rng.randint(0, max(0, len(name) - 3))
+        term = name[start:start + rng.randint(3, 8)]
+        keystrokes.extend((language, term[:length].encode('utf-8')) for length in xrange(1, len(term) + 1))
+    limit = CONFIG['lists']['search']['limit']
+    def run():
+        for (language, term) in keystrokes:
+            DATABASE.items_search(language=language, filter=term, limit=limit)
+    return run
+    
+@_benchmark('analytics.cold', _ITEM_PAGES)
+def _analytics_cold(rng):
+    """
+    Item pages whose rollups have to be loaded.
+    """
+    item_ids = rng.sample(_get_popular_items(), _ITEM_PAGES)
+    for item_id in item_ids:
+        DATABASE._rollups.invalidate(item_id)
+    current_time = int(time.time())
+    def run():
+        for item_id in item_ids:
+            _analyse_item(item_id, current_time)
+    return run
+    
+@_benchmark('analytics.warm', _ITEM_PAGES)
+def _analytics_warm(rng):
+    """
+    Item pages whose rollups are already in memory.
+    """
+    item_ids = rng.sample(_get_popular_items(), _ITEM_PAGES)
+    current_time = int(time.time())
+    for item_id in item_ids:
+        DATABASE.items_get_analytics(item_id, current_time)
+    def run():
+        for item_id in item_ids:
+            _analyse_item(item_id, current_time)
+    return run
+    
+@_benchmark('render.items', _RENDERS)
+def _render_items(rng):
+    """
+    The dashboard with none of its panels' fragments cached.
+    """
+    context = _get_context(page_title="Items")
+    current_time = context['rendering']['time_current']
+    panels = [(panel, query(current_time)) for (panel, query) in items_handlers._SHARED_PANELS]
+    panels.append(('mwt', DATABASE.watchlist_get_most_watched(limit=CONFIG['lists']['item_watch']['limit'])))
+    context['rendering']['html_headers'].extend(items_handlers._build_items_context(context))
+    def run():
+        for i in xrange(_RENDERS):
+            context['panels'] = dict(
+                (panel, _common._MAKO_ENGINE.render_def('formatting.mako', 'render_item_list', item_refs, panel, **context))
+                for (panel, item_refs) in panels
+            )
+            _common._MAKO_ENGINE.render_page('items.html', **context)
+    return run
+    
+@_benchmark('render.item', _RENDERS)
+def _render_item(rng):
+    """
+    A popular item's page, with its full price table and graph.
+    """
+    context = _get_context()
+    current_time = context['rendering']['time_current']
+    item_id = rng.choice(_get_popular_items())
+    item_properties = DATABASE.items_get_properties(language='en', item_id=item_id)
+    (price_data, analytics, normalised_data) = _analyse_item(item_id, current_time)
+    context['rendering']['html_headers'].extend(items_handlers._build_item_context(
+        context, item_id, item_properties, price_data, analytics,
+    ))
+    def run():
+        for i in xrange(_RENDERS):
+            _common._MAKO_ENGINE.render_page('item.html', **context)
+    return run
+    
+def describe_dataset():
+    """
+    Returns the size of the data the benchmarks ran against.
+    """
+    with DATABASE._pool.get_cursor() as cursor:
+        cursor.execute("""SELECT
+            (SELECT COUNT(*) FROM items),
+            (SELECT COUNT(DISTINCT prices.item_id) FROM prices),
+            (SELECT COUNT(*) FROM prices),
+            (SELECT COUNT(*) FROM users),
+            (SELECT COUNT(*) FROM watchlist)""")
+        (items, priced_items, prices, users, watches) = cursor.fetchone()
+    return {
+        'items': items,
+        'priced_items': priced_items,
+        'prices': prices,
+        'users': users,
+        'watchlist_entries': watches,
+    }
+    
+def run(names, repetitions, seed):
+    """
+    Runs the named benchmarks, or all of them, returning {name: timings}
+    with every time in seconds.
+    """
+    results = collections.OrderedDict()
+    try:
+        for (name, (setup, operations)) in BENCHMARKS.iteritems():
+            if names and name not in names:
+                continue
+            rng = random.Random('{seed}:{name}'.format(seed=seed, name=name))
+            durations = []
+            for i in xrange(repetitions):
+                func = setup(rng)
+                start = timeit.default_timer()
+                func()
+                durations.append(timeit.default_timer() - start)
+            durations.sort()
+            results[name] = collections.OrderedDict((
+                ('operations', operations),
+                ('repetitions', repetitions),
+                ('min', durations[0]),
+                ('median', durations[len(durations) // 2]),
+                ('mean', sum(durations) / len(durations)),
+                ('per_operation', durations[0] / operations),
+            ))
+    finally:
+        if _snapshot_path is not None:
+            os.remove(_snapshot_path)
+    return results
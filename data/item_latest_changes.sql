@@ -0,0 +1,85 @@
+--Has item_latest record when each item's latest price changed, and which
+--items were left with none, so a restored snapshot need only read what
+--changed since it was written. Run it once, with the server stopped, on a
+--database that already has item_latest; snapshots written before it are
+--discarded on the next start.
+BEGIN;
+
+ALTER TABLE item_latest
+    ADD COLUMN changed TIMESTAMP NOT NULL DEFAULT (CLOCK_TIMESTAMP() AT TIME ZONE 'utc'); --When ts and value last changed
+CREATE INDEX item_latest_changed ON item_latest(changed);
+
+--Items whose last price was deleted, and when, since item_latest no longer
+--holds a row to tell a restored snapshot about them
+CREATE TABLE item_latest_removed(
+    item_id INTEGER PRIMARY KEY REFERENCES items(id) ON DELETE CASCADE,
+    changed TIMESTAMP NOT NULL DEFAULT (CLOCK_TIMESTAMP() AT TIME ZONE 'utc')
+);
+
+CREATE OR REPLACE FUNCTION item_latest_prices_inserted() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT
+        INTO item_latest (item_id, ts, value)
+        SELECT DISTINCT ON (inserted.item_id) inserted.item_id, inserted.ts, inserted.value
+        FROM inserted
+        ORDER BY inserted.item_id, inserted.ts DESC
+        ON CONFLICT (item_id) DO UPDATE
+        SET ts = EXCLUDED.ts, value = EXCLUDED.value, changed = EXCLUDED.changed
+        WHERE EXCLUDED.ts >= item_latest.ts;
+    PERFORM item_latest_average(ARRAY(SELECT DISTINCT inserted.item_id FROM inserted));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION item_latest_prices_deleted() RETURNS TRIGGER AS $$
+DECLARE
+    item_ids INTEGER[];
+BEGIN
+    --Items whose latest price went, which fall back on their next latest,
+    --possibly one that's expired into prices_hourly
+    item_ids := ARRAY(
+        SELECT item_latest.item_id
+        FROM item_latest, deleted
+        WHERE item_latest.item_id = deleted.item_id
+          AND item_latest.ts = deleted.ts
+    );
+    IF CARDINALITY(item_ids) > 0 THEN
+        DELETE
+            FROM item_latest
+            WHERE item_latest.item_id = ANY(item_ids);
+        INSERT
+            INTO item_latest (item_id, ts, value)
+            SELECT DISTINCT ON (history.item_id) history.item_id, history.ts, history.value
+            FROM (
+                SELECT prices.item_id, prices.ts, prices.value
+                FROM prices
+                WHERE prices.item_id = ANY(item_ids)
+                UNION ALL
+                SELECT prices_hourly.item_id, prices_hourly.last_ts, prices_hourly.last_value
+                FROM prices_hourly
+                WHERE prices_hourly.item_id = ANY(item_ids)
+            ) AS history
+            ORDER BY history.item_id, history.ts DESC;
+        INSERT
+            INTO item_latest_removed (item_id)
+            SELECT UNNEST(item_ids)
+            EXCEPT
+            SELECT item_latest.item_id
+            FROM item_latest
+            WHERE item_latest.item_id = ANY(item_ids)
+            ON CONFLICT (item_id) DO UPDATE
+            SET changed = EXCLUDED.changed;
+    END IF;
+    --Expiry deletes far too long ago to change any averages
+    PERFORM item_latest_average(ARRAY(
+        SELECT DISTINCT deleted.item_id
+        FROM deleted
+        WHERE deleted.ts > DATE_TRUNC('second', NOW() AT TIME ZONE 'utc') - INTERVAL '24 hours'
+        UNION
+        SELECT UNNEST(item_ids)
+    ));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+COMMIT;
@@ -0,0 +1,64 @@
+--Converts a database created before prices were partitioned by month and
+--summarised once they expire. Run it once, with the server stopped; it needs
+--PostgreSQL 12 or later, for flags to reference a partitioned table.
+BEGIN;
+
+ALTER TABLE flags DROP CONSTRAINT flags_price_item_id_price_ts_fkey;
+ALTER TABLE prices RENAME TO prices_unpartitioned;
+ALTER TABLE prices_unpartitioned RENAME CONSTRAINT prices_pkey TO prices_unpartitioned_pkey;
+DROP INDEX idx_prices_ts;
+
+CREATE TABLE prices(
+    item_id INTEGER NOT NULL REFERENCES items(id) ON DELETE CASCADE,
+    ts TIMESTAMP DEFAULT DATE_TRUNC('second', NOW() AT TIME ZONE 'utc') NOT NULL,
+    value INTEGER NOT NULL,
+    submitting_user INTEGER NOT NULL REFERENCES users(id),
+    PRIMARY KEY (item_id, ts)
+) PARTITION BY RANGE (ts);
+CREATE TABLE prices_default PARTITION OF prices DEFAULT;
+CREATE INDEX idx_prices_ts ON prices(ts);
+
+--A partition for every month with prices, named as the server names them
+DO $$
+DECLARE
+    month TIMESTAMP;
+BEGIN
+    FOR month IN SELECT GENERATE_SERIES(
+            DATE_TRUNC('month', COALESCE(MIN(prices_unpartitioned.ts), NOW() AT TIME ZONE 'utc')),
+            DATE_TRUNC('month', NOW() AT TIME ZONE 'utc'),
+            '1 month')
+        FROM prices_unpartitioned
+    LOOP
+        EXECUTE FORMAT('CREATE TABLE %I PARTITION OF prices FOR VALUES FROM (%L) TO (%L)',
+            TO_CHAR(month, '"prices_y"YYYY"m"MM'), month, month + INTERVAL '1 month');
+    END LOOP;
+END
+$$;
+
+INSERT INTO prices (item_id, ts, value, submitting_user)
+    SELECT prices_unpartitioned.item_id, prices_unpartitioned.ts, prices_unpartitioned.value, prices_unpartitioned.submitting_user
+    FROM prices_unpartitioned;
+DROP TABLE prices_unpartitioned;
+
+ALTER TABLE flags ADD CONSTRAINT flags_price_item_id_price_ts_fkey
+    FOREIGN KEY (price_item_id, price_ts) REFERENCES prices(item_id, ts) ON DELETE CASCADE;
+
+CREATE TABLE prices_hourly(
+    item_id INTEGER NOT NULL REFERENCES items(id) ON DELETE CASCADE,
+    hour TIMESTAMP NOT NULL,
+    count INTEGER NOT NULL,
+    low_ts TIMESTAMP NOT NULL,
+    low_value INTEGER NOT NULL,
+    high_ts TIMESTAMP NOT NULL,
+    high_value INTEGER NOT NULL,
+    last_ts TIMESTAMP NOT NULL,
+    last_value INTEGER NOT NULL,
+    PRIMARY KEY (item_id, hour)
+);
+
+CREATE TABLE prices_expired_counts(
+    user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    count INTEGER NOT NULL
+);
+
+COMMIT;
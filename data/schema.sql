@@ -41,14 +41,162 @@ CREATE TABLE user_interactions(
     comment TEXT NOT NULL
 );
 
+--Partitioned by month; the server's maintenance adds partitions ahead of time
+--and drops expired ones. Anything outside them lands in prices_default.
 CREATE TABLE prices(
     item_id INTEGER NOT NULL REFERENCES items(id) ON DELETE CASCADE,
     ts TIMESTAMP DEFAULT DATE_TRUNC('second', NOW() AT TIME ZONE 'utc') NOT NULL,
     value INTEGER NOT NULL,
     submitting_user INTEGER NOT NULL REFERENCES users(id),
     PRIMARY KEY (item_id, ts)
+) PARTITION BY RANGE (ts);
+CREATE TABLE prices_default PARTITION OF prices DEFAULT;
+--Lets a restart catch up on prices submitted after the cache snapshot was written
+CREATE INDEX idx_prices_ts ON prices(ts);
+
+--Prices older than data.prices.retention_days, summarised by the hour once
+--the raw rows are dropped: the lowest, highest and last price, with when
+--each was submitted, which is all the site's analytics need
+CREATE TABLE prices_hourly(
+    item_id INTEGER NOT NULL REFERENCES items(id) ON DELETE CASCADE,
+    hour TIMESTAMP NOT NULL,
+    count INTEGER NOT NULL,
+    low_ts TIMESTAMP NOT NULL,
+    low_value INTEGER NOT NULL,
+    high_ts TIMESTAMP NOT NULL,
+    high_value INTEGER NOT NULL,
+    last_ts TIMESTAMP NOT NULL,
+    last_value INTEGER NOT NULL,
+    PRIMARY KEY (item_id, hour)
+);
+
+--How many of each user's prices have been summarised away
+CREATE TABLE prices_expired_counts(
+    user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    count INTEGER NOT NULL
+);
+
+--The average price of each of item_ids over the 12 hours to end_ts: the mean
+--midpoint of its three-hour slices' lowest and highest prices, other than
+--zeroes
+CREATE FUNCTION prices_averages(item_ids INTEGER[], end_ts TIMESTAMP)
+RETURNS TABLE(item_id INTEGER, average INTEGER) AS $$
+    SELECT timeslices.item_id, TRUNC(AVG(timeslices.midpoint))::INTEGER
+    FROM (
+        SELECT prices.item_id, (MAX(prices.value) + MIN(prices.value)) / 2.0 AS midpoint
+        FROM prices
+        WHERE prices.item_id = ANY(item_ids)
+          AND prices.ts < end_ts
+          AND prices.ts > end_ts - INTERVAL '12 hours'
+          AND prices.value <> 0
+        GROUP BY prices.item_id, FLOOR(EXTRACT(EPOCH FROM (end_ts - prices.ts)) / 10800)
+    ) AS timeslices
+    GROUP BY timeslices.item_id
+$$ LANGUAGE SQL STABLE;
+
+--Every priced item's latest price, expired or not, and its average as last
+--worked out: by the triggers below whenever its prices change, and by the
+--server's refresher as the average's window moves on
+CREATE TABLE item_latest(
+    item_id INTEGER PRIMARY KEY REFERENCES items(id) ON DELETE CASCADE,
+    ts TIMESTAMP NOT NULL,
+    value INTEGER NOT NULL,
+    average INTEGER,
+    changed TIMESTAMP NOT NULL DEFAULT (CLOCK_TIMESTAMP() AT TIME ZONE 'utc') --When ts and value last changed
+);
+CREATE INDEX item_latest_changed ON item_latest(changed);
+
+--Items whose last price was deleted, and when, since item_latest no longer
+--holds a row to tell a restored snapshot about them
+CREATE TABLE item_latest_removed(
+    item_id INTEGER PRIMARY KEY REFERENCES items(id) ON DELETE CASCADE,
+    changed TIMESTAMP NOT NULL DEFAULT (CLOCK_TIMESTAMP() AT TIME ZONE 'utc')
 );
 
+CREATE FUNCTION item_latest_average(item_ids INTEGER[]) RETURNS VOID AS $$
+    UPDATE item_latest
+    SET average = (
+        SELECT averages.average
+        FROM prices_averages(ARRAY[item_latest.item_id], DATE_TRUNC('second', NOW() AT TIME ZONE 'utc') - INTERVAL '12 hours') AS averages
+    )
+    WHERE item_latest.item_id = ANY(item_ids)
+$$ LANGUAGE SQL;
+
+CREATE FUNCTION item_latest_prices_inserted() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT
+        INTO item_latest (item_id, ts, value)
+        SELECT DISTINCT ON (inserted.item_id) inserted.item_id, inserted.ts, inserted.value
+        FROM inserted
+        ORDER BY inserted.item_id, inserted.ts DESC
+        ON CONFLICT (item_id) DO UPDATE
+        SET ts = EXCLUDED.ts, value = EXCLUDED.value, changed = EXCLUDED.changed
+        WHERE EXCLUDED.ts >= item_latest.ts;
+    PERFORM item_latest_average(ARRAY(SELECT DISTINCT inserted.item_id FROM inserted));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE FUNCTION item_latest_prices_deleted() RETURNS TRIGGER AS $$
+DECLARE
+    item_ids INTEGER[];
+BEGIN
+    --Items whose latest price went, which fall back on their next latest,
+    --possibly one that's expired into prices_hourly
+    item_ids := ARRAY(
+        SELECT item_latest.item_id
+        FROM item_latest, deleted
+        WHERE item_latest.item_id = deleted.item_id
+          AND item_latest.ts = deleted.ts
+    );
+    IF CARDINALITY(item_ids) > 0 THEN
+        DELETE
+            FROM item_latest
+            WHERE item_latest.item_id = ANY(item_ids);
+        INSERT
+            INTO item_latest (item_id, ts, value)
+            SELECT DISTINCT ON (history.item_id) history.item_id, history.ts, history.value
+            FROM (
+                SELECT prices.item_id, prices.ts, prices.value
+                FROM prices
+                WHERE prices.item_id = ANY(item_ids)
+                UNION ALL
+                SELECT prices_hourly.item_id, prices_hourly.last_ts, prices_hourly.last_value
+                FROM prices_hourly
+                WHERE prices_hourly.item_id = ANY(item_ids)
+            ) AS history
+            ORDER BY history.item_id, history.ts DESC;
+        INSERT
+            INTO item_latest_removed (item_id)
+            SELECT UNNEST(item_ids)
+            EXCEPT
+            SELECT item_latest.item_id
+            FROM item_latest
+            WHERE item_latest.item_id = ANY(item_ids)
+            ON CONFLICT (item_id) DO UPDATE
+            SET changed = EXCLUDED.changed;
+    END IF;
+    --Expiry deletes far too long ago to change any averages
+    PERFORM item_latest_average(ARRAY(
+        SELECT DISTINCT deleted.item_id
+        FROM deleted
+        WHERE deleted.ts > DATE_TRUNC('second', NOW() AT TIME ZONE 'utc') - INTERVAL '24 hours'
+        UNION
+        SELECT UNNEST(item_ids)
+    ));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+--Statement triggers see every row a statement touched at once, so neither
+--batches of prices nor expiry pay per row
+CREATE TRIGGER item_latest_prices_inserted AFTER INSERT ON prices
+    REFERENCING NEW TABLE AS inserted
+    FOR EACH STATEMENT EXECUTE FUNCTION item_latest_prices_inserted();
+CREATE TRIGGER item_latest_prices_deleted AFTER DELETE ON prices
+    REFERENCING OLD TABLE AS deleted
+    FOR EACH STATEMENT EXECUTE FUNCTION item_latest_prices_deleted();
+
 CREATE TABLE flags(
     price_item_id INTEGER NOT NULL,
     price_ts TIMESTAMP NOT NULL,
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""
+Market analytics over NumPy arrays of price timestamps and values.
+
+Prices are grouped into slices of `timescale` seconds, aligned to the
+epoch, and only each slice's lowest and highest prices matter from then
+on: a slice's price is their midpoint, and the extremes for a window are
+the extremes of the slices within it. A slice's age is how many slices
+before the current one it is.
+
+analyse_many() works through any number of items' histories at once, so
+dashboards and exports needn't analyse items one by one.
+"""
+import collections
+
+import numpy
+
+PriceDatum = collections.namedtuple('PriceDatum', ['timestamp', 'value'])
+Analytics = collections.namedtuple('Analytics', [
+    'normalised_data', 'timescale', 'end',
+    'low_24h', 'low_week', 'low_month',
+    'high_24h', 'high_week', 'high_month',
+    'average_24h', 'average_week', 'average_month',
+    'trend_current', 'trend_daily', 'trend_weekly',
+])
+Slices = collections.namedtuple('Slices', [
+    'numbers', 'low_timestamps', 'low_values', 'high_timestamps', 'high_values',
+])
+
+_ONE_DAY = 3600 * 24
+_ONE_WEEK = _ONE_DAY * 7
+_ONE_MONTH = _ONE_WEEK * 4
+
+_UNMASKED = numpy.iinfo(numpy.int64).max
+
+def get_timescale(days, data_points):
+    """
+    Returns the length of a slice, in seconds, when `days` are graphed as
+    `data_points` slices.
+    """
+    return int(_ONE_DAY * days / float(data_points))
+    
+def _group_starts(keys):
+    """
+    Returns the positions at which each run of equal, sorted `keys` begins.
+    """
+    if not len(keys):
+        return numpy.zeros(0, dtype=numpy.int64)
+    return numpy.concatenate(([0], numpy.flatnonzero(keys[1:] != keys[:-1]) + 1))
+    
+def _reduce(groups, timestamps, values):
+    """
+    Returns, for each distinct group, its key and the timestamps and values
+    of its lowest and highest prices; on ties, the most recent price wins.
+    
+    Each price's value and timestamp are packed into one integer, ordered
+    just as the tie-breaking requires, so a single min/max reduction per
+    group finds both.
+    """
+    if not len(groups):
+        return (groups, timestamps, values, timestamps, values)
+        
+    oldest = timestamps.min()
+    offsets = timestamps - oldest
+    shift = int(offsets.max()).bit_length()
+    newest = (1 << shift) - 1
+    
+    order = numpy.argsort(groups, kind='mergesort')
+    groups = groups[order]
+    (offsets, values) = (offsets[order], values[order])
+    starts = _group_starts(groups)
+    lows = numpy.minimum.reduceat((values << shift) | (newest - offsets), starts)
+    highs = numpy.maximum.reduceat((values << shift) | offsets, starts)
+    return (
+        groups[starts],
+        oldest + newest - (lows & newest), lows >> shift,
+        oldest + (highs & newest), highs >> shift,
+    )
+    
+def reduce(timestamps, values, timescale):
+    """
+    Reduces one item's prices to the Slices they fall into.
+    """
+    timestamps = numpy.asarray(timestamps, dtype=numpy.int64)
+    values = numpy.asarray(values, dtype=numpy.int64)
+    return Slices(*_reduce(timestamps // timescale, timestamps, values))
+    
+def _first_in_groups(starts, mask, values):
+    """
+    Returns, for each group of rows beginning at `starts`, the position of
+    the masked row with the lowest value, the earliest on ties, or -1 if
+    none are masked.
+    """
+    if not len(values):
+        return numpy.zeros(len(starts), dtype=numpy.int64)
+    shift = int(len(values)).bit_length()
+    keys = numpy.where(
+        mask,
+        ((values - values.min()) << shift) | numpy.arange(len(values)),
+        _UNMASKED,
+    )
+    firsts = numpy.minimum.reduceat(keys, starts)
+    return numpy.where(firsts == _UNMASKED, -1, firsts & ((1 << shift) - 1))
+    
+def _floor_means(groups, values, size):
+    """
+    Returns the integer-floored mean of `values` in each of `size` groups,
+    and each group's count, for which zero means the mean is meaningless.
+    """
+    counts = numpy.bincount(groups, minlength=size)
+    sums = numpy.bincount(groups, weights=values, minlength=size)
+    return (numpy.floor_divide(sums, numpy.maximum(counts, 1)).astype(numpy.int64), counts)
+    
+def _trend(current, previous):
+    if not previous:
+        return None
+    return (current / float(previous)) - 1
+    
+def _analyse_slices(count, items, numbers, low_timestamps, low_values, high_timestamps, high_values, current_time, timescale, data_points):
+    current_slice = current_time // timescale
+    ages = current_slice - numbers
+    mask = (ages >= 0) & (ages < data_points)
+    items = items[mask]
+    ages = ages[mask]
+    low_timestamps = low_timestamps[mask]
+    low_values = low_values[mask]
+    high_timestamps = high_timestamps[mask]
+    high_values = high_values[mask]
+    midpoints = (low_values + high_values) // 2
+    
+    order = numpy.argsort(items * data_points + ages, kind='mergesort')
+    (items, ages, midpoints) = (items[order], ages[order], midpoints[order])
+    (low_timestamps, low_values) = (low_timestamps[order], low_values[order])
+    (high_timestamps, high_values) = (high_timestamps[order], high_values[order])
+    item_bounds = numpy.searchsorted(items, numpy.arange(count + 1))
+    
+    #The extremes of each window; rows are newest-first within each item, so the newest slice's win ties
+    present = numpy.flatnonzero(item_bounds[:-1] < item_bounds[1:])
+    extremes = []
+    for window in (_ONE_DAY, _ONE_WEEK, _ONE_MONTH):
+        in_window = ages < min(window // timescale, data_points)
+        extremes.append((
+            dict(zip(present.tolist(), _first_in_groups(item_bounds[present], in_window, low_values).tolist())),
+            dict(zip(present.tolist(), _first_in_groups(item_bounds[present], in_window, -high_values).tolist())),
+        ))
+        
+    #Daily averages of slices, weekly averages of days, and the month's of weeks
+    slices_per_day = int(_ONE_DAY / timescale)
+    days_count = (data_points - 1) // slices_per_day + 1
+    weeks_count = (days_count - 1) // 7 + 1
+    (day_averages, day_counts) = _floor_means(items * days_count + ages // slices_per_day, midpoints, count * days_count)
+    day_averages = day_averages.reshape(count, days_count)
+    present_days = numpy.flatnonzero(day_counts)
+    (week_averages, week_counts) = _floor_means(
+        (present_days // days_count) * weeks_count + (present_days % days_count) // 7,
+        day_averages.ravel()[present_days],
+        count * weeks_count,
+    )
+    week_averages = week_averages.reshape(count, weeks_count)
+    week_counts = week_counts.reshape(count, weeks_count)
+    day_counts = day_counts.reshape(count, days_count)
+    (month_averages, _) = _floor_means(
+        numpy.repeat(numpy.arange(count), weeks_count)[week_counts.ravel() > 0],
+        week_averages.ravel()[week_counts.ravel() > 0],
+        count,
+    )
+    
+    end = (current_slice + 1) * timescale
+    results = []
+    for item in xrange(count):
+        (start, stop) = (item_bounds[item], item_bounds[item + 1])
+        normalised_data = tuple(zip(ages[start:stop].tolist(), midpoints[start:stop].tolist()))
+        if not normalised_data:
+            results.append(Analytics(
+                normalised_data, timescale, end,
+                None, None, None,
+                None, None, None,
+                None, None, None,
+                None, None, None,
+            ))
+            continue
+            
+        (lows, highs) = ([], [])
+        for (window_lows, window_highs) in extremes:
+            position = window_lows[item]
+            lows.append(position >= 0 and PriceDatum(int(low_timestamps[position]), int(low_values[position])) or None)
+            position = window_highs[item]
+            highs.append(position >= 0 and PriceDatum(int(high_timestamps[position]), int(high_values[position])) or None)
+            
+        (days, weeks) = (day_counts[item], week_counts[item])
+        trend_current = trend_daily = trend_weekly = None
+        if stop - start > 1 and ages[start] == 0 and ages[start + 1] == 1:
+            trend_current = _trend(int(midpoints[start]), int(midpoints[start + 1]))
+        if days_count > 1 and days[0] and days[1]:
+            trend_daily = _trend(int(day_averages[item, 0]), int(day_averages[item, 1]))
+        if weeks_count > 1 and weeks[0] and weeks[1]:
+            trend_weekly = _trend(int(week_averages[item, 0]), int(week_averages[item, 1]))
+        results.append(Analytics(
+            normalised_data, timescale, end,
+            lows[0], lows[1], lows[2],
+            highs[0], highs[1], highs[2],
+            days[0] and int(day_averages[item, 0]) or None,
+            weeks[0] and int(week_averages[item, 0]) or None,
+            int(month_averages[item]),
+            trend_current, trend_daily, trend_weekly,
+        ))
+    return results
+    
+def analyse(slices, current_time, timescale, data_points):
+    """
+    Returns the Analytics for one item's Slices as of `current_time`.
+    """
+    return _analyse_slices(
+        1, numpy.zeros(len(slices.numbers), dtype=numpy.int64),
+        *(numpy.asarray(column, dtype=numpy.int64) for column in slices),
+        current_time=current_time, timescale=timescale, data_points=data_points
+    )[0]
+    
+def analyse_many(histories, current_time, timescale, data_points):
+    """
+    Returns a list of Analytics, one for each (timestamps, values) pair in
+    `histories`, computed together.
+    """
+    histories = list(histories)
+    items = numpy.repeat(numpy.arange(len(histories)), [len(timestamps) for (timestamps, values) in histories])
+    if not len(items):
+        return _analyse_slices(
+            len(histories), *(numpy.zeros(0, dtype=numpy.int64) for i in xrange(6)),
+            current_time=current_time, timescale=timescale, data_points=data_points
+        )
+    timestamps = numpy.concatenate([numpy.asarray(t, dtype=numpy.int64) for (t, v) in histories])
+    values = numpy.concatenate([numpy.asarray(v, dtype=numpy.int64) for (t, v) in histories])
+    
+    #Each item's slices are kept apart by giving every item its own range of slice numbers
+    current_slice = current_time // timescale
+    ages = current_slice - timestamps // timescale
+    groups = items * data_points + ages
+    mask = (ages >= 0) & (ages < data_points)
+    (groups, low_timestamps, low_values, high_timestamps, high_values) = _reduce(groups[mask], timestamps[mask], values[mask])
+    return _analyse_slices(
+        len(histories), groups // data_points, current_slice - groups % data_points,
+        low_timestamps, low_values, high_timestamps, high_values,
+        current_time=current_time, timescale=timescale, data_points=data_points
+    )
+    
+def pad(normalised_data, data_points):
+    """
+    Turns (age, price) pairs into a list of `data_points` prices, oldest
+    first, carrying each price forward over the slices with no data until
+    the next. Slices before the first price, and those after a price of 0,
+    are None.
+    """
+    positions = data_points - 1 - numpy.array([age for (age, price) in normalised_data], dtype=numpy.int64)
+    series = numpy.zeros(data_points, dtype=numpy.int64)
+    series[positions] = [price for (age, price) in normalised_data]
+    known = numpy.full(data_points, -1, dtype=numpy.int64)
+    known[positions] = positions
+    latest = numpy.maximum.accumulate(known)
+    return [
+        (position >= 0 and price) or None
+        for (position, price) in zip(latest.tolist(), series[latest].tolist())
+    ]
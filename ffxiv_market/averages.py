@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Keeps the cache's averages current for items nobody is pricing.
+
+An item's average covers a window that trails the current time, so it
+drifts out of date even when the item's prices don't change. Time is cut
+into buckets of `interval` seconds, and in each, every item whose average
+could have moved since the last is recomputed once. Each tick works
+through as many batches as fit in its time budget, so the work is spread
+across the bucket rather than arriving all at once on its boundary.
+"""
+import collections
+import logging
+import threading
+import time
+
+_logger = logging.getLogger('averages')
+
+class Refresher(object):
+    _candidates = None
+    _refresh = None
+    _interval = None
+    _batch_size = None
+    _budget = None
+    _lock = None
+    _bucket = None
+    _pending = None #Item IDs yet to be refreshed in the current bucket
+    _started = None #When the current bucket's work began
+    _count = None #Items due in the current bucket
+    
+    def __init__(self, candidates, refresh, interval, batch_size, budget):
+        """
+        `candidates` is called with the current time and returns the IDs of
+        the items whose averages may have moved; `refresh` is called with a
+        list of at most `batch_size` of them to recompute and apply. Ticks
+        stop starting batches after `budget` seconds.
+        """
+        self._candidates = candidates
+        self._refresh = refresh
+        self._interval = interval
+        self._batch_size = batch_size
+        self._budget = budget
+        self._lock = threading.Lock()
+        self._pending = collections.deque()
+        
+    def tick(self):
+        """
+        Refreshes the next batches of the current bucket's items; does
+        nothing if another tick is still running.
+        """
+        if not self._lock.acquire(False):
+            return
+        try:
+            start_time = time.time()
+            bucket = int(start_time) // self._interval
+            if bucket != self._bucket:
+                try:
+                    candidates = self._candidates(int(start_time))
+                except Exception as e: #The bucket is left unstarted, to be tried again next tick
+                    _logger.error("Unable to find averages to refresh: {error}".format(error=e))
+                    return
+                if self._pending:
+                    _logger.warn("{count} averages weren't refreshed within {interval}s".format(
+                        count=len(self._pending),
+                        interval=self._interval,
+                    ))
+                self._bucket = bucket
+                self._pending = collections.deque(candidates)
+                self._started = start_time
+                self._count = len(self._pending)
+                
+            while self._pending and time.time() - start_time < self._budget:
+                batch = [self._pending.popleft() for i in xrange(min(self._batch_size, len(self._pending)))]
+                try:
+                    self._refresh(batch)
+                except Exception as e: #Its items come round again next bucket
+                    _logger.error("Unable to refresh {count} averages: {error}".format(
+                        count=len(batch),
+                        error=e,
+                    ))
+                    return
+                if not self._pending:
+                    _logger.info("Refreshed {count} averages over {duration:.1f}s".format(
+                        count=self._count,
+                        duration=(time.time() - self._started),
+                    ))
+        finally:
+            self._lock.release()
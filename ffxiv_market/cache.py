@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+"""
+The in-memory image of every item's latest price and average, from which
+the dashboard and most item lists are served without touching Postgres.
+"""
+import collections
+import sys
+import threading
+
+import numpy
+
+import metrics
+
+ItemPrice = collections.namedtuple('Price', ['timestamp', 'value', 'reporter', 'flagged'])
+ItemState = collections.namedtuple('ItemState', ['name', 'id', 'hq', 'price'])
+ItemName = collections.namedtuple('ItemName', ['en', 'ja', 'fr', 'de'])
+ItemRef = collections.namedtuple('ItemRef', ['item_state', 'average'])
+
+NO_PRICE = -1 #Stands in for timestamps, values and averages that don't exist
+
+Columns = collections.namedtuple('Columns', ['ids', 'hq', 'timestamps', 'values', 'averages', 'revisions'])
+
+#The priced rows in order of key, then row; keys are ascending and rows are the matching entries
+SortedIndex = collections.namedtuple('SortedIndex', ['keys', 'rows'])
+Indexes = collections.namedtuple('Indexes', ['timestamps', 'values'])
+
+_TIMESTAMP_SPAN = 1 << 32 #Values index keys hold the timestamp in their low 32 bits
+_MAX_KEY = (1 << 63) - 1
+_WALK_CHUNK = 64 #Entries a filtered walk looks at first, doubling each time it comes up short
+
+def value_key(value, timestamp):
+    """
+    Returns the values index's key for (value, timestamp), clamped to what an
+    int64 holds so it can bound a walk.
+    """
+    return max(min(value * _TIMESTAMP_SPAN + timestamp, _MAX_KEY), -_MAX_KEY - 1)
+    
+def value_key_timestamps(keys):
+    return keys % _TIMESTAMP_SPAN
+    
+def _index_keys(columns, rows):
+    return (
+        columns.timestamps[rows],
+        columns.values[rows] * _TIMESTAMP_SPAN + columns.timestamps[rows],
+    )
+    
+def _locate(index, keys, rows):
+    """
+    Returns where each (key, row) falls in `index`, counting ties on key.
+    """
+    positions = numpy.searchsorted(index.keys, keys, 'left')
+    ends = numpy.searchsorted(index.keys, keys, 'right')
+    for i in numpy.flatnonzero(ends > positions):
+        positions[i] += numpy.searchsorted(index.rows[positions[i]:ends[i]], rows[i])
+    return positions
+    
+def _without(array, positions):
+    pieces = []
+    start = 0
+    for position in positions:
+        pieces.append(array[start:position])
+        start = position + 1
+    pieces.append(array[start:])
+    return numpy.concatenate(pieces)
+    
+def _with(array, positions, values):
+    pieces = []
+    start = 0
+    for (i, position) in enumerate(positions):
+        pieces.append(array[start:position])
+        pieces.append(values[i:i + 1])
+        start = position
+    pieces.append(array[start:])
+    return numpy.concatenate(pieces)
+    
+def _patch_index(index, removed_keys, removed_rows, added_keys, added_rows):
+    """
+    Returns a copy of `index` without the entries (removed_keys, removed_rows)
+    and with (added_keys, added_rows), splicing the arrays rather than
+    sorting them again; only a few entries change at a time.
+    """
+    positions = numpy.sort(_locate(index, removed_keys, removed_rows))
+    index = SortedIndex(_without(index.keys, positions), _without(index.rows, positions))
+    order = numpy.lexsort((added_rows, added_keys))
+    (added_keys, added_rows) = (added_keys[order], added_rows[order])
+    positions = _locate(index, added_keys, added_rows)
+    return SortedIndex(_with(index.keys, positions, added_keys), _with(index.rows, positions, added_rows))
+    
+def walk(index, low, high, limit, reverse=False, where=None):
+    """
+    Returns the rows of up to `limit` entries of `index` with keys from `low`
+    (inclusive) to `high` (exclusive), either of which may be None, in key
+    order or, if `reverse`, the opposite; rows break ties on key, so later
+    rows (higher ids) come first in reverse.
+    
+    `where`, if given, is called with arrays of keys along the way, returning
+    masks of the entries to keep.
+    """
+    start = 0 if low is None else int(numpy.searchsorted(index.keys, low, 'left'))
+    end = len(index.keys) if high is None else int(numpy.searchsorted(index.keys, high, 'left'))
+    if where is None:
+        if reverse:
+            return index.rows[max(start, end - limit):end][::-1]
+        return index.rows[start:min(end, start + limit)]
+        
+    found = []
+    count = 0
+    chunk = max(limit, _WALK_CHUNK)
+    while start < end and count < limit:
+        if reverse:
+            (chunk_start, chunk_end) = (max(start, end - chunk), end)
+            end = chunk_start
+            (keys, rows) = (index.keys[chunk_start:chunk_end][::-1], index.rows[chunk_start:chunk_end][::-1])
+        else:
+            (chunk_start, chunk_end) = (start, min(end, start + chunk))
+            start = chunk_end
+            (keys, rows) = (index.keys[chunk_start:chunk_end], index.rows[chunk_start:chunk_end])
+        rows = rows[where(keys)][:limit - count]
+        found.append(rows)
+        count += len(rows)
+        chunk *= 2
+    if not found:
+        return index.rows[:0]
+    return numpy.concatenate(found)
+    
+_Snapshot = collections.namedtuple('_Snapshot', ['version', 'columns', 'indexes'])
+
+class Cache(object):
+    """
+    The latest price and average of every item, held column-wise: one array
+    per field, with a row per item in id order. ItemRefs are only built for
+    the items something asks for.
+    
+    Names live in per-language tables shared by each item's NQ and HQ rows.
+    
+    Each snapshot also holds the priced rows sorted by timestamp and by
+    value, so the dashboard's lists are ranges of an index rather than sorts
+    of every item. Writers patch them along with the rows that change.
+    
+    Readers take the current _Snapshot with a single reference read and
+    never lock; its arrays are never modified. Writers take turns building
+    the next snapshot, copying only the columns that change and sharing the
+    rest, then publish it by replacing the reference. Updates queue up while
+    another writer works and are applied together, so a burst of prices
+    costs one copy rather than one each.
+    
+    It's loaded from item_latest, which triggers on prices keep as the
+    database's own record of the same thing.
+    """
+    _write_lock = None
+    _pending = None #Updates waiting for the write lock, as (item_id, timestamp, value, average)
+    _snapshot = None
+    _name_rows = None #Each row's position in the name tables
+    _names = None #One list of interned names per language
+    
+    def __init__(self, item_data):
+        self._write_lock = metrics.TimedLock(metrics.CACHE_WRITE_WAIT, metrics.CACHE_WRITE_HOLD)
+        self._pending = collections.deque()
+        
+        item_states = []
+        averages = []
+        for item_ref in item_data:
+            item_states.append(item_ref.item_state)
+            averages.append(NO_PRICE if item_ref.average is None else item_ref.average)
+        columns = Columns(
+            numpy.array([i.id for i in item_states], dtype=numpy.int64),
+            numpy.array([i.hq for i in item_states], dtype=numpy.bool_),
+            numpy.array([i.price.timestamp if i.price else NO_PRICE for i in item_states], dtype=numpy.int64),
+            numpy.array([i.price.value if i.price else NO_PRICE for i in item_states], dtype=numpy.int64),
+            numpy.array(averages, dtype=numpy.int64),
+            numpy.zeros(len(item_states), dtype=numpy.int64),
+        )
+        indexes = []
+        rows = numpy.flatnonzero(columns.timestamps != NO_PRICE)
+        for keys in _index_keys(columns, rows):
+            order = numpy.lexsort((rows, keys))
+            indexes.append(SortedIndex(keys[order], rows[order]))
+        self._publish(0, columns, Indexes(*indexes))
+        
+        name_positions = {}
+        self._names = ItemName(*([] for language in ItemName._fields))
+        for item_state in item_states:
+            if item_state.name not in name_positions:
+                name_positions[item_state.name] = len(name_positions)
+                for (table, name) in zip(self._names, item_state.name):
+                    table.append(intern(name))
+        self._name_rows = numpy.array([name_positions[i.name] for i in item_states], dtype=numpy.int32)
+        
+    @property
+    def version(self):
+        """
+        Bumped whenever an item changes, so anything derived from the cache
+        can tell it's stale.
+        """
+        return self._snapshot.version
+        
+    def memory_usage(self):
+        """
+        Returns the bytes held by the columns, indexes and name tables.
+        """
+        snapshot = self._snapshot
+        usage = sum(column.nbytes for column in snapshot.columns) + self._name_rows.nbytes
+        usage += sum(index.keys.nbytes + index.rows.nbytes for index in snapshot.indexes)
+        for table in self._names:
+            usage += sys.getsizeof(table) + sum(sys.getsizeof(name) for name in table)
+        return usage
+        
+    def _publish(self, version, columns, indexes):
+        for column in columns:
+            column.setflags(write=False)
+        for index in indexes:
+            index.keys.setflags(write=False)
+            index.rows.setflags(write=False)
+        self._snapshot = _Snapshot(version, columns, indexes)
+        
+    def _find_row(self, columns, item_id):
+        row = int(numpy.searchsorted(columns.ids, item_id))
+        if row < len(columns.ids) and columns.ids[row] == item_id:
+            return row
+        return None
+        
+    def _materialise(self, columns, row):
+        name_row = self._name_rows[row]
+        price = None
+        if columns.timestamps[row] != NO_PRICE:
+            price = ItemPrice(int(columns.timestamps[row]), int(columns.values[row]), None, False)
+        average = int(columns.averages[row])
+        return ItemRef(
+            ItemState(
+                ItemName(*(table[name_row] for table in self._names)),
+                int(columns.ids[row]), bool(columns.hq[row]), price,
+            ),
+            None if average == NO_PRICE else average,
+        )
+        
+    def _set_rows(self, snapshot, changes):
+        """
+        Publishes `snapshot` with each (row, timestamp, value, average) in
+        `changes` applied, in order.
+        """
+        (timestamps, values, averages, revisions) = (
+            snapshot.columns.timestamps.copy(), snapshot.columns.values.copy(), snapshot.columns.averages.copy(),
+            snapshot.columns.revisions.copy(),
+        )
+        for (row, timestamp, value, average) in changes:
+            timestamps[row] = timestamp
+            values[row] = value
+            averages[row] = average
+            revisions[row] += 1
+        columns = snapshot.columns._replace(
+            timestamps=timestamps, values=values, averages=averages, revisions=revisions,
+        )
+        
+        rows = numpy.unique(numpy.array([row for (row, timestamp, value, average) in changes], dtype=numpy.int64))
+        removed = rows[snapshot.columns.timestamps[rows] != NO_PRICE]
+        added = rows[timestamps[rows] != NO_PRICE]
+        indexes = Indexes(*(
+            _patch_index(index, removed_keys, removed, added_keys, added)
+            for (index, removed_keys, added_keys)
+            in zip(snapshot.indexes, _index_keys(snapshot.columns, removed), _index_keys(columns, added))
+        ))
+        self._publish(snapshot.version + 1, columns, indexes)
+        
+    def update(self, item_id, timestamp, value, average):
+        self.update_many(((item_id, timestamp, value, average),))
+        
+    def update_many(self, prices):
+        """
+        Sets the latest price of every (item ID, timestamp, value, average)
+        in `prices`, publishing them together. Items the cache doesn't know,
+        as when the catalogue has yet to be reloaded, are skipped.
+        """
+        self._pending.extend(
+            (item_id, timestamp, value, NO_PRICE if average is None else average)
+            for (item_id, timestamp, value, average) in prices
+        )
+        with self._write_lock:
+            changes = []
+            while self._pending: #Only the lock's holder takes from the queue
+                changes.append(self._pending.popleft())
+            if not changes: #Another writer published this update along with its own
+                return
+            snapshot = self._snapshot
+            rows = []
+            for (item_id, timestamp, value, average) in changes:
+                row = self._find_row(snapshot.columns, item_id)
+                if row is not None:
+                    rows.append((row, timestamp, value, average))
+            if rows:
+                self._set_rows(snapshot, rows)
+            
+    def set_averages(self, averages):
+        """
+        Sets the average of every (item ID, average) in `averages`, leaving
+        latest prices alone, and publishes them together if any changed.
+        """
+        with self._write_lock:
+            snapshot = self._snapshot
+            columns = snapshot.columns
+            changed = []
+            for (item_id, average) in averages:
+                row = self._find_row(columns, item_id)
+                average = NO_PRICE if average is None else average
+                if row is not None and columns.timestamps[row] != NO_PRICE and columns.averages[row] != average:
+                    changed.append((row, average))
+            if not changed:
+                return
+            averages = columns.averages.copy()
+            for (row, average) in changed:
+                averages[row] = average
+            self._publish(snapshot.version + 1, columns._replace(averages=averages), snapshot.indexes)
+            
+    def delete(self, item_id, timestamp):
+        with self._write_lock:
+            snapshot = self._snapshot
+            row = self._find_row(snapshot.columns, item_id)
+            if row is not None and snapshot.columns.timestamps[row] == timestamp:
+                self._set_rows(snapshot, [(row, NO_PRICE, NO_PRICE, NO_PRICE)])
+                return True
+        return False
+        
+    def touch(self, item_ids):
+        """
+        Marks items whose price history changed without their latest price
+        changing, as when an older price is deleted.
+        """
+        with self._write_lock:
+            snapshot = self._snapshot
+            revisions = snapshot.columns.revisions.copy()
+            for item_id in item_ids:
+                row = self._find_row(snapshot.columns, item_id)
+                if row is not None:
+                    revisions[row] += 1
+            self._publish(snapshot.version + 1, snapshot.columns._replace(revisions=revisions), snapshot.indexes)
+            
+    def get_fingerprint(self, item_id):
+        """
+        Returns (revision, timestamp, value, average) for the item, which
+        changes whenever anything about its prices does, or None if the item
+        isn't known. Revisions count changes since the cache was built.
+        """
+        columns = self._snapshot.columns
+        row = self._find_row(columns, item_id)
+        if row is None:
+            return None
+        return (int(columns.revisions[row]), int(columns.timestamps[row]), int(columns.values[row]), int(columns.averages[row]))
+        
+    def get_item_by_id(self, item_id):
+        columns = self._snapshot.columns
+        row = self._find_row(columns, item_id)
+        if row is None:
+            return None
+        return self._materialise(columns, row)
+        
+    def query(self, query_func):
+        """
+        Calls `query_func` with every item's ItemRef; this builds them all,
+        so it's only for rare, whole-catalogue work.
+        """
+        columns = self._snapshot.columns
+        return query_func([self._materialise(columns, row) for row in xrange(len(columns.ids))])
+        
+    def select(self, query_func):
+        """
+        Calls `query_func` with the cache's Columns, returning the ItemRefs
+        of the rows it returns.
+        """
+        columns = self._snapshot.columns
+        return [self._materialise(columns, row) for row in query_func(columns)]
+        
+    def select_indexed(self, query_func):
+        """
+        Calls `query_func` with the cache's Indexes, returning the ItemRefs of
+        the rows it returns.
+        """
+        snapshot = self._snapshot
+        return [self._materialise(snapshot.columns, row) for row in query_func(snapshot.indexes)]
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+The item catalogue: base items, their NQ and HQ variants, names and the
+crafting graph. It only changes when data/items.sql is reloaded, so it's
+read once and item pages look things up in memory instead of querying.
+
+A Catalogue is never modified; reloading builds a new one to replace it.
+"""
+import collections
+import logging
+
+import numpy
+
+from cache import ItemName
+
+_logger = logging.getLogger('catalogue')
+
+BaseItem = collections.namedtuple('BaseItem', ['name', 'lodestone_id', 'nq_id', 'hq_id'])
+
+class _Graph(object):
+    """
+    Edges from base items to related base items, as adjacency arrays: the
+    targets of the base item in row `r` are targets[offsets[r]:offsets[r + 1]].
+    """
+    def __init__(self, rows, edges):
+        """
+        `rows` maps base item IDs to rows; `edges` are (base item ID,
+        related base item ID) pairs.
+        """
+        sources = numpy.array([rows[source] for (source, target) in edges], dtype=numpy.int32)
+        targets = numpy.array([target for (source, target) in edges], dtype=numpy.int32)
+        order = numpy.argsort(sources, kind='mergesort')
+        self._targets = targets[order]
+        self._offsets = numpy.concatenate(([0], numpy.cumsum(numpy.bincount(sources, minlength=len(rows))))).astype(numpy.int32)
+        
+    def get(self, row):
+        return self._targets[self._offsets[row]:self._offsets[row + 1]].tolist()
+        
+class Catalogue(object):
+    _base_items = None #base item ID: BaseItem
+    _items = None #item ID: (base item ID, HQ)
+    _rows = None #base item ID: row in the graphs
+    _crafted_from = None
+    _crafts_into = None
+    
+    def __init__(self, base_items, items, crafted_from, crafts_into):
+        """
+        `base_items` are (ID, name_en, name_ja, name_fr, name_de,
+        lodestone_id); `items` are (ID, base item ID, HQ); `crafted_from`
+        and `crafts_into` are (base item ID, related base item ID).
+        """
+        variants = collections.defaultdict(lambda: [None, None])
+        self._items = {}
+        for (item_id, base_item_id, hq) in items:
+            self._items[item_id] = (base_item_id, hq)
+            variants[base_item_id][hq] = item_id
+            
+        self._base_items = {}
+        self._rows = {}
+        for (base_item_id, name_en, name_ja, name_fr, name_de, lodestone_id) in base_items:
+            (nq_id, hq_id) = variants[base_item_id]
+            self._base_items[base_item_id] = BaseItem(
+                ItemName(intern(name_en), intern(name_ja), intern(name_fr), intern(name_de)),
+                lodestone_id, nq_id, hq_id,
+            )
+            self._rows[base_item_id] = len(self._rows)
+        self._crafted_from = _Graph(self._rows, crafted_from)
+        self._crafts_into = _Graph(self._rows, crafts_into)
+        _logger.info("Catalogue holds {base_items} base items, {items} items, and {edges} crafting relations".format(
+            base_items=len(self._base_items),
+            items=len(self._items),
+            edges=(len(crafted_from) + len(crafts_into)),
+        ))
+        
+    def get_properties(self, language, item_id):
+        """
+        Returns (name, base item ID, lodestone ID, HQ) for the item, or None
+        if it isn't known.
+        """
+        item = self._items.get(item_id)
+        if item is None:
+            return None
+        (base_item_id, hq) = item
+        base_item = self._base_items[base_item_id]
+        return (getattr(base_item.name, language), base_item_id, base_item.lodestone_id, hq)
+        
+    def get_variant_id(self, base_item_id, hq):
+        """
+        Returns the ID of the base item's HQ or NQ variant, or None if it
+        has none.
+        """
+        base_item = self._base_items.get(base_item_id)
+        if base_item is None:
+            return None
+        if hq:
+            return base_item.hq_id
+        return base_item.nq_id
+        
+    def _get_related(self, graph, base_item_id):
+        row = self._rows.get(base_item_id)
+        if row is None:
+            return []
+        item_ids = []
+        for related_base_item_id in graph.get(row):
+            base_item = self._base_items.get(related_base_item_id)
+            if base_item is not None:
+                item_ids.extend(i for i in (base_item.nq_id, base_item.hq_id) if i is not None)
+        return item_ids
+        
+    def get_related(self, base_item_id):
+        """
+        Returns the IDs of the items the base item is crafted from and those
+        it's crafted into, counting both variants of each.
+        """
+        return (
+            self._get_related(self._crafted_from, base_item_id),
+            self._get_related(self._crafts_into, base_item_id),
+        )
+        
@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
 import logging
+import time
 
 CONFIG = None #installed on startup
+STARTED = int(time.time()) #Imported before workers are forked, so they all share it
 
 USER_STATUS_GUEST = -1 #People who aren't logged in
 USER_STATUS_PENDING = 0
@@ -1,16 +1,38 @@
 # -*- coding: utf-8 -*-
 import collections
 import datetime
+import hashlib
+import json
 import logging
+import os
+import sys
 import threading
 import time
 
-import bcrypt
+import concurrent.futures
+import numpy
 import psycopg2
-import psycopg2.pool
+import psycopg2.extensions
 
+import analytics
+import averages
+import cache
+import catalogue
+import identities
+import maintenance
+import metrics
+import pool
+import push
+import rollups
+import search
+import slow_queries
+import snapshot
+import watchlists
+from cache import (
+    ItemName, ItemPrice, ItemRef, ItemState,
+)
 from common import (
-    CONFIG,
+    CONFIG, STARTED,
     USER_STATUS_GUEST,
     USER_STATUS_PENDING, USER_STATUS_ACTIVE, USER_STATUS_BANNED,
     USER_STATUS_MODERATOR, USER_STATUS_ADMINISTRATOR,
@@ -19,10 +41,15 @@ from common import (
 _THREE_HOURS = 3600 * 3
 _TWELVE_HOURS = _THREE_HOURS * 4
 
-ItemPrice = collections.namedtuple('Price', ['timestamp', 'value', 'reporter', 'flagged'])
-ItemState = collections.namedtuple('ItemState', ['name', 'id', 'hq', 'price'])
-ItemName = collections.namedtuple('ItemName', ['en', 'ja', 'fr', 'de'])
-ItemRef = collections.namedtuple('ItemRef', ['item_state', 'average'])
+_MIN_RETENTION_DAYS = 2 #Averages are worked out from prices up to 36 hours old, which mustn't have expired
+_PARTITIONS_AHEAD = 2 #Months of partitions kept ready for prices
+_EXPIRY_BATCH_SIZE = 5000 #Prices expired per statement
+_AVERAGES_BATCH_LIMIT = 300 #Refreshed averages that fit in one broadcast, which Postgres caps at 8000 bytes
+_PRICES_BROADCAST_LIMIT = 150 #Added prices that fit in one broadcast
+_SNAPSHOT_MARGIN = 300 #Seconds before a snapshot's high-water mark to catch up from, for commits, broadcasts and clocks that lag
+
+_BROADCAST_CHANNEL = 'ffxiv_market_cache'
+
 UserRef = collections.namedtuple('UserRef', ['name', 'id', 'anonymous'])
 Flag = collections.namedtuple('Flag', ['item', 'user'])
 
@@ -36,116 +63,71 @@ def _datetime_to_epoch(timestamp):
     
 _epoch_to_datetime = datetime.datetime.utcfromtimestamp
 
-class WritePriorityLock(object):
-    def __init__(self):
-        self._lock = threading.Condition(threading.Lock())
-        self._readers = 0
-        self._writer = False
+#The hottest statements, prepared on each connection as it's opened so
+#they're planned once rather than on every page: name: (types, statement)
+_PREPARED_STATEMENTS = collections.OrderedDict((
+    ('items_get_prices', ('INTEGER, TIMESTAMP, BIGINT', """(SELECT prices.ts, prices.value, users.id, users.name, users.anonymous, flags.price_ts
+            FROM users,
+                prices LEFT OUTER JOIN flags ON (flags.price_item_id = prices.item_id AND flags.price_ts = prices.ts)
+            WHERE prices.item_id = $1
+              AND prices.submitting_user = users.id
+              AND prices.ts > COALESCE($2, '-infinity'))
+        UNION ALL
+        (SELECT prices_hourly.last_ts, prices_hourly.last_value, NULL, NULL, NULL, NULL
+            FROM prices_hourly
+            WHERE prices_hourly.item_id = $1
+              AND prices_hourly.last_ts > COALESCE($2, '-infinity'))
+        ORDER BY 1 DESC
+        LIMIT $3""")),
+    ('users_get_identity', ('INTEGER', """SELECT users.name, users.language, users.status, users.anonymous
+        FROM users
+        WHERE users.id = $1
+        LIMIT 1""")),
+))
 
-    def read_start(self):
-        with self._lock:
-            while self._writer:
-                self._lock.wait()
-            self._readers += 1
-            
-    def read_stop(self):
-        with self._lock:
-            self._readers -= 1
-            if not self._readers:
-                self._lock.notify_all()
-                
-    def write_start(self):
-        self._lock.acquire()
-        self._writer = True
-        while self._readers:
-            self._lock.wait()
-            
-    def write_stop(self):
-        self._writer = False
-        self._lock.notify_all()
-        self._lock.release()
-        
-class _Cache(object):
-    """
-    This should be replaced by a Materialized View when Postgres >= 9.3 is
-    available.
-    """
-    _lock = None
-    _item_refs = None
-    
-    def __init__(self, item_data):
-        self._lock = WritePriorityLock()
-        
-        self._item_refs = list(item_data)
-        
-    def _find_index(self, item_id):
-        low = 0
-        high = len(self._item_refs) - 1
-        while low <= high:
-            position = int((low + high) / 2)
-            value = self._item_refs[position].item_state.id
-            if value < item_id:
-                low = position + 1
-            elif value > item_id:
-                high = position - 1
-            else:
-                return position
-        return None
-        
-    def update(self, item_ref):
-        self._lock.write_start()
-        try:
-            self._item_refs[self._find_index(item_ref.item_state.id)] = item_ref
-        finally:
-            self._lock.write_stop()
-            
-    def delete(self, item_id, timestamp):
-        self._lock.write_start()
-        try:
-            record_index = self._find_index(item_id)
-            if self._item_refs[record_index].item_state.price and self._item_refs[record_index].item_state.price.timestamp == timestamp:
-                item_ref = self._item_refs[record_index]
-                self._item_refs[record_index] = ItemRef(
-                    ItemState(
-                        item_ref.item_state.name, item_ref.item_state.id, item_ref.item_state.hq, None,
-                    ),
-                    None,
-                )
-                return True
-        finally:
-            self._lock.write_stop()
-        return False
+def _prepare_statements(connection):
+    with connection.cursor() as cursor:
+        cursor.execute(';\n'.join(
+            "PREPARE {name} ({types}) AS {statement}".format(name=name, types=types, statement=statement)
+            for (name, (types, statement)) in _PREPARED_STATEMENTS.iteritems()
+        ))
         
-    def get_item_by_id(self, item_id):
-        self._lock.read_start()
-        try:
-            record_index = self._find_index(item_id)
-            if record_index is None:
-                return None
-            return self._item_refs[record_index]
-        finally:
-            self._lock.read_stop()
-            
-    def query(self, query_func):
-        self._lock.read_start()
+def _configure_connection(connection):
+    connection.set_session(autocommit=True)
+    _prepare_statements(connection)
+    
+class _TimedCursor(psycopg2.extensions.cursor):
+    method = None #The _Database method the cursor's statements are timed under
+    slow_queries = None
+    
+    def execute(self, query, vars=None):
+        start = time.time()
         try:
-            return query_func(self._item_refs)
+            return super(_TimedCursor, self).execute(query, vars)
         finally:
-            self._lock.read_stop()
+            duration = time.time() - start
+            metrics.QUERY_DURATION.observe(duration, self.method)
+            if duration >= self.slow_queries.threshold:
+                self.slow_queries.record(self, self.method, query, vars, duration)
             
 class _Cursor(object):
     _pool = None
     _conn = None
     _cursor = None
+    _method = None
     
-    def __init__(self, pool):
+    def __init__(self, pool, method):
         self._pool = pool
+        self._method = method
+        start = time.time()
         self._conn = pool.getconn()
-        self._conn.set_session(autocommit=True)
+        metrics.POOL_WAIT.observe(time.time() - start)
         
     def __enter__(self):
         _logger.debug("Obtaining database connection")
-        self._cursor = self._conn.cursor()
+        self._cursor = self._conn.cursor(cursor_factory=_TimedCursor)
+        self._cursor.method = self._method
+        self._cursor.slow_queries = self._pool.slow_queries
         return self._cursor
         
     def __exit__(self, exc_type, exc_val, exc_tb):
@@ -153,28 +135,188 @@ class _Cursor(object):
         self._pool.putconn(self._conn)
         _logger.debug("Released database connection")
         
-class _Pool(psycopg2.pool.ThreadedConnectionPool):
+class _Pool(pool.Pool):
+    slow_queries = None
+    
+    def __init__(self, minconn, maxconn, timeout, slow_queries, **kwargs):
+        pool.Pool.__init__(self, minconn, maxconn, timeout, _configure_connection, **kwargs)
+        self.slow_queries = slow_queries
+        
     def get_cursor(self):
-        return _Cursor(self)
+        return _Cursor(self, sys._getframe(1).f_code.co_name)
         
 class _Database(object):
     _pool = None
     _cache = None
+    _catalogue = None
+    _catalogue_digest = None
+    _catalogue_lock = None
+    _names = None
+    _rollups = None
+    _averages = None
+    _identities = None
+    _flags_count = None
+    _flags_lock = None
+    _watchlists = None
+    _listener = None
+    _maintenance_connection = None
     _related_lock = None
+    _slow_queries = None
+    _retention_days = None
+    
+    connections_max = None
     
     def __init__(self):
         self._related_lock = threading.Lock()
+        self._flags_lock = threading.Lock()
+        self._catalogue_lock = threading.Lock()
+        self._identities = identities.IdentityCache(
+            size=CONFIG['server']['cache']['identities_limit'],
+            ttl=CONFIG['server']['cache']['identities_ttl'],
+        )
+        
+        self._retention_days = CONFIG['data']['prices']['retention_days']
+        if self._retention_days < _MIN_RETENTION_DAYS:
+            _logger.warn("Prices must be kept for at least {minimum} days; {retention} configured".format(
+                minimum=_MIN_RETENTION_DAYS,
+                retention=self._retention_days,
+            ))
+            self._retention_days = _MIN_RETENTION_DAYS
+        if analytics.get_timescale(CONFIG['graphing']['days'], CONFIG['graphing']['data_points']) % 3600:
+            _logger.warn("Graphs' slices aren't whole hours, so analytics of expired prices are approximate")
+            
+        connections_min = CONFIG['server']['postgres']['connections_min']
+        connections_max = CONFIG['server']['postgres']['connections_max']
+        workers = CONFIG['server']['workers']
+        #connections_max is the budget for every worker together, including the connections
+        #each one holds to receive broadcasts and explain slow queries, and the one the first
+        #sets aside for maintenance
+        dedicated = (1 if workers > 1 else 0) + (1 if CONFIG['server']['postgres']['slow_queries']['explain_rate'] > 0 else 0)
+        connections_max = max(1, (connections_max - 1) // workers - dedicated)
+        needed = (connections_max + dedicated) * workers + 1
+        if needed > CONFIG['server']['postgres']['connections_max']:
+            _logger.warn("{workers} workers need {needed} connections; budget is {budget}".format(
+                workers=workers,
+                needed=needed,
+                budget=CONFIG['server']['postgres']['connections_max'],
+            ))
+        connections_min = min(connections_min, connections_max)
+        
+        self.connections_max = connections_max
+        self._slow_queries = slow_queries.SlowQueryLog(
+            threshold=CONFIG['server']['postgres']['slow_queries']['threshold'],
+            size=CONFIG['server']['postgres']['slow_queries']['limit'],
+            explain_rate=CONFIG['server']['postgres']['slow_queries']['explain_rate'],
+            connect=self._connect_explainer,
+        )
         self._pool = _Pool(
-            minconn=CONFIG['server']['postgres']['connections_min'],
-            maxconn=CONFIG['server']['postgres']['connections_max'],
-            host=CONFIG['server']['postgres']['host'],
-            database=CONFIG['server']['postgres']['database'],
-            user=CONFIG['server']['postgres']['username'],
-            password=CONFIG['server']['postgres']['password'],
+            minconn=connections_min,
+            maxconn=connections_max,
+            timeout=CONFIG['server']['postgres']['checkout_timeout'],
+            slow_queries=self._slow_queries,
+            **self._get_connection_parameters()
         )
+        metrics.Gauges('ffxiv_market_pool', "Database connection pool", self._pool.stats)
+        
+        if workers > 1:
+            #Listen before warming up so nothing other workers change in the meantime is lost
+            self._listener = psycopg2.connect(**self._get_connection_parameters())
+            self._listener.set_session(autocommit=True)
+            self._listener.cursor().execute("LISTEN {channel}".format(channel=_BROADCAST_CHANNEL))
+            
+        self._catalogue = self._load_catalogue()
+        
         _logger.info("Initialising cache...")
-        self._cache = _Cache(self._get_cache_data())
-        _logger.info("Cache initialised")
+        start_time = time.time()
+        self._catalogue_digest = self._get_catalogue_digest()
+        item_data = None
+        if CONFIG['server']['cache']['snapshot_path']:
+            item_data = self._get_snapshot_cache_data(CONFIG['server']['cache']['snapshot_path'])
+        if item_data is None:
+            item_data = self._get_cache_data()
+        self._cache = cache.Cache(item_data)
+        self._names = search.NameIndex(self._cache.query(list), ItemName._fields)
+        self._rollups = rollups.Rollups(
+            load=self._items_get_price_values,
+            size=CONFIG['server']['cache']['rollups_limit'],
+            days=CONFIG['graphing']['days'],
+            data_points=CONFIG['graphing']['data_points'],
+        )
+        self._averages = averages.Refresher(
+            candidates=self._items_get_averaged,
+            refresh=self._items_refresh_averages,
+            interval=CONFIG['server']['cache']['averages_interval'],
+            batch_size=min(CONFIG['server']['cache']['averages_batch'], _AVERAGES_BATCH_LIMIT),
+            budget=CONFIG['server']['cache']['averages_budget'],
+        )
+        _logger.info("Cache initialised in {duration:.2f}s; {size} bytes held".format(
+            duration=(time.time() - start_time),
+            size=self._cache.memory_usage(),
+        ))
+        
+        with self._pool.get_cursor() as cursor:
+            cursor.execute("""SELECT COUNT(flags.price_ts)
+                FROM flags""")
+            self._flags_count = cursor.fetchone()[0]
+            cursor.execute("""SELECT watchlist.user_id, watchlist.item_id
+                FROM watchlist""")
+            self._watchlists = watchlists.Watchlists(self._iterate_results(cursor, buffer_size=1024))
+        
+    def _get_connection_parameters(self):
+        return {
+            'host': CONFIG['server']['postgres']['host'],
+            'database': CONFIG['server']['postgres']['database'],
+            'user': CONFIG['server']['postgres']['username'],
+            'password': CONFIG['server']['postgres']['password'],
+        }
+        
+    def listen(self, io_loop):
+        """
+        Applies cache changes broadcast by other workers as they arrive.
+        """
+        io_loop.add_handler(self._listener.fileno(), self._receive_broadcasts, io_loop.READ)
+        self._receive_broadcasts()
+        
+    def _receive_broadcasts(self, fd=None, events=None):
+        self._listener.poll()
+        while self._listener.notifies:
+            message = json.loads(self._listener.notifies.pop(0).payload)
+            if message.pop('origin') == os.getpid():
+                continue
+            getattr(self, '_apply_{kind}'.format(kind=message.pop('kind')))(**message)
+            
+    def _broadcast(self, cursor, kind, **message):
+        if self._listener is None: #Nobody else to tell
+            return
+        message.update({
+            'kind': kind,
+            'origin': os.getpid(),
+        })
+        cursor.execute("""SELECT pg_notify(%(channel)s, %(message)s)""", {
+            'channel': _BROADCAST_CHANNEL,
+            'message': json.dumps(message),
+        })
+        
+    def _connect_explainer(self):
+        """
+        Returns a connection for the slow-query log, with the prepared
+        statements it may need to explain, left in manual-commit mode.
+        """
+        connection = psycopg2.connect(**self._get_connection_parameters())
+        _prepare_statements(connection)
+        connection.commit()
+        return connection
+        
+    def _get_maintenance_connection(self):
+        """
+        Returns the connection prices are maintained on, opened on first use
+        and kept apart from the pool so maintenance never holds up requests.
+        It's in autocommit mode.
+        """
+        if self._maintenance_connection is None or self._maintenance_connection.closed:
+            self._maintenance_connection = psycopg2.connect(**self._get_connection_parameters())
+            self._maintenance_connection.set_session(autocommit=True)
+        return self._maintenance_connection
         
     def _iterate_results(self, cursor, buffer_size=128):
         while True:
@@ -186,19 +328,22 @@ class _Database(object):
                 break
                 
     def _get_cache_data(self):
+        item_count = priced_count = 0
         with self._pool.get_cursor() as cursor:
-            cursor.execute("""SELECT DISTINCT ON (items.id) items.id, items.hq, prices.ts, prices.value,
+            #item_latest is kept by triggers on prices, including when the latest expires into prices_hourly
+            cursor.execute("""SELECT items.id, items.hq, item_latest.ts, item_latest.value, item_latest.average,
                      base_items.name_en, base_items.name_ja, base_items.name_fr, base_items.name_de
                 FROM base_items,
-                     items LEFT OUTER JOIN prices ON (items.id = prices.item_id)
+                     items LEFT OUTER JOIN item_latest ON (items.id = item_latest.item_id)
                 WHERE base_items.id = items.base_item_id
-                ORDER BY items.id ASC, prices.ts DESC""")
-            for (item_id, hq, ts, value, name_en, name_ja, name_fr, name_de) in self._iterate_results(cursor, buffer_size=512):
-                if value:
+                ORDER BY items.id ASC""")
+            for (item_id, hq, ts, value, average, name_en, name_ja, name_fr, name_de) in self._iterate_results(cursor, buffer_size=512):
+                item_count += 1
+                if value is not None: #Zero is a valid price: nothing was for sale
+                    priced_count += 1
                     price = ItemPrice(
                         _datetime_to_epoch(ts), value, None, False
                     )
-                    average = self._items_compute_average(item_id)
                 else:
                     price = average = None
 
@@ -208,8 +353,200 @@ class _Database(object):
                     ),
                     average,
                 )
+        _logger.info("Loaded {count} items ({priced} priced)".format(
+            count=item_count,
+            priced=priced_count,
+        ))
+        
+    def _get_catalogue_digest(self):
+        with self._pool.get_cursor() as cursor:
+            cursor.execute("""SELECT MD5(STRING_AGG(
+                    items.id || ':' || items.hq || ':' || base_items.id || ':' ||
+                    base_items.name_en || ':' || base_items.name_ja || ':' || base_items.name_fr || ':' || base_items.name_de,
+                    ',' ORDER BY items.id))
+                FROM items, base_items
+                WHERE base_items.id = items.base_item_id""")
+            return cursor.fetchone()[0] or ''
+            
+    def _get_prices_since(self, high_water_ts):
+        """
+        Returns {item_id: (timestamp, value, average)} for the latest price
+        of every item priced at or after `high_water_ts`.
+        """
+        latest = {}
+        with self._pool.get_cursor() as cursor:
+            cursor.execute("""SELECT item_latest.item_id, item_latest.ts, item_latest.value, item_latest.average
+                FROM item_latest
+                WHERE item_latest.ts >= %(high_water)s""", {
+                'high_water': _epoch_to_datetime(high_water_ts),
+            })
+            for (item_id, ts, value, average) in self._iterate_results(cursor, buffer_size=512):
+                latest[item_id] = (_datetime_to_epoch(ts), value, average)
+        return latest
+        
+    def _get_changes_since(self, changed_ts):
+        """
+        Returns {item_id: (timestamp, value, average)} for every item whose
+        latest price changed at or after `changed_ts`, all None for those
+        left with no price.
+        """
+        changes = {}
+        with self._pool.get_cursor() as cursor:
+            cursor.execute("""SELECT item_latest_removed.item_id
+                FROM item_latest_removed
+                WHERE item_latest_removed.changed >= %(changed)s""", {
+                'changed': _epoch_to_datetime(changed_ts),
+            })
+            for (item_id,) in cursor.fetchall():
+                changes[item_id] = (None, None, None)
+            #An item priced again since its removal has a row here too, which supersedes it
+            cursor.execute("""SELECT item_latest.item_id, item_latest.ts, item_latest.value, item_latest.average
+                FROM item_latest
+                WHERE item_latest.changed >= %(changed)s""", {
+                'changed': _epoch_to_datetime(changed_ts),
+            })
+            for (item_id, ts, value, average) in self._iterate_results(cursor, buffer_size=512):
+                changes[item_id] = (_datetime_to_epoch(ts), value, average)
+        return changes
+        
+    def _get_snapshot_cache_data(self, path):
+        snapshot_data = snapshot.read(path, self._catalogue_digest)
+        if snapshot_data is None:
+            return None
+        (written_ts, high_water_ts, items) = snapshot_data
+        changes = self._get_changes_since(high_water_ts - _SNAPSHOT_MARGIN)
+        
+        #Averages are relative to the current time, so an old snapshot's are all stale
+        stale = time.time() - written_ts >= _THREE_HOURS
+        averages = stale and self._items_compute_averages() or {}
+        
+        item_refs = []
+        changed = 0
+        for (item_id, hq, names, timestamp, value, average) in items:
+            current = changes.get(item_id)
+            if current is not None and current[:2] != (timestamp, value): #Priced or deleted since it was written
+                changed += 1
+                (timestamp, value, average) = current
+            if stale:
+                average = averages.get(item_id)
+                
+            if timestamp is None:
+                price = average = None
+            else:
+                price = ItemPrice(timestamp, value, None, False)
+            item_refs.append(ItemRef(
+                ItemState(ItemName(*names), item_id, hq, price),
+                average,
+            ))
+        _logger.info("Restored {count} items from snapshot; {changed} changed since it was written at {written}".format(
+            count=len(items),
+            changed=changed,
+            written=_epoch_to_datetime(written_ts),
+        ))
+        return item_refs
+        
+    def _load_catalogue(self):
+        with self._pool.get_cursor() as cursor:
+            cursor.execute("""SELECT base_items.id, base_items.name_en, base_items.name_ja, base_items.name_fr, base_items.name_de, base_items.lodestone_id
+                FROM base_items""")
+            base_items = cursor.fetchall()
+            cursor.execute("""SELECT items.id, items.base_item_id, items.hq
+                FROM items""")
+            items = cursor.fetchall()
+            cursor.execute("""SELECT related_crafted_from.base_item_id, related_crafted_from.related_base_item_id
+                FROM related_crafted_from""")
+            crafted_from = cursor.fetchall()
+            cursor.execute("""SELECT related_crafts_into.base_item_id, related_crafts_into.related_base_item_id
+                FROM related_crafts_into""")
+            crafts_into = cursor.fetchall()
+        return catalogue.Catalogue(base_items, items, crafted_from, crafts_into)
+        
+    def catalogue_reload(self):
+        """
+        Rereads the catalogue once data/items.sql has been reloaded, and has
+        every other worker do the same.
+        """
+        self._reload_catalogue()
+        with self._pool.get_cursor() as cursor:
+            self._broadcast(cursor, 'catalogue_reloaded')
+            
+    def _apply_catalogue_reloaded(self):
+        #Rebuilding the cache takes seconds, far too long to hold up the IOLoop
+        thread = threading.Thread(target=self._reload_catalogue, name='catalogue-reload')
+        thread.daemon = True
+        thread.start()
+        
+    def _reload_catalogue(self):
+        with self._catalogue_lock:
+            start_time = time.time()
+            self._catalogue = self._load_catalogue()
+            catalogue_digest = self._get_catalogue_digest()
+            if catalogue_digest == self._catalogue_digest:
+                _logger.info("Catalogue reloaded in {duration:.2f}s".format(duration=(time.time() - start_time)))
+                return
                 
-    def users_create(self, username, password):
+            #Items were added or renamed, which the cache and name index hold too
+            high_water_ts = int(start_time) - 1
+            item_cache = cache.Cache(self._get_cache_data())
+            names = search.NameIndex(item_cache.query(list), ItemName._fields)
+            (self._cache, self._names, self._catalogue_digest) = (item_cache, names, catalogue_digest)
+            
+            #Prices that went into the old cache while the new one was loading
+            latest = self._get_prices_since(high_water_ts)
+            item_cache.update_many(
+                (item_id, timestamp, value, average)
+                for (item_id, (timestamp, value, average)) in latest.iteritems()
+            )
+            _logger.info("Catalogue and cache reloaded in {duration:.2f}s; {caught_up} items caught up".format(
+                duration=(time.time() - start_time),
+                caught_up=len(latest),
+            ))
+            
+    def prices_maintain(self):
+        """
+        Adds the coming months' partitions to prices, summarises and drops
+        prices older than data.prices.retention_days, and re-syncs the count
+        of flags. Meant to run periodically, off the IOLoop, in just one
+        worker, on its own connection.
+        """
+        try:
+            start_time = time.time()
+            current_time = int(start_time)
+            horizon = _epoch_to_datetime(maintenance.get_horizon(current_time, self._retention_days))
+            with self._get_maintenance_connection().cursor() as cursor:
+                partitioned = maintenance.is_partitioned(cursor)
+                if partitioned:
+                    for name in maintenance.create_partitions(cursor, current_time, _PARTITIONS_AHEAD):
+                        _logger.info("Added partition {name}".format(name=name))
+                (expired, items) = maintenance.expire(cursor, horizon, _EXPIRY_BATCH_SIZE)
+                if partitioned:
+                    for name in maintenance.drop_partitions(cursor, horizon):
+                        _logger.info("Dropped partition {name}".format(name=name))
+                self._flags_recount(cursor)
+            _logger.info("Expired {expired} prices of {items} items from before {horizon} in {duration:.2f}s".format(
+                expired=expired,
+                items=items,
+                horizon=horizon,
+                duration=(time.time() - start_time),
+            ))
+        except Exception as e:
+            _logger.error("Unable to maintain prices: {error}".format(error=e))
+            if self._maintenance_connection is not None:
+                self._maintenance_connection.close() #Start afresh next time
+            
+    def slow_queries_list(self):
+        return self._slow_queries.list()
+        
+    def cache_save_snapshot(self):
+        path = CONFIG['server']['cache']['snapshot_path']
+        if path:
+            try:
+                high_water_ts = time.time()
+                snapshot.write(path, self._cache.query(list), self._catalogue_digest, high_water_ts)
+            except (IOError, OSError) as e: #The next attempt may fare better
+                _logger.error("Unable to write snapshot {path}: {error}".format(path=path, error=e))
+            
+    def users_create(self, username, pwhash, salt):
         with self._pool.get_cursor() as cursor:
             _logger.info("Clearing out stale registrations...")
             cursor.execute("""DELETE
@@ -222,10 +559,12 @@ class _Database(object):
                 USING users
                 WHERE watchlist.user_id = users.id
                   AND users.last_seen_ts <> NULL
-                  AND users.last_seen_ts < (current_date - integer '28')""")
-            
-            salt = bcrypt.gensalt()
-            pwhash = bcrypt.hashpw(password, salt)
+                  AND users.last_seen_ts < (current_date - integer '28')
+                RETURNING watchlist.user_id""")
+            for user_id in set(user_id for (user_id,) in cursor.fetchall()):
+                self._watchlists.clear(user_id)
+                self._broadcast(cursor, 'watchlist_cleared', user_id=user_id)
+                
             _logger.info("Creating registration for user {user}...".format(
                 user=username,
             ))
@@ -237,26 +576,21 @@ class _Database(object):
                 'salt': salt,
             })
             
-    def users_set_recovery_password(self, username, password):
+    def users_get_credentials(self, username):
         with self._pool.get_cursor() as cursor:
-            cursor.execute("""SELECT users.id, users.password_salt, users.status
+            cursor.execute("""SELECT users.id, users.password_hash, users.password_salt, users.status
                 FROM users
                 WHERE users.name = %(name)s
                 LIMIT 1""", {
                 'name': username,
             })
-            user = cursor.fetchone()
-            if not user:
-                return False
-                
-            (user_id, salt, status) = user
-            if status == USER_STATUS_BANNED:
-                return False
-                
-            pwhash = bcrypt.hashpw(password, salt)
-            _logger.info("Creating password candidate for user {user}...".format(
-                user=username,
-            ))
+            return cursor.fetchone()
+            
+    def users_set_recovery_password(self, user_id, pwhash):
+        _logger.info("Creating password candidate for user {id}...".format(
+            id=user_id,
+        ))
+        with self._pool.get_cursor() as cursor:
             cursor.execute("""UPDATE users
                 SET
                     password_hash_candidate = %(pwhash)s,
@@ -265,7 +599,6 @@ class _Database(object):
                 'user_id': user_id,
                 'pwhash': pwhash,
             })
-            return True
             
     def users_accept_recovery_password(self, user_id):
         with self._pool.get_cursor() as cursor:
@@ -278,38 +611,6 @@ class _Database(object):
                 'user_id': user_id,
             })
             
-    def users_login(self, username, password):
-        with self._pool.get_cursor() as cursor:
-            cursor.execute("""SELECT users.id, users.password_hash, users.password_salt, users.status
-                FROM users
-                WHERE users.name = %(name)s
-                LIMIT 1""", {
-                'name': username,
-            })
-            result = cursor.fetchone()
-            if result is not None:
-                (user_id, password_hash, password_salt, status) = result
-                if status == USER_STATUS_BANNED:
-                    _logger.info("User {user} failed to log in: banned".format(
-                        user=username,
-                    ))
-                    return -1
-                    
-                if bcrypt.hashpw(password, password_salt) == password_hash:
-                    _logger.info("User {user} logged in".format(
-                        user=username,
-                    ))
-                    return user_id
-                else:
-                    _logger.info("User {user} failed to log in: incorrect password".format(
-                        user=username,
-                    ))
-            else:
-                _logger.info("User {user} does not exist".format(
-                    user=username,
-                ))
-            return None
-            
     def users_mark_active(self, user_id):
         with self._pool.get_cursor() as cursor:
             cursor.execute("""UPDATE users
@@ -373,7 +674,11 @@ class _Database(object):
                 self._iterate_results(cursor)
             )
             
-            cursor.execute("""SELECT COUNT(prices.submitting_user)
+            cursor.execute("""SELECT COUNT(prices.submitting_user) + COALESCE((
+                    SELECT prices_expired_counts.count
+                    FROM prices_expired_counts
+                    WHERE prices_expired_counts.user_id = %(user_id)s
+                ), 0)
                 FROM prices
                 WHERE prices.submitting_user = %(user_id)s""", {
                 'user_id': user_id,
@@ -438,6 +743,7 @@ class _Database(object):
                 'status': status,
                 'user_id': user_id,
             })
+            self._identity_changed(cursor, user_id)
             
     def users_set_anonymous(self, user_id, anonymous):
         _logger.info("Changing user {id}'s visibility={visibility}...".format(
@@ -452,6 +758,7 @@ class _Database(object):
                 'anonymous': anonymous,
                 'user_id': user_id,
             })
+            self._identity_changed(cursor, user_id)
             
     def users_set_language(self, user_id, language):
         _logger.info("Changing user {id}'s language={language}...".format(
@@ -466,16 +773,40 @@ class _Database(object):
                 'language': language,
                 'user_id': user_id,
             })
+            self._identity_changed(cursor, user_id)
             
+    def _identity_changed(self, cursor, user_id):
+        self._identities.invalidate(user_id)
+        self._broadcast(cursor, 'identity_changed', user_id=user_id)
+        
+    def _apply_identity_changed(self, user_id):
+        self._identities.invalidate(user_id)
+        
+    def users_get_cached_identity(self, user_id):
+        """
+        Returns (True, identity) if the identity can be had without a query,
+        (False, None) otherwise.
+        """
+        if user_id is None:
+            return (True, None)
+        (cached, identity) = self._identities.get(user_id)
+        return (cached, cached and identity or None)
+        
     def users_get_identity(self, user_id):
+        if user_id is None:
+            return None
+        (cached, identity) = self._identities.get(user_id)
+        if cached:
+            return identity
+        token = identity
+        
         with self._pool.get_cursor() as cursor:
-            cursor.execute("""SELECT users.name, users.language, users.status, users.anonymous
-                FROM users
-                WHERE users.id = %(user_id)s
-                LIMIT 1""", {
+            cursor.execute("""EXECUTE users_get_identity (%(user_id)s)""", {
                 'user_id': user_id,
             })
-            return cursor.fetchone()
+            identity = cursor.fetchone()
+        self._identities.set(user_id, identity, token)
+        return identity
             
     def interactions_record(self, subject, actor, action, comment):
         with self._pool.get_cursor() as cursor:
@@ -489,114 +820,160 @@ class _Database(object):
             })
             
     def items_search(self, language, filter, limit):
-        with self._pool.get_cursor() as cursor:
-            cursor.execute("""SELECT base_items.name_{language}, items.id, items.hq
-                FROM items, base_items
-                WHERE LOWER(base_items.name_{language}) LIKE %(filter)s
-                  AND base_items.id = items.base_item_id
-                ORDER BY base_items.name_{language} ASC, items.hq ASC
-                LIMIT %(limit)s""".format(language=language), {
-                'filter': '%{v}%'.format(v=filter.lower()),
-                'limit': limit,
-            })
-            return list(self._iterate_results(cursor))
+        return self._names.search(language, filter, limit)
             
     def items_get_properties(self, language, item_id):
-        with self._pool.get_cursor() as cursor:
-            cursor.execute("""SELECT base_items.name_{language}, base_items.id, base_items.lodestone_id, items.hq
-                FROM items, base_items
-                WHERE items.id = %(item_id)s
-                  AND base_items.id = items.base_item_id
-                LIMIT 1""".format(language=language), {
-                'item_id': item_id,
-            })
-            return cursor.fetchone()
-            
+        return self._catalogue.get_properties(language, item_id)
+        
     def items_get_hq_variant_id(self, xivdb_item_id, hq):
-        with self._pool.get_cursor() as cursor:
-            cursor.execute("""SELECT items.id
-                FROM items
-                WHERE items.base_item_id = %(xivdb_item_id)s
-                  AND items.hq = %(hq)s
-                LIMIT 1""", {
-                'xivdb_item_id': xivdb_item_id,
-                'hq': hq,
-            })
-            return cursor.fetchone()
-            
+        return self._catalogue.get_variant_id(xivdb_item_id, hq)
+        
     def items_get_latest_by_id(self, item_id):
         return self._cache.get_item_by_id(item_id)
         
     def items_query(self, query):
         return self._cache.query(query)
         
-    def _query__items_get_recently_updated(self, limit, max_age, items):
-        candidates = [i for i in items if i.item_state.price and i.item_state.price.timestamp > max_age]
-        return sorted(candidates, key=(lambda i: i.item_state.price.timestamp), reverse=True)[:limit]
+    def _query__items_get_recently_updated(self, limit, max_age, indexes):
+        return cache.walk(indexes.timestamps, max_age + 1, None, limit, reverse=True)
     def items_get_recently_updated(self, limit, max_age):
-        return self._cache.query(lambda items: self._query__items_get_recently_updated(limit, max_age, items))
+        return self._cache.select_indexed(lambda indexes: self._query__items_get_recently_updated(limit, max_age, indexes))
         
-    def _query__items_get_most_valuable(self, limit, max_age, min_value, max_value, items):
-        candidates = [i for i in items if i.item_state.price and i.item_state.price.timestamp > max_age and min_value <= i.item_state.price.value <= max_value]
-        return sorted(candidates, key=(lambda i: i.item_state.price.value), reverse=True)[:limit]
+    def _query__items_get_most_valuable(self, limit, max_age, min_value, max_value, indexes):
+        return cache.walk(
+            indexes.values, cache.value_key(min_value, 0), cache.value_key(max_value + 1, 0), limit, reverse=True,
+            where=(lambda keys: cache.value_key_timestamps(keys) > max_age),
+        )
     def items_get_most_valuable(self, limit, max_age, min_value, max_value):
-        return self._cache.query(lambda items: self._query__items_get_most_valuable(limit, max_age, min_value, max_value, items))
+        return self._cache.select_indexed(lambda indexes: self._query__items_get_most_valuable(limit, max_age, min_value, max_value, indexes))
         
-    def _query__items_get_no_supply(self, limit, max_age, items):
-        candidates = [i for i in items if i.item_state.price and i.item_state.price.timestamp > max_age and i.item_state.price.value == 0]
-        return sorted(candidates, key=(lambda i: i.item_state.price.timestamp), reverse=True)[:limit]
+    def _query__items_get_no_supply(self, limit, max_age, indexes):
+        return cache.walk(indexes.values, cache.value_key(0, max_age + 1), cache.value_key(1, 0), limit, reverse=True)
     def items_get_no_supply(self, limit, max_age):
-        return self._cache.query(lambda items: self._query__items_get_no_supply(limit, max_age, items))
+        return self._cache.select_indexed(lambda indexes: self._query__items_get_no_supply(limit, max_age, indexes))
         
-    def _query__items_get_stale(self, limit, min_age, max_age, items):
-        candidates = [i for i in items if i.item_state.price and max_age < i.item_state.price.timestamp < min_age]
-        return sorted(candidates, key=(lambda i: i.item_state.price.timestamp))[:limit]
+    def _query__items_get_stale(self, limit, min_age, max_age, indexes):
+        return cache.walk(indexes.timestamps, max_age + 1, min_age, limit)
     def items_get_stale(self, limit, min_age, max_age):
-        return self._cache.query(lambda items: self._query__items_get_stale(limit, min_age, max_age, items))
-        
-    def _items_compute_average(self, item_id):
-        #Computes the average price from -12h to -36h
-        current_time = int(time.time())
-        end_time = current_time - _TWELVE_HOURS
-        start_time = end_time - _TWELVE_HOURS
-        timeslices = collections.defaultdict(list)
+        return self._cache.select_indexed(lambda indexes: self._query__items_get_stale(limit, min_age, max_age, indexes))
         
+    def _items_compute_averages(self, item_ids=None):
+        #Computes the average price from -12h to -36h for every item with
+        #data in that window (or just those in item_ids) in a single pass;
+        #prices_averages() is shared with the triggers that keep item_latest
+        end_time = int(time.time()) - _TWELVE_HOURS
         with self._pool.get_cursor() as cursor:
-            cursor.execute("""SELECT prices.ts, prices.value
-                FROM prices
-                WHERE prices.item_id = %(item_id)s
-                  AND prices.ts < %(end_ts)s
-                  AND prices.ts > %(start_ts)s""", {
-                'item_id': item_id,
+            cursor.execute("""SELECT averages.item_id, averages.average
+                FROM prices_averages({item_ids}, %(end_ts)s) AS averages""".format(
+                    item_ids=(item_ids is None and "ARRAY(SELECT items.id FROM items)" or "%(item_ids)s"),
+                ), {
+                'item_ids': item_ids is not None and list(item_ids) or None,
                 'end_ts': _epoch_to_datetime(end_time),
-                'start_ts': _epoch_to_datetime(start_time),
             })
-            for (ts, value) in self._iterate_results(cursor):
-                if value:
-                    timestamp = end_time - _datetime_to_epoch(ts)
-                    timeslices[int(timestamp / _THREE_HOURS)].append(value)
-        if len(timeslices) == 0:
-            return None
-        return int(sum(((max(v) + min(v)) / 2.0) for v in timeslices.values()) / len(timeslices))
+            return dict(self._iterate_results(cursor, buffer_size=512))
+            
+    def _query__items_get_averaged(self, current_time, columns):
+        #Items with prices in their average's window, or with an average that's about to lapse
+        return numpy.flatnonzero((columns.timestamps > current_time - _TWELVE_HOURS * 2) | (columns.averages != cache.NO_PRICE))
+    def _items_get_averaged(self, current_time):
+        return [
+            item_ref.item_state.id
+            for item_ref in self._cache.select(lambda columns: self._query__items_get_averaged(current_time, columns))
+        ]
+        
+    def _items_refresh_averages(self, item_ids):
+        with self._pool.get_cursor() as cursor:
+            cursor.execute("""SELECT item_latest_average(%(item_ids)s)""", {
+                'item_ids': item_ids,
+            })
+            cursor.execute("""SELECT item_latest.item_id, item_latest.average
+                FROM item_latest
+                WHERE item_latest.item_id = ANY(%(item_ids)s)""", {
+                'item_ids': item_ids,
+            })
+            averages = cursor.fetchall()
+            self._cache.set_averages(averages)
+            self._broadcast(cursor, 'averages_refreshed', averages=averages)
+            
+    def _apply_averages_refreshed(self, averages):
+        self._cache.set_averages(averages)
+        
+    def items_refresh_averages(self):
+        """
+        Recomputes the next batches of averages that may have drifted as
+        time passed, persisting them to item_latest. Meant to run
+        periodically, off the IOLoop, in just one worker.
+        """
+        self._averages.tick()
+        
+    def _cache_set_price(self, item_id, price, average):
+        self._cache.update(item_id, price.timestamp, price.value, average)
         
     def items_add_price(self, item_id, value, user_id):
+        self.items_add_prices(((item_id, value),), user_id)
+        
+    def items_add_prices(self, prices, user_id):
+        """
+        Records every (item ID, value) in `prices` at once; if an item
+        appears more than once, its last value is the one kept.
+        """
+        prices = collections.OrderedDict(prices)
+        if not prices:
+            return
         with self._pool.get_cursor() as cursor:
             cursor.execute("""INSERT
                 INTO prices(item_id, value, submitting_user)
-                VALUES(%(item_id)s, %(value)s, %(user_id)s)
-                RETURNING ts""", {
-                'item_id': item_id,
-                'value': value,
-                'user_id': user_id,
+                VALUES {rows}
+                RETURNING item_id, ts, value""".format(rows=', '.join(
+                    cursor.mogrify("(%s, %s, %s)", (item_id, value, user_id))
+                    for (item_id, value) in prices.iteritems()
+                )))
+            added = [
+                (item_id, _datetime_to_epoch(timestamp), value)
+                for (item_id, timestamp, value) in cursor.fetchall()
+            ]
+            
+            #Update the cache, with the averages the insert's trigger worked out
+            cursor.execute("""SELECT item_latest.item_id, item_latest.average
+                FROM item_latest
+                WHERE item_latest.item_id = ANY(%(item_ids)s)""", {
+                'item_ids': prices.keys(),
             })
-            price = ItemPrice(_datetime_to_epoch(cursor.fetchone()[0]), value, None, False)
+            averages = dict(cursor.fetchall())
+            added = [
+                (item_id, timestamp, value, averages.get(item_id))
+                for (item_id, timestamp, value) in added
+            ]
+            self._cache.update_many(added)
+            for start in xrange(0, len(added), _PRICES_BROADCAST_LIMIT): #data.prices.batch_limit may be any size
+                self._broadcast(cursor, 'prices_added', prices=added[start:start + _PRICES_BROADCAST_LIMIT])
+        push.HUB.publish(prices=added)
+        for (item_id, timestamp, value, average) in added:
+            self._rollups.add(item_id, timestamp, value)
             
-            #Update the cache
-            old_item_ref = self._cache.get_item_by_id(item_id)
-            self._cache.update(ItemRef(
-                ItemState(old_item_ref.item_state.name, item_id, old_item_ref.item_state.hq, price),
-                self._items_compute_average(item_id),
-            ))
+    def _apply_prices_added(self, prices):
+        (newer, older) = ([], [])
+        for (item_id, timestamp, value, average) in prices:
+            item_ref = self._cache.get_item_by_id(item_id)
+            if item_ref is None: #Not in this worker's catalogue until it's reloaded
+                continue
+            if not item_ref.item_state.price or item_ref.item_state.price.timestamp <= timestamp:
+                newer.append((item_id, timestamp, value, average))
+            else:
+                older.append(item_id)
+            self._rollups.add(item_id, timestamp, value)
+        self._cache.update_many(newer)
+        push.HUB.publish(prices=newer)
+        if older:
+            self._cache.touch(older)
+            
+    def _price_history_changed(self, item_id):
+        """
+        Accounts for a deletion, which rollups can't, and which needn't
+        change the cached latest price but does change the item's ETag.
+        """
+        self._rollups.invalidate(item_id)
+        self._cache.touch((item_id,))
             
     def items_delete_price(self, item_id, timestamp, user_id=None):
         statement = [
@@ -609,59 +986,200 @@ class _Database(object):
             statement.append("AND prices.submitting_user = %(user_id)s")
             
         with self._pool.get_cursor() as cursor:
+            cursor.execute("""SELECT COUNT(flags.price_ts)
+                FROM flags
+                WHERE flags.price_item_id = %(item_id)s
+                  AND flags.price_ts = %(timestamp)s""", {
+                'item_id': item_id,
+                'timestamp': _epoch_to_datetime(timestamp),
+            })
+            flagged = cursor.fetchone()[0]
+            
             latest_deleted = self._cache.delete(item_id, timestamp)
             cursor.execute('\n'.join(statement), {
                 'item_id': item_id,
                 'timestamp': _epoch_to_datetime(timestamp),
                 'user_id': user_id,
             })
-            
+            if flagged and cursor.rowcount: #Cascade cleaned up the flag
+                self._flags_changed(cursor, -flagged)
+                
+            latest = average = None
             if latest_deleted:
-                cursor.execute("""SELECT prices.ts, prices.value
-                    FROM prices
-                    WHERE prices.item_id = %(item_id)s
-                    ORDER BY prices.ts DESC
-                    LIMIT 1""", {
+                #The delete's trigger has already found the next latest price
+                cursor.execute("""SELECT item_latest.ts, item_latest.value, item_latest.average
+                    FROM item_latest
+                    WHERE item_latest.item_id = %(item_id)s""", {
                     'item_id': item_id,
                 })
-                result = cursor.fetchone()
-                if result is not None: #There's still data
-                    (timestamp, value) = result
-                    old_item_ref = self._cache.get_item_by_id(item_id)
-                    self._cache.update(ItemRef(
-                        ItemState(old_item_ref.item_state.name, item_id, old_item_ref.item_state.hq, ItemPrice(
-                            _datetime_to_epoch(timestamp),
-                            value, None, False,
-                        )),
-                        self._items_compute_average(item_id, hq),
-                    ))
-                    
-    def items_get_prices(self, item_id, limit=None, max_age=None):
-        query = [
-            "SELECT prices.ts, prices.value, users.id, users.name, users.anonymous, flags.price_ts "
-            "FROM users, "
-                "prices LEFT OUTER JOIN flags ON (flags.price_item_id = prices.item_id AND flags.price_ts = prices.ts) "
-            "WHERE prices.item_id = %(item_id)s "
-              "AND prices.submitting_user = users.id "
-        ]
-        if max_age is not None:
-            query.append("AND prices.ts > %(max_age)s")
-        query.append("ORDER BY prices.ts DESC")
-        if limit is not None:
-            query.append("LIMIT %(limit)s")
+                row = cursor.fetchone()
+                if row is not None: #There's still data
+                    (latest, average) = ((_datetime_to_epoch(row[0]), row[1]), row[2])
+                    self._cache_set_price(item_id, ItemPrice(latest[0], latest[1], None, False), average)
+            self._broadcast(cursor, 'price_deleted',
+                item_id=item_id, timestamp=timestamp, latest=latest, average=average,
+            )
+        self._price_history_changed(item_id)
+        self._publish_price_deleted(item_id, timestamp, latest_deleted, latest, average)
+        
+    def _apply_price_deleted(self, item_id, timestamp, latest, average):
+        latest_deleted = self._cache.delete(item_id, timestamp)
+        if latest_deleted and latest is not None:
+            self._cache_set_price(item_id, ItemPrice(latest[0], latest[1], None, False), average)
+        self._price_history_changed(item_id)
+        self._publish_price_deleted(item_id, timestamp, latest_deleted, latest, average)
+        
+    def _publish_price_deleted(self, item_id, timestamp, latest_deleted, latest, average):
+        prices = ()
+        if latest_deleted:
+            (latest_timestamp, latest_value) = latest or (None, None)
+            prices = ((item_id, latest_timestamp, latest_value, average),)
+        push.HUB.publish(prices=prices, deleted=((item_id, timestamp),))
             
+    def items_get_prices(self, item_id, limit=None, max_age=None):
+        """
+        Returns the item's ItemPrices, newest first. Where prices have
+        expired, each hour's last one is listed instead, with no reporter.
+        """
         with self._pool.get_cursor() as cursor:
-            cursor.execute('\n'.join(query), {
+            cursor.execute("""EXECUTE items_get_prices (%(item_id)s, %(max_age)s, %(limit)s)""", {
                 'item_id': item_id,
-                'max_age': _epoch_to_datetime(max_age),
+                'max_age': max_age is not None and _epoch_to_datetime(max_age) or None,
                 'limit': limit,
             })
             return [
-                ItemPrice(_datetime_to_epoch(timestamp), value, UserRef(username, user_id, user_anonymous), bool(flagged))
+                ItemPrice(_datetime_to_epoch(timestamp), value, user_id is not None and UserRef(username, user_id, user_anonymous) or None, bool(flagged))
                 for (timestamp, value, user_id, username, user_anonymous, flagged)
                 in self._iterate_results(cursor, buffer_size=512)
             ]
             
+    def items_get_missing_prices(self, item_id, timestamps):
+        """
+        Returns those of `timestamps` at which the item no longer has a price
+        listed by items_get_prices, in ascending order.
+        """
+        with self._pool.get_cursor() as cursor:
+            cursor.execute("""SELECT listed.ts
+                FROM UNNEST(%(timestamps)s::TIMESTAMP[]) AS listed(ts)
+                WHERE NOT EXISTS (
+                    SELECT 1
+                    FROM prices
+                    WHERE prices.item_id = %(item_id)s
+                      AND prices.ts = listed.ts
+                  )
+                  AND NOT EXISTS (
+                    SELECT 1
+                    FROM prices_hourly
+                    WHERE prices_hourly.item_id = %(item_id)s
+                      AND prices_hourly.hour = DATE_TRUNC('hour', listed.ts)
+                      AND prices_hourly.last_ts = listed.ts
+                  )
+                ORDER BY listed.ts""", {
+                'item_id': item_id,
+                'timestamps': [_epoch_to_datetime(timestamp) for timestamp in timestamps],
+            })
+            return [_datetime_to_epoch(timestamp) for (timestamp,) in cursor.fetchall()]
+            
+    def _items_get_price_values(self, item_id, min_timestamp):
+        with self._pool.get_cursor() as cursor:
+            #Expired prices' hourly extremes stand in for them
+            cursor.execute("""SELECT prices.ts, prices.value
+                FROM prices
+                WHERE prices.item_id = %(item_id)s
+                  AND prices.ts >= %(min_timestamp)s
+                UNION ALL
+                SELECT UNNEST(ARRAY[prices_hourly.low_ts, prices_hourly.high_ts]), UNNEST(ARRAY[prices_hourly.low_value, prices_hourly.high_value])
+                FROM prices_hourly
+                WHERE prices_hourly.item_id = %(item_id)s
+                  AND prices_hourly.hour >= DATE_TRUNC('hour', %(min_timestamp)s)""", {
+                'item_id': item_id,
+                'min_timestamp': _epoch_to_datetime(min_timestamp),
+            })
+            return [
+                (_datetime_to_epoch(timestamp), value)
+                for (timestamp, value) in self._iterate_results(cursor, buffer_size=512)
+            ]
+            
+    def items_get_analytics(self, item_id, current_time):
+        """
+        Returns the item's rollups.Analytics as of `current_time`.
+        """
+        return self._rollups.get_analytics(item_id, current_time)
+        
+    def items_get_etag(self, item_id, current_time):
+        """
+        Returns a tag for the item's latest price and analytics as of
+        `current_time`, worked out from the cache alone, or None if the item
+        isn't known. It changes with the item's prices, whenever the
+        analytics' window moves on a slice, and on restart or the cache
+        being rebuilt.
+        """
+        fingerprint = self._cache.get_fingerprint(item_id)
+        if fingerprint is None:
+            return None
+        timescale = analytics.get_timescale(CONFIG['graphing']['days'], CONFIG['graphing']['data_points'])
+        return hashlib.sha1(':'.join(
+            str(part) for part in (STARTED, self._catalogue_digest, item_id, current_time // timescale) + fingerprint
+        )).hexdigest()
+        
+    def items_get_analytics_many(self, item_ids, current_time):
+        """
+        Returns {item_id: analytics.Analytics} for all of `item_ids`, analysed
+        together in one pass, for consumers like dashboards and exports
+        that cover too many items to go through rollups.
+        """
+        item_ids = sorted(set(item_ids))
+        timescale = analytics.get_timescale(CONFIG['graphing']['days'], CONFIG['graphing']['data_points'])
+        oldest_slice = current_time // timescale - CONFIG['graphing']['data_points'] + 1
+        with self._pool.get_cursor() as cursor:
+            cursor.execute("""SELECT history.item_id, FLOOR(EXTRACT(EPOCH FROM history.ts))::BIGINT, history.value
+                FROM (
+                    SELECT prices.item_id, prices.ts, prices.value
+                    FROM prices
+                    WHERE prices.item_id = ANY(%(item_ids)s)
+                      AND prices.ts >= %(min_timestamp)s
+                    UNION ALL
+                    SELECT prices_hourly.item_id, UNNEST(ARRAY[prices_hourly.low_ts, prices_hourly.high_ts]), UNNEST(ARRAY[prices_hourly.low_value, prices_hourly.high_value])
+                    FROM prices_hourly
+                    WHERE prices_hourly.item_id = ANY(%(item_ids)s)
+                      AND prices_hourly.hour >= DATE_TRUNC('hour', %(min_timestamp)s)
+                ) AS history
+                ORDER BY history.item_id""", {
+                'item_ids': item_ids,
+                'min_timestamp': _epoch_to_datetime(oldest_slice * timescale),
+            })
+            prices = numpy.array(cursor.fetchall(), dtype=numpy.int64).reshape(-1, 3)
+            
+        starts = numpy.searchsorted(prices[:, 0], item_ids, side='left')
+        ends = numpy.searchsorted(prices[:, 0], item_ids, side='right')
+        return dict(zip(item_ids, analytics.analyse_many(
+            ((prices[start:end, 1], prices[start:end, 2]) for (start, end) in zip(starts, ends)),
+            current_time, timescale, CONFIG['graphing']['data_points'],
+        )))
+        
+    def _flags_changed(self, cursor, delta):
+        self._apply_flags_changed(delta)
+        self._broadcast(cursor, 'flags_changed', delta=delta)
+        
+    def _apply_flags_changed(self, delta):
+        with self._flags_lock:
+            self._flags_count += delta
+            
+    def _flags_recount(self, cursor):
+        """
+        Takes the count of flags afresh, for those that went with their
+        prices or items without passing through _flags_changed.
+        """
+        cursor.execute("""SELECT COUNT(flags.price_ts)
+            FROM flags""")
+        count = cursor.fetchone()[0]
+        self._apply_flags_counted(count)
+        self._broadcast(cursor, 'flags_counted', count=count)
+        
+    def _apply_flags_counted(self, count):
+        with self._flags_lock:
+            self._flags_count = count
+            
     def flags_create(self, item_id, timestamp, reporter):
         with self._pool.get_cursor() as cursor:
             cursor.execute("""INSERT
@@ -671,6 +1189,7 @@ class _Database(object):
                 'timestamp': _epoch_to_datetime(timestamp),
                 'reporter': reporter,
             })
+            self._flags_changed(cursor, cursor.rowcount)
             
     def flags_list(self):
         with self._pool.get_cursor() as cursor:
@@ -709,10 +1228,7 @@ class _Database(object):
             )
                         
     def flags_count(self):
-        with self._pool.get_cursor() as cursor:
-            cursor.execute("""SELECT COUNT(flags.price_ts)
-                FROM flags""")
-            return cursor.fetchone()[0]
+        return self._flags_count
             
     def flags_resolve(self, item_id, timestamp, delete):
         timestamp = _epoch_to_datetime(timestamp)
@@ -727,6 +1243,7 @@ class _Database(object):
                     'timestamp': timestamp,
                 })
             (reported_by, submitting_user) = cursor.fetchone()
+            self._flags_changed(cursor, -1)
             
             if delete: #Cascade will clean up the flag
                 cursor.execute("""DELETE
@@ -754,7 +1271,24 @@ class _Database(object):
                 'reporter': reported_by,
                 'deleted': delete,
             })
+            if delete:
+                self._broadcast(cursor, 'rollup_invalidated', item_id=item_id)
+        if delete:
+            self._price_history_changed(item_id)
+            
+    def _apply_rollup_invalidated(self, item_id):
+        self._price_history_changed(item_id)
             
+    def _apply_watchlist_changed(self, user_id, item_id, watching):
+        if watching:
+            self._watchlists.add(user_id, item_id)
+        else:
+            self._watchlists.remove(user_id, item_id)
+            
+    def _apply_watchlist_cleared(self, user_id):
+        self._watchlists.clear(user_id)
+        
+    #Watchlists are written to the database, then to memory, where they're read from
     def watchlist_add(self, user_id, item_id):
         with self._pool.get_cursor() as cursor:
             cursor.execute("""INSERT
@@ -763,6 +1297,8 @@ class _Database(object):
                 'user_id': user_id,
                 'item_id': item_id,
             })
+            self._watchlists.add(user_id, item_id)
+            self._broadcast(cursor, 'watchlist_changed', user_id=user_id, item_id=item_id, watching=True)
             
     def watchlist_remove(self, user_id, item_id):
         with self._pool.get_cursor() as cursor:
@@ -773,67 +1309,56 @@ class _Database(object):
                 'user_id': user_id,
                 'item_id': item_id,
             })
-            
+            self._watchlists.remove(user_id, item_id)
+            if cursor.rowcount:
+                self._broadcast(cursor, 'watchlist_changed', user_id=user_id, item_id=item_id, watching=False)
+                
     def watchlist_list(self, user_id):
-        with self._pool.get_cursor() as cursor:
-            cursor.execute("""SELECT watchlist.item_id
-                FROM watchlist
-                WHERE watchlist.user_id = %(user_id)s""", {
-                'user_id': user_id,
-            })
-            return [self._cache.get_item_by_id(i[0]) for i in self._iterate_results(cursor)]
-            
+        return [self._cache.get_item_by_id(item_id) for item_id in self._watchlists.list(user_id)]
+        
     def watchlist_is_watching(self, user_id, item_id):
-        with self._pool.get_cursor() as cursor:
-            cursor.execute("""SELECT 0
-                FROM watchlist
-                WHERE watchlist.user_id = %(user_id)s
-                  AND watchlist.item_id = %(item_id)s
-                LIMIT 1""", {
-                'user_id': user_id,
-                'item_id': item_id,
-            })
-            return bool(cursor.fetchone())
-            
+        return self._watchlists.is_watching(user_id, item_id)
+        
     def watchlist_count(self, user_id):
-        with self._pool.get_cursor() as cursor:
-            cursor.execute("""SELECT COUNT(watchlist.item_id)
-                FROM watchlist
-                WHERE watchlist.user_id = %(user_id)s""", {
-                'user_id': user_id,
-            })
-            return cursor.fetchone()[0]
-            
+        return self._watchlists.count(user_id)
+        
     def watchlist_get_most_watched(self, limit=None):
-        query = [
-            "SELECT COUNT(watchlist.item_id) as item_count, watchlist.item_id "
-            "FROM watchlist "
-            "GROUP BY watchlist.item_id "
-            "ORDER BY item_count DESC ",
-        ]
-        if limit is not None:
-            query.append("LIMIT %(limit)s")
-            
-        with self._pool.get_cursor() as cursor:
-            cursor.execute('\n'.join(query), {
-                'limit': limit,
-            })
-            return [self._cache.get_item_by_id(i[1]) for i in self._iterate_results(cursor)]
+        return [self._cache.get_item_by_id(item_id) for item_id in self._watchlists.get_most_watched(limit)]
             
     def related_get(self, base_item_id):
-        with self._pool.get_cursor() as cursor:
-            cursor.execute("""SELECT items.id
-                FROM related_crafted_from, items
-                WHERE related_crafted_from.base_item_id = %(base_item_id)s
-                  AND related_crafted_from.related_base_item_id = items.base_item_id""", {
-                'base_item_id': base_item_id,
-            })
-            crafted_from = [self._cache.get_item_by_id(i[0]) for i in self._iterate_results(cursor)]
-            cursor.execute("""SELECT items.id
-                FROM related_crafts_into, items
-                WHERE related_crafts_into.base_item_id = %(base_item_id)s
-                  AND related_crafts_into.related_base_item_id = items.base_item_id""", {
-                'base_item_id': base_item_id,
-            })
-            return (crafted_from, [self._cache.get_item_by_id(i[0]) for i in self._iterate_results(cursor)])
+        (crafted_from, crafts_into) = self._catalogue.get_related(base_item_id)
+        return (
+            [self._cache.get_item_by_id(item_id) for item_id in crafted_from],
+            [self._cache.get_item_by_id(item_id) for item_id in crafts_into],
+        )
+        
+class _AsyncDatabase(object):
+    """
+    Offers every method of a _Database as one that returns a Future, running
+    the call on a pool of `max_workers` threads, so handlers can yield on
+    queries without stalling the IOLoop.
+    
+    No method checks out a second connection while holding one, so each
+    thread needs at most one. By default there's one thread fewer than the
+    database's pool has connections, leaving one for the queries handlers
+    still make on the IOLoop and for background jobs; those may yet wait
+    for a connection, up to the pool's checkout timeout, when both are busy.
+    """
+    _database = None
+    _executor = None
+    
+    def __init__(self, database, max_workers=None):
+        self._database = database
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=(max_workers or max(1, database.connections_max - 1)))
+        
+    def __getattr__(self, name):
+        method = getattr(self._database, name)
+        def submit(*args, **kwargs):
+            return self._executor.submit(method, *args, **kwargs)
+        setattr(self, name, submit)
+        return submit
+        
 DATABASE = _Database()
+ASYNC_DATABASE = _AsyncDatabase(DATABASE)
+#For periodic jobs, so they never occupy a thread requests are waiting for
+BACKGROUND_DATABASE = _AsyncDatabase(DATABASE, max_workers=1)
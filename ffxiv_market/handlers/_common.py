@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import collections
 import httplib
 import logging
 import os
@@ -8,6 +9,7 @@ import urllib
 
 import mako.template
 import mako.lookup
+import tornado.gen
 import tornado.web
 
 from ..common import (
@@ -19,7 +21,8 @@ from ..common import (
     USER_LANGUAGE_ENGLISH, USER_LANGUAGE_JAPANESE, USER_LANGUAGE_FRENCH, USER_LANGUAGE_GERMAN,
     USER_LANGUAGE_NAMES,
 )
-from ..db import DATABASE
+from .. import metrics
+from ..db import DATABASE, ASYNC_DATABASE
 
 _logger = logging.getLogger('handlers._common')
 
@@ -36,10 +39,60 @@ class _MakoEngine(object):
         )
         
     def render_page(self, template, **kwargs):
-        template = self._lookup.get_template(template)
-        return template.render(CONFIG=CONFIG, DATABASE=DATABASE, **kwargs)
+        with metrics.RENDER_DURATION.time(template):
+            template = self._lookup.get_template(template)
+            return template.render(CONFIG=CONFIG, DATABASE=DATABASE, **kwargs)
+        
+    def render_def(self, template, name, *args, **kwargs):
+        """
+        Renders a single <%def> from `template` to unicode, for embedding in
+        a page later.
+        """
+        with metrics.RENDER_DURATION.time('{template}:{name}'.format(template=template, name=name)):
+            template = self._lookup.get_template(template).get_def(name)
+            return template.render_unicode(*args, CONFIG=CONFIG, DATABASE=DATABASE, **kwargs)
 _MAKO_ENGINE = _MakoEngine()
 
+class _FragmentCache(object):
+    """
+    Rendered HTML that looks the same to every user who shares its key.
+    
+    Keys should include whatever the fragment was rendered from, so changes
+    are picked up at once; entries also expire after `ttl` seconds, because
+    the ages they show drift with the clock. The least recently used entries
+    are dropped first once there are more than `size`.
+    """
+    _lock = None
+    _entries = None
+    _size = None
+    _ttl = None
+    
+    def __init__(self, size, ttl):
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._size = size
+        self._ttl = ttl
+        
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[0] <= time.time():
+                return None
+            self._entries[key] = entry
+            return entry[1]
+            
+    def set(self, key, fragment):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + self._ttl, fragment)
+            while len(self._entries) > self._size:
+                self._entries.popitem(last=False)
+        return fragment
+_FRAGMENT_CACHE = _FragmentCache(
+    size=CONFIG['server']['cache']['fragments_limit'],
+    ttl=CONFIG['server']['cache']['fragments_ttl'],
+)
+
 _BAN_LOCK = threading.Lock()
 _BAN_LIST = set()
 def ADD_BAN(user_id): #Call any time a user is banned
@@ -65,17 +118,30 @@ def restrict_administrator(context):
     if not context['role']['administrator']:
         raise tornado.web.HTTPError(403, reason="Access is restricted to administrators")
         
+def get_authenticated_user(request_handler):
+    """
+    Returns the ID of the user the request's cookie names, unless they're
+    banned, or None.
+    """
+    user_id = request_handler.get_secure_cookie(CONFIG['cookies']['authentication']['identifier'])
+    if user_id:
+        user_id = int(user_id)
+        if not CHECK_BAN(user_id):
+            return user_id
+    return None
+    
 class Handler(tornado.web.RequestHandler):
+    _context = None #The most recently built common context, reused when rendering errors
+    
+    def on_finish(self):
+        metrics.REQUEST_DURATION.observe(
+            self.request.request_time(), type(self).__name__, self.request.method, self.get_status(),
+        )
+        
     def get_current_user(self):
-        user_id = self.get_secure_cookie(CONFIG['cookies']['authentication']['identifier'])
-        if user_id:
-            user_id = int(user_id)
-            if not CHECK_BAN(user_id):
-                return user_id
-        return None
+        return get_authenticated_user(self)
         
-    def _get_current_user_identity(self, user_id):
-        identity = DATABASE.users_get_identity(self.get_current_user())
+    def _format_identity(self, user_id, identity):
         if identity is None:
             return {
                 'user_id': user_id,
@@ -92,11 +158,18 @@ class Handler(tornado.web.RequestHandler):
             'anonymous': identity[3],
         }
         
-    def _build_common_context(self, page_title=None):
-        identity = self._get_current_user_identity(self.get_current_user())
-        moderator = identity['status'] in (USER_STATUS_MODERATOR, USER_STATUS_ADMINISTRATOR,)
+    @tornado.gen.coroutine
+    def _get_current_user_identity(self, user_id):
+        (cached, identity) = DATABASE.users_get_cached_identity(user_id)
+        if not cached:
+            identity = yield ASYNC_DATABASE.users_get_identity(user_id)
+        raise tornado.gen.Return(self._format_identity(user_id, identity))
         
-        return {
+    def _is_moderator(self, identity):
+        return identity['status'] in (USER_STATUS_MODERATOR, USER_STATUS_ADMINISTRATOR,)
+        
+    def _make_common_context(self, identity, flags_count, page_title=None):
+        context = {
             'rendering': {
                 'title': page_title,
                 'time_current': int(time.time()),
@@ -105,13 +178,21 @@ class Handler(tornado.web.RequestHandler):
             'identity': identity,
             'role': {
                 'active': identity['status'] in (USER_STATUS_ACTIVE, USER_STATUS_MODERATOR, USER_STATUS_ADMINISTRATOR,),
-                'moderator': moderator,
+                'moderator': self._is_moderator(identity),
                 'administrator': identity['status'] in (USER_STATUS_ADMINISTRATOR,),
             },
             'notifications': {
-                'flags': moderator and DATABASE.flags_count() or 0,
+                'flags': flags_count,
             },
         }
+        self._context = context
+        return context
+        
+    @tornado.gen.coroutine
+    def _build_common_context(self, page_title=None):
+        identity = yield self._get_current_user_identity(self.get_current_user())
+        flags_count = self._is_moderator(identity) and DATABASE.flags_count() or 0
+        raise tornado.gen.Return(self._make_common_context(identity, flags_count, page_title=page_title))
         
     def _refresh_auth_cookie(self, context):
         if context['identity']['user_id'] is not None:
@@ -120,8 +201,9 @@ class Handler(tornado.web.RequestHandler):
                 expires_days=CONFIG['cookies']['authentication']['longevity_days']
             )
             
+    @tornado.gen.coroutine
     def _common_setup(self, page_title=None, restrict=None):
-        context = self._build_common_context(
+        context = yield self._build_common_context(
             page_title=page_title,
         )
         
@@ -130,7 +212,20 @@ class Handler(tornado.web.RequestHandler):
         if restrict:
             restrict(context)
             
-        return context
+        raise tornado.gen.Return(context)
+        
+    def _get_fragment(self, key, render):
+        """
+        Returns the cached fragment for `key`. If there isn't one, `render`
+        is called to produce it.
+        """
+        fragment = _FRAGMENT_CACHE.get(key)
+        if fragment is None:
+            fragment = _FRAGMENT_CACHE.set(key, render())
+        return fragment
+        
+    def _render_fragment(self, context, template, name, *args):
+        return _MAKO_ENGINE.render_def(template, name, *args, **context)
         
     def _render(self, template, context, html_headers=()):
         self.set_header('Content-Type', 'text/html')
@@ -138,7 +233,21 @@ class Handler(tornado.web.RequestHandler):
         self.write(_MAKO_ENGINE.render_page(template, **context))
         
     def write_error(self, status_code, **kwargs):
-        context = self._build_common_context(page_title='Error {code}'.format(code=status_code))
+        #This can't yield, so reuse what the request already looked up where possible
+        page_title = 'Error {code}'.format(code=status_code)
+        if self._context is not None:
+            context = self._make_common_context(
+                self._context['identity'], self._context['notifications']['flags'], page_title=page_title,
+            )
+        else:
+            user_id = self.get_current_user()
+            (cached, identity) = DATABASE.users_get_cached_identity(user_id)
+            if not cached: #Shown as a guest, rather than stall the IOLoop on a query
+                (user_id, identity) = (None, None)
+            identity = self._format_identity(user_id, identity)
+            context = self._make_common_context(
+                identity, self._is_moderator(identity) and DATABASE.flags_count() or 0, page_title=page_title,
+            )
         reason = httplib.responses.get(status_code)
         exc = kwargs.get('exc_info')
         if exc:
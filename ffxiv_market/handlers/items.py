@@ -1,13 +1,18 @@
 # -*- coding: utf-8 -*-
-import collections
+import datetime
 import json
 import logging
+import time
 
+import tornado.gen
 import tornado.web
+import tornado.websocket
 
+from ..analytics import pad
+from ..push import HUB
 from _common import (
-    CONFIG, DATABASE,
-    Handler,
+    CONFIG, DATABASE, ASYNC_DATABASE,
+    Handler, get_authenticated_user,
     restrict_active, restrict_moderator, restrict_administrator,
     USER_STATUS_GUEST,
     USER_STATUS_PENDING, USER_STATUS_ACTIVE, USER_STATUS_BANNED,
@@ -36,218 +41,218 @@ del _crystal_list
 
 _logger = logging.getLogger('handlers.items')
 
-class ItemsHandler(Handler):
-    @tornado.web.authenticated
-    def get(self):
-        context = self._common_setup(page_title="Items")
-        context.update({
-            'crystal_list': _CRYSTAL_LIST,
-            'watch_count': DATABASE.watchlist_count(context['identity']['user_id']),
-            'watch_limit': CONFIG['lists']['item_watch']['limit'],
-        })
-        
-        self._render('items.html', context, html_headers=(
-            '<script src="/static/ajax.js"></script>',
-        ))
+#The dashboard's lists that look the same to everyone, by callback-ID prefix
+_SHARED_PANELS = (
+    ('cry', lambda current_time: [DATABASE.items_get_latest_by_id(id) for id in _CRYSTAL_LIST]),
+    ('nst', lambda current_time: DATABASE.items_get_no_supply(
+        limit=CONFIG['lists']['no_supply']['limit'],
+        max_age=(current_time - CONFIG['lists']['no_supply']['max_age']),
+    )),
+    ('sta', lambda current_time: DATABASE.items_get_stale(
+        limit=CONFIG['lists']['stale']['limit'],
+        min_age=(current_time - CONFIG['lists']['stale']['min_age']),
+        max_age=(current_time - CONFIG['lists']['stale']['max_age']),
+    )),
+    ('val', lambda current_time: DATABASE.items_get_most_valuable(
+        limit=CONFIG['lists']['most_valuable']['limit'],
+        max_age=(current_time - CONFIG['lists']['most_valuable']['max_age']),
+        min_value=CONFIG['lists']['most_valuable']['min_value'],
+        max_value=CONFIG['lists']['most_valuable']['max_value'],
+    )),
+    ('rec', lambda current_time: DATABASE.items_get_recently_updated(
+        limit=CONFIG['lists']['recently_updated']['limit'],
+        max_age=(current_time - CONFIG['lists']['recently_updated']['max_age']),
+    )),
+)
 
-class ItemHandler(Handler):
-    def _normalise_data(self, price_data, current_time):
-        data_points = CONFIG['graphing']['data_points']
-        timescale = int(_ONE_DAY * CONFIG['graphing']['days'] / float(data_points))
-        
-        ages = collections.defaultdict(list)
-        for price in price_data:
-            age = int((current_time - price.timestamp) / timescale)
-            if age >= data_points: #Data is too old to be relevant
-                break
-            ages[age].append(price.value)
-            
-        prices = []
-        for (age, pricing) in sorted(ages.items()):
-            prices.append((age, int((max(pricing) + min(pricing)) / 2)))
-        return (prices, timescale)
-        
-    def _compute_maxmin(self, price_data, current_time):
-        low_24h = low_week = low_month = None
-        low_24h_value = low_week_value = low_month_value = 999999999
-        high_24h = high_week = high_month = None
-        high_24h_value = high_week_value = high_month_value = 0
-        
-        timestamp_cutoff_month = current_time - _ONE_MONTH
-        timestamp_cutoff_week = current_time - _ONE_WEEK
-        timestamp_cutoff_24h = current_time - _ONE_DAY
-        
-        for datum in price_data:
-            datum_value = datum.value
-            datum_timestamp = datum.timestamp
-            if datum_timestamp >= timestamp_cutoff_month:
-                if datum_timestamp >= timestamp_cutoff_week:
-                    if datum_timestamp >= timestamp_cutoff_24h:
-                        if datum_value < low_24h_value:
-                            low_24h = datum
-                            low_24h_value = datum_value
-                        elif datum_value > high_24h_value:
-                            high_24h = datum
-                            high_24h_value = datum_value
-                    if datum_value < low_week_value:
-                        low_week = datum
-                        low_week_value = datum_value
-                    elif datum_value > high_week_value:
-                        high_week = datum
-                        high_week_value = datum_value
-                if datum_value < low_month_value:
-                    low_month = datum
-                    low_month_value = datum_value
-                elif datum_value > high_month_value:
-                    high_month = datum
-                    high_month_value = datum_value
-            else:
-                break
-            
-        return (
-            low_24h, low_week, low_month,
-            high_24h, high_week, high_month,
-        )
+def _build_items_context(context):
+    """
+    Fills in the dashboard's context, all but its panels, returning the
+    page's extra HTML headers.
+    """
+    user_id = context['identity']['user_id']
+    context.update({
+        'watch_count': DATABASE.watchlist_count(user_id),
+        'watch_limit': CONFIG['lists']['item_watch']['limit'],
+        'watchlist': DATABASE.watchlist_list(user_id),
+    })
+    return (
+        '<script src="/static/ajax.js"></script>',
+        '<script>ffxivm_price_batching = true;</script>',
+        '<script>ffxivm_push_subscribe({dashboard: true});</script>',
+    )
+    
+def _build_item_context(context, item_id, item_properties, price_data, analytics):
+    """
+    Fills in an item page's context from the item's properties, prices and
+    analytics, returning the page's extra HTML headers.
+    """
+    user_id = context['identity']['user_id']
+    (item_name, xivdb_id, lodestone_id, hq) = item_properties
+    quality_counterpart_id = DATABASE.items_get_hq_variant_id(xivdb_id, not hq)
+    (crafted_from, crafts_into) = DATABASE.related_get(xivdb_id)
+    watch_count = DATABASE.watchlist_count(user_id)
+    watching = DATABASE.watchlist_is_watching(user_id, item_id)
+    
+    quality_counterpart = None
+    if quality_counterpart_id is not None:
+        quality_counterpart = DATABASE.items_get_latest_by_id(quality_counterpart_id)
         
-    def _compute_timeblock_averages(self, normalised_data, normalised_data_timescale):
-        slices_per_day = int((3600.0 * 24) / normalised_data_timescale)
+    if len(analytics.normalised_data) > 1:
+        normalised_data = pad(analytics.normalised_data, CONFIG['graphing']['data_points'])
+    else: #Not enough data to do time-based analysis
+        normalised_data = None
         
-        days = collections.defaultdict(list)
-        for datum in normalised_data:
-            days[int(datum[0] / slices_per_day)].append(datum[1])
-        weeks = collections.defaultdict(list)
-        for (day, prices) in days.iteritems():
-            weeks[int(day / 7)].append(int(sum(prices) / len(prices)))
-            
-        return (days, weeks)
+    context['rendering']['title'] = item_name
+    context.update({
+        'item_name': item_name,
+        'item_hq': hq,
+        'item_id': item_id,
+        'xivdb_id': xivdb_id,
+        'lodestone_id': lodestone_id,
+        'quality_counterpart': quality_counterpart,
+        'crafted_from': sorted((i for i in crafted_from if i), key=(lambda i: getattr(i.item_state.name, context['identity']['language']))),
+        'crafts_into': sorted((i for i in crafts_into if i), key=(lambda i: getattr(i.item_state.name, context['identity']['language']))),
+        'price_data': price_data,
+        'normalised_data': normalised_data,
+        'normalised_data_timescale': analytics.timescale,
+        'normalised_data_end': analytics.end,
+        'average_month': analytics.average_month,
+        'average_week': analytics.average_week,
+        'average_24h': analytics.average_24h,
+        'low_month': analytics.low_month,
+        'low_week': analytics.low_week,
+        'low_24h': analytics.low_24h,
+        'high_month': analytics.high_month,
+        'high_week': analytics.high_week,
+        'high_24h': analytics.high_24h,
+        'trend_weekly': analytics.trend_weekly,
+        'trend_daily': analytics.trend_daily,
+        'trend_current': analytics.trend_current,
+        'delete_lockout_time': 0, #Assume it's a moderator by default, to avoid resizing the table
+        'watch_count': watch_count,
+        'watch_limit': CONFIG['lists']['item_watch']['limit'],
+        'watching': watching,
+    })
+    if not context['role']['moderator']:
+        context['delete_lockout_time'] = context['rendering']['time_current'] - CONFIG['data']['prices']['delete_window']
+    return (
+        '<script src="/static/ajax.js"></script>',
+        '<script src="https://www.gstatic.com/charts/loader.js"></script>',
+        '<script>ffxivm_push_subscribe({{item: {item_id}}});</script>'.format(item_id=item_id),
+    )
+    
+class ItemsHandler(Handler):
+    def _render_item_list(self, context, item_refs, callback_id_prefix):
+        return self._render_fragment(context, 'formatting.mako', 'render_item_list', item_refs, callback_id_prefix)
         
-    def _compute_averages(self, timeblock_days, timeblock_weeks):
-        return (
-            0 in timeblock_days and int(sum(timeblock_days[0]) / len(timeblock_days[0])) or None,
-            0 in timeblock_weeks and int(sum(timeblock_weeks[0]) / len(timeblock_weeks[0])) or None,
-            int(sum(int(sum(prices) / len(prices)) for prices in timeblock_weeks.values()) / len(timeblock_weeks)),
-        )
+    @tornado.web.authenticated
+    @tornado.gen.coroutine
+    def get(self):
+        context = yield self._common_setup(page_title="Items")
+        language = context['identity']['language']
+        current_time = context['rendering']['time_current']
         
-    def _compute_trends(self, normalised_data, timeblock_days, timeblock_weeks):
-        if 0 in timeblock_weeks and 1 in timeblock_weeks:
-            current_weekly_average = sum(timeblock_weeks[0]) / len(timeblock_weeks[0])
-            previous_weekly_average = sum(timeblock_weeks[1]) / len(timeblock_weeks[1])
-            trend_weekly = (current_weekly_average / float(previous_weekly_average)) - 1
-        else:
-            trend_weekly = None
+        #Listing items costs little next to rendering them, so each panel is
+        #keyed by the items it shows and re-rendered only when they change
+        lists = [(panel, query(current_time)) for (panel, query) in _SHARED_PANELS]
+        lists.append(('mwt', DATABASE.watchlist_get_most_watched(limit=CONFIG['lists']['item_watch']['limit'])))
+        panels = {}
+        for (panel, item_refs) in lists:
+            panels[panel] = self._get_fragment(
+                (panel, language, tuple(item_refs)),
+                lambda: self._render_item_list(context, item_refs, panel),
+            )
             
-        if 0 in timeblock_days and 1 in timeblock_days:
-            current_daily_average = sum(timeblock_days[0]) / len(timeblock_days[0])
-            previous_daily_average = sum(timeblock_days[1]) / len(timeblock_days[1])
-            trend_daily = (current_daily_average / float(previous_daily_average)) - 1
-        else:
-            trend_daily = None
-            
-        if len(normalised_data) > 1 and normalised_data[0][0] == 0 and normalised_data[1][0] == 1:
-            trend_current = (normalised_data[0][1] / float(normalised_data[1][1])) - 1        
-        else:
-            trend_current = None
-            
-        return (trend_current, trend_daily, trend_weekly)
-        
+        html_headers = _build_items_context(context)
+        context['panels'] = panels
+        self._render('items.html', context, html_headers=html_headers)
+
+class ItemHandler(Handler):
     @tornado.web.authenticated
+    @tornado.gen.coroutine
     def get(self, item_id):
         item_id = int(item_id)
-        context = self._common_setup()
+        context = yield self._common_setup()
         
         item_properties = DATABASE.items_get_properties(language=context['identity']['language'], item_id=item_id)
         if item_properties is None:
             raise tornado.web.HTTPError(42, reason='"{item_id}" is not a known item; submit a price to create it'.format(
                 item_id=item_id,
             ))
-        (item_name, xivdb_id, lodestone_id, hq) = item_properties
-        
-        quality_counterpart = None
-        quality_counterpart_id = DATABASE.items_get_hq_variant_id(xivdb_id, not hq)
-        if quality_counterpart_id is not None:
-            quality_counterpart = DATABASE.items_get_latest_by_id(quality_counterpart_id)
-            
-        (crafted_from, crafts_into) = DATABASE.related_get(xivdb_id)
-        
-        price_data = DATABASE.items_get_prices(item_id, max_age=(context['rendering']['time_current'] - (CONFIG['graphing']['days'] * _ONE_DAY)))
-        
-        #Defaults
-        low_month = low_week = low_24h = None
-        high_month = high_week = high_24h = None
-        average_month = average_week = average_24h = None
-        trend_weekly = trend_daily = trend_current = None
-        
-        (normalised_data, normalised_data_timescale) = self._normalise_data(price_data, context['rendering']['time_current'])
-        if normalised_data:
-            (   low_24h, low_week, low_month,
-                high_24h, high_week, high_month,
-            ) = self._compute_maxmin(price_data, context['rendering']['time_current'])
             
-            (timeblock_days, timeblock_weeks) = self._compute_timeblock_averages(normalised_data, normalised_data_timescale)
-            (average_24h, average_week, average_month) = self._compute_averages(timeblock_days, timeblock_weeks)
-            (trend_current, trend_daily, trend_weekly) = self._compute_trends(normalised_data, timeblock_days, timeblock_weeks)
+        (price_data, analytics) = yield [
+            ASYNC_DATABASE.items_get_prices(item_id, limit=1000, max_age=(context['rendering']['time_current'] - (CONFIG['graphing']['days'] * _ONE_DAY))),
+            ASYNC_DATABASE.items_get_analytics(item_id, context['rendering']['time_current']),
+        ]
+        html_headers = _build_item_context(context, item_id, item_properties, price_data, analytics)
+        self._render('item.html', context, html_headers=html_headers)
             
-        if len(normalised_data) > 1:
-            #Reverse the data and pad holes
-            next_data_slice = normalised_data[-1][0]
-            last_value = None
-            new_normalised_data = []
-            for i in xrange(167, -1, -1):
-                if next_data_slice == i:
-                    last_value = normalised_data.pop()[1]
-                    if last_value == 0:
-                        last_value = None
-                    new_normalised_data.append(last_value)
-                    if normalised_data:
-                        next_data_slice = normalised_data[-1][0]
-                    else:
-                        new_normalised_data.extend(last_value for n in xrange(i))
-                        break
-                else:
-                    new_normalised_data.append(last_value)
-            normalised_data = new_normalised_data
-        else: #Not enough data to do time-based analysis
-            normalised_data = None
+class ItemDataHandler(Handler):
+    """
+    An item's latest price, analytics and chart as JSON, tagged so that an
+    unchanged item is revalidated without a query or any analysis.
+    """
+    @tornado.web.authenticated
+    @tornado.gen.coroutine
+    def get(self, item_id):
+        item_id = int(item_id)
+        current_time = int(time.time())
+        
+        etag = DATABASE.items_get_etag(item_id, current_time)
+        if etag is None:
+            raise tornado.web.HTTPError(404, reason='"{item_id}" is not a known item'.format(
+                item_id=item_id,
+            ))
+        self.set_header('Etag', '"{etag}"'.format(etag=etag))
+        self.set_header('Cache-Control', 'private, no-cache')
+        item_ref = DATABASE.items_get_latest_by_id(item_id)
+        if item_ref.item_state.price:
+            self.set_header('Last-Modified', datetime.datetime.utcfromtimestamp(item_ref.item_state.price.timestamp))
+        if self.check_etag_header():
+            self.set_status(304)
+            return
             
-        context['rendering']['title'] = item_name
-        context.update({
-            'item_name': item_name,
-            'item_hq': hq,
+        analytics = yield ASYNC_DATABASE.items_get_analytics(item_id, current_time)
+        normalised_data = None
+        if len(analytics.normalised_data) > 1:
+            normalised_data = pad(analytics.normalised_data, CONFIG['graphing']['data_points'])
+        price_point = lambda datum: datum and {'timestamp': datum.timestamp, 'value': datum.value}
+        self.write({
             'item_id': item_id,
-            'xivdb_id': xivdb_id,
-            'lodestone_id': lodestone_id,
-            'quality_counterpart': quality_counterpart,
-            'crafted_from': sorted((i for i in crafted_from if i), key=(lambda i: getattr(i.item_state.name, context['identity']['language']))),
-            'crafts_into': sorted((i for i in crafts_into if i), key=(lambda i: getattr(i.item_state.name, context['identity']['language']))),
-            'price_data': price_data,
-            'normalised_data': normalised_data,
-            'normalised_data_timescale': normalised_data_timescale,
-            'average_month': average_month,
-            'average_week': average_week,
-            'average_24h': average_24h,
-            'low_month': low_month,
-            'low_week': low_week,
-            'low_24h': low_24h,
-            'high_month': high_month,
-            'high_week': high_week,
-            'high_24h': high_24h,
-            'trend_weekly': trend_weekly,
-            'trend_daily': trend_daily,
-            'trend_current': trend_current,
-            'delete_lockout_time': 0, #Assume it's a moderator by default, to avoid resizing the table
-            'watch_count': DATABASE.watchlist_count(context['identity']['user_id']),
-            'watch_limit': CONFIG['lists']['item_watch']['limit'],
-            'watching': DATABASE.watchlist_is_watching(context['identity']['user_id'], item_id),
+            'hq': item_ref.item_state.hq,
+            'price': price_point(item_ref.item_state.price),
+            'average': item_ref.average,
+            'averages': {
+                '24h': analytics.average_24h,
+                'week': analytics.average_week,
+                'month': analytics.average_month,
+            },
+            'lows': {
+                '24h': price_point(analytics.low_24h),
+                'week': price_point(analytics.low_week),
+                'month': price_point(analytics.low_month),
+            },
+            'highs': {
+                '24h': price_point(analytics.high_24h),
+                'week': price_point(analytics.high_week),
+                'month': price_point(analytics.high_month),
+            },
+            'trends': {
+                'current': analytics.trend_current,
+                'daily': analytics.trend_daily,
+                'weekly': analytics.trend_weekly,
+            },
+            'chart': {
+                'timescale': analytics.timescale,
+                'end': analytics.end,
+                'data': normalised_data,
+            },
         })
-        if not context['role']['moderator']:
-            context['delete_lockout_time'] = context['rendering']['time_current'] - CONFIG['data']['prices']['delete_window']
-        self._render('item.html', context, html_headers=(
-                '<script src="/static/ajax.js"></script>',
-                '<script src="https://www.gstatic.com/charts/loader.js"></script>',
-            ))
-            
+        
 class PriceUpdateHandler(Handler):
     @tornado.web.authenticated
+    @tornado.gen.coroutine
     def post(self):
         item_id = int(self.get_argument("item_id"))
         value = self.get_argument("value", default=None)
@@ -261,9 +266,9 @@ class PriceUpdateHandler(Handler):
         else:
             value = None
             
-        context = self._build_common_context()
+        context = yield self._build_common_context()
         if value is not None:
-            DATABASE.items_add_price(item_id, value, context['identity']['user_id'])
+            yield ASYNC_DATABASE.items_add_price(item_id, value, context['identity']['user_id'])
             
         self.redirect("/items/{item_id}".format(
             item_id=item_id,
@@ -271,18 +276,19 @@ class PriceUpdateHandler(Handler):
         
 class PriceDeleteHandler(Handler):
     @tornado.web.authenticated
+    @tornado.gen.coroutine
     def post(self):
         item_id = int(self.get_argument("item_id"))
         timestamp = int(self.get_argument("timestamp"))
         
-        context = self._build_common_context()
+        context = yield self._build_common_context()
         if context['role']['moderator']:
-            DATABASE.items_delete_price(item_id, timestamp)
+            yield ASYNC_DATABASE.items_delete_price(item_id, timestamp)
         else:
             if context['rendering']['time_current'] - timestamp > CONFIG['data']['prices']['delete_window']:
-                DATABASE.flags_create(item_id, timestamp, context['identity']['user_id'])
+                yield ASYNC_DATABASE.flags_create(item_id, timestamp, context['identity']['user_id'])
             else:
-                DATABASE.items_delete_price(item_id, timestamp, context['identity']['user_id'])
+                yield ASYNC_DATABASE.items_delete_price(item_id, timestamp, context['identity']['user_id'])
                 
         self.redirect("/items/{item_id}".format(
             item_id=item_id,
@@ -290,66 +296,161 @@ class PriceDeleteHandler(Handler):
         
 class AjaxPriceUpdateHandler(Handler):
     @tornado.web.authenticated
+    @tornado.gen.coroutine
     def post(self):
         item_id = int(self.get_argument("item_id"))
         value = int(self.get_argument("value"))
         
-        context = self._build_common_context()
-        DATABASE.items_add_price(item_id, value, context['identity']['user_id'])
+        context = yield self._build_common_context()
+        yield ASYNC_DATABASE.items_add_price(item_id, value, context['identity']['user_id'])
+        self.write({})
+        
+class AjaxPricesUpdateHandler(Handler):
+    @tornado.web.authenticated
+    @tornado.gen.coroutine
+    def post(self):
+        item_ids = [int(item_id) for item_id in self.get_arguments("item_id")]
+        values = [int(value) for value in self.get_arguments("value")]
+        if not item_ids or len(item_ids) != len(values):
+            raise tornado.web.HTTPError(400, reason='Every item needs exactly one price')
+        if len(item_ids) > CONFIG['data']['prices']['batch_limit']:
+            raise tornado.web.HTTPError(413, reason='Too many prices at once')
+            
+        context = yield self._build_common_context()
+        yield ASYNC_DATABASE.items_add_prices(zip(item_ids, values), context['identity']['user_id'])
         self.write({})
         
 class AjaxPriceDeleteHandler(Handler):
     @tornado.web.authenticated
+    @tornado.gen.coroutine
     def post(self):
         item_id = int(self.get_argument("item_id"))
         timestamp = int(self.get_argument("timestamp"))
         
-        context = self._build_common_context()
+        context = yield self._build_common_context()
         deleted = True
         if context['role']['moderator']:
-            DATABASE.items_delete_price(item_id, timestamp)
+            yield ASYNC_DATABASE.items_delete_price(item_id, timestamp)
         else:
             if context['rendering']['time_current'] - timestamp > CONFIG['data']['prices']['delete_window']:
-                DATABASE.flags_create(item_id, timestamp, context['identity']['user_id'])
+                yield ASYNC_DATABASE.flags_create(item_id, timestamp, context['identity']['user_id'])
                 deleted = False
             else:
-                DATABASE.items_delete_price(item_id, timestamp, context['identity']['user_id'])
+                yield ASYNC_DATABASE.items_delete_price(item_id, timestamp, context['identity']['user_id'])
         self.write({'deleted': deleted})
         
 class AjaxWatchHandler(Handler):
     @tornado.web.authenticated
+    @tornado.gen.coroutine
     def post(self):
         item_id = int(self.get_argument("item_id"))
         
-        context = self._build_common_context()
+        context = yield self._build_common_context()
         user_id = context['identity']['user_id']
         
         if DATABASE.watchlist_count(user_id) >= CONFIG['lists']['item_watch']['limit']:
             raise tornado.web.HTTPError(409, reason='You cannot watch any more items')
             
-        DATABASE.watchlist_add(user_id, item_id)
+        yield ASYNC_DATABASE.watchlist_add(user_id, item_id)
         self.write({})
         
 class AjaxUnwatchHandler(Handler):
     @tornado.web.authenticated
+    @tornado.gen.coroutine
     def post(self):
         item_id = int(self.get_argument("item_id"))
         
-        context = self._build_common_context()
+        context = yield self._build_common_context()
         
-        DATABASE.watchlist_remove(context['identity']['user_id'], item_id)
+        yield ASYNC_DATABASE.watchlist_remove(context['identity']['user_id'], item_id)
+        self.write({})
+        
+class PushHandler(tornado.websocket.WebSocketHandler):
+    """
+    Price changes for an open dashboard or item page, as they happen.
+    
+    The page subscribes by sending a JSON object with either "dashboard" or
+    "items", the IDs of the items it shows, its own first. To catch up on
+    what changed while it wasn't listening, deletions included, it also
+    sends "shown", the [item ID, timestamp] of each price it lists, with a
+    null timestamp for an item with none, and an item page sends "history",
+    the timestamps of its item's prices; any that no longer match are
+    corrected at once.
+    """
+    _subscriber = None
+    
+    def get_current_user(self):
+        return get_authenticated_user(self)
+        
+    def prepare(self):
+        if self.current_user is None:
+            raise tornado.web.HTTPError(403, reason="Live prices are only for signed-in users")
+            
+    def open(self):
+        self._subscriber = HUB.new_subscriber(self)
+        
+    @tornado.gen.coroutine
+    def on_message(self, message):
+        resync_limit = CONFIG['server']['push']['resync_limit']
+        try:
+            subscription = json.loads(message)
+            dashboard = bool(subscription.get('dashboard'))
+            item_ids = [int(i) for i in subscription.get('items', ())][:CONFIG['server']['push']['items_limit']]
+            shown = [
+                (int(item_id), None if timestamp is None else int(timestamp))
+                for (item_id, timestamp) in subscription.get('shown', ())
+            ][:resync_limit]
+            history = [int(timestamp) for timestamp in subscription.get('history', ())][:resync_limit]
+        except (AttributeError, TypeError, ValueError):
+            self.close(1007, "Unreadable subscription")
+            return
+        HUB.subscribe(self._subscriber, item_ids, dashboard)
+        
+        prices = []
+        for (item_id, timestamp) in shown:
+            item_ref = DATABASE.items_get_latest_by_id(item_id)
+            if not item_ref:
+                continue
+            price = item_ref.item_state.price
+            if not price:
+                if timestamp is not None:
+                    prices.append([item_id, None, None, None])
+            elif price.timestamp != timestamp:
+                prices.append([item_id, price.timestamp, price.value, item_ref.average])
+        deleted = []
+        if history and item_ids and not dashboard:
+            missing = yield ASYNC_DATABASE.items_get_missing_prices(item_ids[0], history)
+            deleted = [[item_ids[0], timestamp] for timestamp in missing]
+        if prices or deleted:
+            self._subscriber.send(json.dumps({'p': prices, 'd': deleted}, separators=(',', ':')))
+            
+    def on_close(self):
+        if self._subscriber is not None:
+            HUB.unsubscribe(self._subscriber)
+            
+class CatalogueReloadHandler(Handler):
+    """
+    To be called once data/items.sql has been reloaded.
+    """
+    @tornado.web.authenticated
+    @tornado.gen.coroutine
+    def post(self):
+        yield self._common_setup(restrict=restrict_administrator)
+        yield ASYNC_DATABASE.catalogue_reload()
         self.write({})
         
 class AjaxQueryNames(Handler):
     @tornado.web.authenticated
+    @tornado.gen.coroutine
     def get(self):
         search_term = self.get_argument("term")
         limit = CONFIG['lists']['search']['limit']
         
-        context = self._build_common_context()
+        context = yield self._build_common_context()
         
         options = []
-        for (name, id, hq) in DATABASE.items_search(language=context['identity']['language'], filter=search_term, limit=limit):
+        results = DATABASE.items_search(language=context['identity']['language'], filter=search_term, limit=limit)
+        for (name, id, hq) in results:
             if hq:
                 name = '{name} HQ'.format(name=name)
             options.append({
@@ -1,13 +1,14 @@
 # -*- coding: utf-8 -*-
 import logging
 import re
-import time
 import uuid
 
+import bcrypt
+import tornado.gen
 import tornado.web
 
 from _common import (
-    CONFIG, DATABASE,
+    CONFIG, DATABASE, ASYNC_DATABASE,
     Handler,
     restrict_active, restrict_moderator, restrict_administrator,
     USER_STATUS_GUEST,
@@ -16,6 +17,7 @@ from _common import (
     USER_LANGUAGE_ENGLISH, USER_LANGUAGE_JAPANESE, USER_LANGUAGE_FRENCH, USER_LANGUAGE_GERMAN,
     USER_LANGUAGE_NAMES,
 )
+from ..hashing import HASHING_POOL, HashingQueueFull
 
 _CHARACTER_NAME_MAX_LENGTH = 21
 _CHARACTER_NAME_RE = re.compile(r"[A-Za-z][a-z']* [A-Za-z][a-z']*")
@@ -40,20 +42,55 @@ def _validate_credentials(handler):
     if len(password) < _PASSWORD_MIN_LENGTH:
         raise tornado.web.HTTPError(422, reason="Password is too short")
     return (_normalise_name(username).encode('utf-8'), password.encode('utf-8'))
+    
+def _hashpw(password, salt):
+    try:
+        return HASHING_POOL.hashpw(password, salt)
+    except HashingQueueFull:
+        raise tornado.web.HTTPError(503, reason="Too many logins are being processed; please try again shortly")
+        
+@tornado.gen.coroutine
+def _authenticate(username, password):
+    credentials = yield ASYNC_DATABASE.users_get_credentials(username)
+    if credentials is None:
+        _logger.info("User {user} does not exist".format(
+            user=username,
+        ))
+        raise tornado.gen.Return(None)
+        
+    (user_id, password_hash, password_salt, status) = credentials
+    if status == USER_STATUS_BANNED:
+        _logger.info("User {user} failed to log in: banned".format(
+            user=username,
+        ))
+        raise tornado.gen.Return(-1)
+        
+    pwhash = yield _hashpw(password, password_salt)
+    if pwhash == password_hash:
+        _logger.info("User {user} logged in".format(
+            user=username,
+        ))
+        raise tornado.gen.Return(user_id)
+    _logger.info("User {user} failed to log in: incorrect password".format(
+        user=username,
+    ))
+    raise tornado.gen.Return(None)
 
 class LoginHandler(Handler):
+    @tornado.gen.coroutine
     def get(self):
-        context = self._build_common_context(page_title="Login")
+        context = yield self._build_common_context(page_title="Login")
         context.update({
             'next': self.get_argument("next", default="/"),
             'throwaway_password': uuid.uuid4().hex,
         })
         self._render('login.html', context)
         
+    @tornado.gen.coroutine
     def post(self):
         (username, password) = _validate_credentials(self)
         
-        user_id = DATABASE.users_login(username, password)
+        user_id = yield _authenticate(username, password)
         if user_id is not None:
             if user_id == -1:
                 raise tornado.web.HTTPError(403, reason="Account is banned")
@@ -64,7 +101,7 @@ class LoginHandler(Handler):
             )
             self.redirect(self.get_argument("next", default="/"))
             return
-        time.sleep(1)
+        yield tornado.gen.sleep(1)
         raise tornado.web.HTTPError(403, reason="Unrecognised character-name/password")
         
 class LogoutHandler(Handler):
@@ -73,14 +110,19 @@ class LogoutHandler(Handler):
         self.redirect('/login')
         
 class RegisterHandler(Handler):
+    @tornado.gen.coroutine
     def get(self):
-        self._render('register.html', self._build_common_context(page_title="Register account"))
+        context = yield self._build_common_context(page_title="Register account")
+        self._render('register.html', context)
         
+    @tornado.gen.coroutine
     def post(self):
         (username, password) = _validate_credentials(self)
         
+        salt = bcrypt.gensalt()
+        pwhash = yield _hashpw(password, salt)
         try:
-            DATABASE.users_create(username, password)
+            yield ASYNC_DATABASE.users_create(username, pwhash, salt)
         except Exception, e:
             _logger.error(str(e))
             raise tornado.web.HTTPError(409, reason="Character-name already exists")
@@ -88,19 +130,27 @@ class RegisterHandler(Handler):
         self.redirect("/login/register")
         
 class RecoverHandler(Handler):
+    @tornado.gen.coroutine
     def get(self):
-        self._render('recover.html', self._build_common_context(page_title="Recover password"))
+        context = yield self._build_common_context(page_title="Recover password")
+        self._render('recover.html', context)
         
+    @tornado.gen.coroutine
     def post(self):
         (username, password) = _validate_credentials(self)
         
-        if not DATABASE.users_set_recovery_password(username, password):
+        credentials = yield ASYNC_DATABASE.users_get_credentials(username)
+        if credentials is None or credentials[3] == USER_STATUS_BANNED:
             raise tornado.web.HTTPError(403, reason="Unable to set recovery password: character is not registered")
             
+        (user_id, _, salt, _) = credentials
+        pwhash = yield _hashpw(password, salt)
+        yield ASYNC_DATABASE.users_set_recovery_password(user_id, pwhash)
         self.redirect("/login/recover")
         
 class AboutHandler(Handler):
+    @tornado.gen.coroutine
     def get(self):
-        context = self._build_common_context(page_title="About")
+        context = yield self._build_common_context(page_title="About")
         self._render('about.html', context)
         
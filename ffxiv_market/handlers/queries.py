@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+import logging
+
+import tornado.gen
+import tornado.web
+
+from _common import (
+    CONFIG, DATABASE, ASYNC_DATABASE,
+    Handler,
+    restrict_active, restrict_moderator, restrict_administrator,
+    USER_STATUS_GUEST,
+    USER_STATUS_PENDING, USER_STATUS_ACTIVE, USER_STATUS_BANNED,
+    USER_STATUS_MODERATOR, USER_STATUS_ADMINISTRATOR,
+    USER_LANGUAGE_ENGLISH, USER_LANGUAGE_JAPANESE, USER_LANGUAGE_FRENCH, USER_LANGUAGE_GERMAN,
+    USER_LANGUAGE_NAMES,
+)
+
+_logger = logging.getLogger('handlers.queries')
+
+class SlowQueriesHandler(Handler):
+    @tornado.web.authenticated
+    @tornado.gen.coroutine
+    def get(self):
+        context = yield self._common_setup(
+            page_title="Slow queries",
+            restrict=restrict_moderator,
+        )
+        
+        context.update({
+            'slow_queries': DATABASE.slow_queries_list(),
+            'threshold': CONFIG['server']['postgres']['slow_queries']['threshold'],
+        })
+        self._render('slow_queries.html', context)
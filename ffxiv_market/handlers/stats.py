@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+import logging
+
+import tornado.gen
+import tornado.web
+
+from _common import (
+    CONFIG, DATABASE, ASYNC_DATABASE,
+    Handler,
+    restrict_active, restrict_moderator, restrict_administrator,
+    USER_STATUS_GUEST,
+    USER_STATUS_PENDING, USER_STATUS_ACTIVE, USER_STATUS_BANNED,
+    USER_STATUS_MODERATOR, USER_STATUS_ADMINISTRATOR,
+    USER_LANGUAGE_ENGLISH, USER_LANGUAGE_JAPANESE, USER_LANGUAGE_FRENCH, USER_LANGUAGE_GERMAN,
+    USER_LANGUAGE_NAMES,
+)
+from .. import metrics
+from ..hashing import HASHING_POOL
+
+_logger = logging.getLogger('handlers.stats')
+
+class HashingStatsHandler(Handler):
+    @tornado.web.authenticated
+    @tornado.gen.coroutine
+    def get(self):
+        yield self._common_setup(restrict=restrict_administrator)
+        self.write(HASHING_POOL.stats())
+        
+class MetricsHandler(Handler):
+    @tornado.web.authenticated
+    @tornado.gen.coroutine
+    def get(self):
+        yield self._common_setup(restrict=restrict_administrator)
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.write(metrics.render())
@@ -1,10 +1,11 @@
 # -*- coding: utf-8 -*-
 import logging
 
+import tornado.gen
 import tornado.web
 
 from _common import (
-    CONFIG, DATABASE,
+    CONFIG, DATABASE, ASYNC_DATABASE,
     Handler,
     restrict_active, restrict_moderator, restrict_administrator,
     ADD_BAN, CLEAR_BAN, CHECK_BAN,
@@ -44,8 +45,9 @@ def _can_set_banned(user_id, user_status, actor_id, actor_role):
     
 class ListHandler(Handler):
     @tornado.web.authenticated
+    @tornado.gen.coroutine
     def get(self):
-        context = self._common_setup(
+        context = yield self._common_setup(
             page_title="Users",
             restrict=restrict_moderator,
         )
@@ -55,7 +57,8 @@ class ListHandler(Handler):
         moderators = []
         administrators = []
         banned = []
-        for (user_id, user_name, user_status) in DATABASE.users_list():
+        users = yield ASYNC_DATABASE.users_list()
+        for (user_id, user_name, user_status) in users:
             if user_status == USER_STATUS_PENDING:
                 pending.append((user_id, user_name))
             elif user_status == USER_STATUS_ACTIVE:
@@ -77,18 +80,23 @@ class ListHandler(Handler):
         self._render('users.html', context)
         
 class ModeratorsHandler(Handler):
+    @tornado.gen.coroutine
     def get(self):
-        context = self._common_setup(page_title="Moderators")
+        context = yield self._common_setup(page_title="Moderators")
         
+        (moderators, administrators) = yield [
+            ASYNC_DATABASE.users_list(status=USER_STATUS_MODERATOR, order_most_recent=True),
+            ASYNC_DATABASE.users_list(status=USER_STATUS_ADMINISTRATOR, order_most_recent=True),
+        ]
         moderators = [
             (user_id, user_name)
             for (user_id, user_name, _)
-            in DATABASE.users_list(status=USER_STATUS_MODERATOR, order_most_recent=True)
+            in moderators
         ]
         moderators.extend(
             (user_id, user_name)
             for (user_id, user_name, _)
-            in DATABASE.users_list(status=USER_STATUS_ADMINISTRATOR, order_most_recent=True)
+            in administrators
         )
         
         context['moderators'] = moderators
@@ -96,15 +104,16 @@ class ModeratorsHandler(Handler):
         
 class ProfileHandler(Handler):
     @tornado.web.authenticated
+    @tornado.gen.coroutine
     def get(self, user_id):
         user_id = int(user_id)
         
-        context = self._common_setup()
+        context = yield self._common_setup()
         moderator = context['role']['moderator']
         if not moderator and context['identity']['user_id'] != user_id:
             raise tornado.web.HTTPError(403, reason="You do not have access to user profiles")
             
-        profile = DATABASE.users_get_profile(user_id)
+        profile = yield ASYNC_DATABASE.users_get_profile(user_id)
         if profile is None:
             raise tornado.web.HTTPError(404, reason="No user exists with id {id}".format(
                 id=user_id,
@@ -144,6 +153,7 @@ class ProfileHandler(Handler):
         
 class SetStatusHandler(Handler):
     @tornado.web.authenticated
+    @tornado.gen.coroutine
     def post(self):
         action = self.get_argument("action")
         reason = self.get_argument("reason").strip()
@@ -153,9 +163,9 @@ class SetStatusHandler(Handler):
                 offset=offset,
             ))
             
-        context = self._build_common_context()
+        context = yield self._build_common_context()
         
-        subject_identity = DATABASE.users_get_identity(user_id)
+        subject_identity = yield ASYNC_DATABASE.users_get_identity(user_id)
         if subject_identity is None:
             raise tornado.web.HTTPError(404, reason="No user exists with id {id}".format(
                 id=user_id,
@@ -175,14 +185,15 @@ class SetStatusHandler(Handler):
                 action=action,
             ))
             
-        DATABASE.users_set_status(user_id, status)
-        DATABASE.interactions_record(user_id, context['identity']['user_id'], action, reason)
+        yield ASYNC_DATABASE.users_set_status(user_id, status)
+        yield ASYNC_DATABASE.interactions_record(user_id, context['identity']['user_id'], action, reason)
         self.redirect('/users/{user_id}'.format(
             user_id=user_id,
         ))
         
 class AcceptRecoveryPasswordHandler(Handler):
     @tornado.web.authenticated
+    @tornado.gen.coroutine
     def post(self):
         reason = self.get_argument("reason").strip()
         user_id = int(self.get_argument("user_id"))
@@ -191,34 +202,36 @@ class AcceptRecoveryPasswordHandler(Handler):
                 offset=offset,
             ))
             
-        context = self._build_common_context()
+        context = yield self._build_common_context()
         restrict_moderator(context)
-        DATABASE.users_accept_recovery_password(user_id)
-        DATABASE.interactions_record(user_id, context['identity']['user_id'], 'recovered', reason)
+        yield ASYNC_DATABASE.users_accept_recovery_password(user_id)
+        yield ASYNC_DATABASE.interactions_record(user_id, context['identity']['user_id'], 'recovered', reason)
         self.redirect('/users/{user_id}'.format(
             user_id=user_id,
         ))
         
 class UpdateAnonymityHandler(Handler):
     @tornado.web.authenticated
+    @tornado.gen.coroutine
     def post(self):
         anonymous = self.get_argument("anonymity") == 'hide'
         
-        context = self._build_common_context()
+        context = yield self._build_common_context()
         user_id = context['identity']['user_id']
-        DATABASE.users_set_anonymous(user_id, anonymous)
+        yield ASYNC_DATABASE.users_set_anonymous(user_id, anonymous)
         self.redirect('/users/{user_id}'.format(
             user_id=user_id,
         ))
         
 class UpdateLanguageHandler(Handler):
     @tornado.web.authenticated
+    @tornado.gen.coroutine
     def post(self):
         language = self.get_argument("language")
         
-        context = self._build_common_context()
+        context = yield self._build_common_context()
         user_id = context['identity']['user_id']
-        DATABASE.users_set_language(user_id, language)
+        yield ASYNC_DATABASE.users_set_language(user_id, language)
         self.redirect('/users/{user_id}'.format(
             user_id=user_id,
         ))
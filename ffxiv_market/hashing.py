@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+
+import bcrypt
+import concurrent.futures
+
+import metrics
+from common import CONFIG
+
+_logger = logging.getLogger('hashing')
+
+class HashingQueueFull(Exception):
+    """
+    Raised when too many password hashes are already waiting.
+    """
+    
+class _HashingPool(object):
+    """
+    Runs bcrypt in a bounded set of worker processes, so a burst of logins
+    can't hold up the IOLoop or, through the GIL, the database threads.
+    """
+    _executor = None
+    _lock = None
+    _queue_limit = None
+    _processes = None
+    _pending = 0
+    _completed = 0
+    _rejected = 0
+    
+    def __init__(self, processes, queue_limit):
+        self._lock = threading.Lock()
+        self._processes = processes
+        self._queue_limit = queue_limit
+        
+    def start(self):
+        """
+        Forks the worker processes; call this once the server is set up,
+        outside of any import, before the database threads exist.
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=self._processes)
+        self._executor.submit(bcrypt.gensalt).result()
+        
+    def _finished(self, future):
+        with self._lock:
+            self._pending -= 1
+            self._completed += 1
+            
+    def hashpw(self, password, salt):
+        with self._lock:
+            if self._pending >= self._queue_limit:
+                self._rejected += 1
+                _logger.warn("Hashing queue is full ({pending} pending)".format(
+                    pending=self._pending,
+                ))
+                raise HashingQueueFull()
+            self._pending += 1
+            if self._executor is None:
+                self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=self._processes)
+        future = self._executor.submit(bcrypt.hashpw, password, salt)
+        future.add_done_callback(self._finished)
+        return future
+        
+    def stats(self):
+        with self._lock:
+            return {
+                'processes': self._processes,
+                'queue_limit': self._queue_limit,
+                'pending': self._pending,
+                'completed': self._completed,
+                'rejected': self._rejected,
+            }
+HASHING_POOL = _HashingPool(
+    processes=CONFIG['server']['hashing']['processes'],
+    queue_limit=CONFIG['server']['hashing']['queue_limit'],
+)
+metrics.Gauges('ffxiv_market_hashing', "Password hashing pool", HASHING_POOL.stats)
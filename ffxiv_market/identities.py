@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Recently seen users' identities, held in memory so most pages needn't
+query for them.
+"""
+import collections
+import threading
+import time
+
+class IdentityCache(object):
+    """
+    Recently seen users' identities, so building a page's common context
+    needs no query. Entries are dropped when the user changes, after `ttl`
+    seconds, or least-recently-used first once `size` are held.
+    """
+    _lock = None
+    _entries = None
+    _size = None
+    _ttl = None
+    _invalidations = 0
+    
+    def __init__(self, size, ttl):
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._size = size
+        self._ttl = ttl
+        
+    def get(self, user_id):
+        """
+        Returns (True, identity) on a hit; otherwise (False, token), where
+        token must be passed to set() with the freshly loaded identity.
+        """
+        with self._lock:
+            entry = self._entries.pop(user_id, None)
+            if entry is not None and entry[0] > time.time():
+                self._entries[user_id] = entry
+                return (True, entry[1])
+            return (False, self._invalidations)
+            
+    def set(self, user_id, identity, token):
+        with self._lock:
+            if token != self._invalidations: #Changed while it was being loaded
+                return
+            self._entries.pop(user_id, None)
+            self._entries[user_id] = (time.time() + self._ttl, identity)
+            while len(self._entries) > self._size:
+                self._entries.popitem(last=False)
+                
+    def invalidate(self, user_id):
+        with self._lock:
+            self._invalidations += 1
+            self._entries.pop(user_id, None)
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+Upkeep of the prices table, which would otherwise grow forever.
+
+Prices are partitioned by month, with partitions added a few months ahead
+of time. Once older than the retention horizon, prices are summarised into
+prices_hourly and dropped, except those still flagged for review, and
+partitions left empty are dropped whole.
+
+Each hour's summary keeps its lowest, highest and last price, with when each
+was submitted. Analytics only ever look at the lowest and highest price of
+slices made of whole hours, so reading summaries alongside the remaining
+prices gives the same results as the prices themselves did.
+"""
+import datetime
+import logging
+import re
+
+_PARTITION_NAME = 'prices_y{year:04}m{month:02}'
+_PARTITION_PATTERN = re.compile(r'^prices_y(\d{4})m(\d{2})$')
+_DEFAULT_PARTITION = 'prices_default'
+
+_logger = logging.getLogger('maintenance')
+
+def get_horizon(current_time, retention_days):
+    """
+    Returns the epoch timestamp before which prices expire, on the hour so
+    no hour is ever only partly summarised.
+    """
+    horizon = current_time - retention_days * 3600 * 24
+    return horizon - horizon % 3600
+    
+def _next_month(month):
+    if month.month == 12:
+        return month.replace(year=(month.year + 1), month=1)
+    return month.replace(month=(month.month + 1))
+    
+def is_partitioned(cursor):
+    cursor.execute("""SELECT pg_class.relkind
+        FROM pg_class
+        WHERE pg_class.oid = 'prices'::regclass""")
+    return cursor.fetchone()[0] == 'p'
+    
+def _list_partitions(cursor):
+    """
+    Returns {first day of month: name} for the monthly partitions of prices.
+    """
+    cursor.execute("""SELECT pg_class.relname
+        FROM pg_inherits, pg_class
+        WHERE pg_inherits.inhparent = 'prices'::regclass
+          AND pg_class.oid = pg_inherits.inhrelid""")
+    partitions = {}
+    for (name,) in cursor.fetchall():
+        match = _PARTITION_PATTERN.match(name)
+        if match:
+            partitions[datetime.datetime(int(match.group(1)), int(match.group(2)), 1)] = name
+    return partitions
+    
+def create_partitions(cursor, current_time, months_ahead):
+    """
+    Adds partitions for the month of `current_time` and the `months_ahead`
+    after it, where missing, returning the names of those added.
+    
+    Partitions are made months ahead so no price should reach the default
+    partition. Moving any that do takes locks on prices and flags that would
+    stall the site, so a month with prices there is only reported, to be
+    dealt with while the server is stopped.
+    """
+    partitions = _list_partitions(cursor)
+    month = datetime.datetime.utcfromtimestamp(current_time).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    created = []
+    for i in xrange(months_ahead + 1):
+        following = _next_month(month)
+        if month not in partitions:
+            name = _PARTITION_NAME.format(year=month.year, month=month.month)
+            cursor.execute("""SELECT 1
+                FROM {default}
+                WHERE {default}.ts >= %(start)s
+                  AND {default}.ts < %(end)s
+                LIMIT 1""".format(default=_DEFAULT_PARTITION), {
+                'start': month,
+                'end': following,
+            })
+            if cursor.fetchone() is not None:
+                #Postgres won't take a partition over rows in the default one
+                _logger.warn("Unable to add {name}; {default} already holds prices for that month".format(
+                    name=name,
+                    default=_DEFAULT_PARTITION,
+                ))
+            else:
+                cursor.execute("""CREATE TABLE {name}
+                    PARTITION OF prices
+                    FOR VALUES FROM (%(start)s) TO (%(end)s)""".format(name=name), {
+                    'start': month,
+                    'end': following,
+                })
+                created.append(name)
+        month = following
+    return created
+    
+def expire(cursor, horizon, batch_size):
+    """
+    Summarises and deletes every unflagged price from before `horizon`, an
+    hour-aligned datetime, crediting their submitters in
+    prices_expired_counts. Returns how many prices expired and how many
+    items they belonged to.
+    
+    Prices go oldest first, `batch_size` to a statement, so no transaction
+    holds locks or grows for long; each batch happens entirely or not at
+    all, and an hour split between batches is merged into one summary.
+    """
+    expired = 0
+    item_ids = set()
+    while True:
+        cursor.execute("""WITH batch AS (
+                SELECT prices.item_id, prices.ts
+                FROM prices
+                WHERE prices.ts < %(horizon)s
+                  AND NOT EXISTS (
+                    SELECT 1
+                    FROM flags
+                    WHERE flags.price_item_id = prices.item_id
+                      AND flags.price_ts = prices.ts
+                  )
+                ORDER BY prices.ts ASC
+                LIMIT %(batch_size)s
+            ), expired AS (
+                DELETE
+                FROM prices
+                USING batch
+                WHERE prices.item_id = batch.item_id
+                  AND prices.ts = batch.ts
+                RETURNING prices.item_id, prices.ts, prices.value, prices.submitting_user
+            ), credited AS (
+                INSERT
+                INTO prices_expired_counts (user_id, count)
+                SELECT expired.submitting_user, COUNT(*)
+                FROM expired
+                GROUP BY expired.submitting_user
+                ON CONFLICT (user_id) DO UPDATE
+                SET count = prices_expired_counts.count + EXCLUDED.count
+            ), summarised AS (
+                INSERT
+                INTO prices_hourly (item_id, hour, count, low_ts, low_value, high_ts, high_value, last_ts, last_value)
+                SELECT expired.item_id, DATE_TRUNC('hour', expired.ts), COUNT(*),
+                    (ARRAY_AGG(expired.ts ORDER BY expired.value ASC, expired.ts DESC))[1], MIN(expired.value),
+                    (ARRAY_AGG(expired.ts ORDER BY expired.value DESC, expired.ts DESC))[1], MAX(expired.value),
+                    MAX(expired.ts), (ARRAY_AGG(expired.value ORDER BY expired.ts DESC))[1]
+                FROM expired
+                GROUP BY expired.item_id, DATE_TRUNC('hour', expired.ts)
+                --Hours split between batches, or with prices that were flagged the first time round,
+                --are merged; as in analytics, the most recent of equal extremes wins
+                ON CONFLICT (item_id, hour) DO UPDATE
+                SET count = prices_hourly.count + EXCLUDED.count,
+                    low_ts = CASE
+                        WHEN EXCLUDED.low_value < prices_hourly.low_value THEN EXCLUDED.low_ts
+                        WHEN EXCLUDED.low_value = prices_hourly.low_value THEN GREATEST(prices_hourly.low_ts, EXCLUDED.low_ts)
+                        ELSE prices_hourly.low_ts
+                    END,
+                    low_value = LEAST(prices_hourly.low_value, EXCLUDED.low_value),
+                    high_ts = CASE
+                        WHEN EXCLUDED.high_value > prices_hourly.high_value THEN EXCLUDED.high_ts
+                        WHEN EXCLUDED.high_value = prices_hourly.high_value THEN GREATEST(prices_hourly.high_ts, EXCLUDED.high_ts)
+                        ELSE prices_hourly.high_ts
+                    END,
+                    high_value = GREATEST(prices_hourly.high_value, EXCLUDED.high_value),
+                    last_ts = GREATEST(prices_hourly.last_ts, EXCLUDED.last_ts),
+                    last_value = CASE
+                        WHEN EXCLUDED.last_ts > prices_hourly.last_ts THEN EXCLUDED.last_value
+                        ELSE prices_hourly.last_value
+                    END
+                RETURNING prices_hourly.item_id
+            )
+            SELECT
+                (SELECT COUNT(*) FROM expired),
+                ARRAY(SELECT DISTINCT summarised.item_id FROM summarised)""", {
+            'horizon': horizon,
+            'batch_size': batch_size,
+        })
+        (count, batch_item_ids) = cursor.fetchone()
+        expired += count
+        item_ids.update(batch_item_ids)
+        if count < batch_size:
+            return (expired, len(item_ids))
+            
+def drop_partitions(cursor, horizon):
+    """
+    Drops the partitions that lie wholly before `horizon` and hold no prices,
+    returning their names. Each is dropped in a transaction of its own, so
+    the cursor's connection must be in autocommit mode.
+    """
+    dropped = []
+    for (month, name) in sorted(_list_partitions(cursor).iteritems()):
+        if _next_month(month) > horizon:
+            break
+        cursor.execute("BEGIN")
+        try:
+            #Flagged prices are kept past the horizon until their flags are resolved
+            cursor.execute("""SELECT 1
+                FROM {name}
+                LIMIT 1""".format(name=name))
+            if cursor.fetchone() is None:
+                cursor.execute("""ALTER TABLE prices
+                    DETACH PARTITION {name}""".format(name=name))
+                cursor.execute("""DROP TABLE {name}""".format(name=name))
+                dropped.append(name)
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+    return dropped
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Timings of requests, queries, pool checkouts, cache writes and renders,
+exposed in Prometheus's text format.
+
+Recording is a bisect and a few additions under a lock, so it stays on.
+Every worker keeps its own figures.
+"""
+import bisect
+import logging
+import threading
+import time
+
+_REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+_logger = logging.getLogger('metrics')
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+    
+def _format_labels(names, values, extra=()):
+    pairs = ['{name}="{value}"'.format(name=name, value=_escape(value)) for (name, value) in zip(names, values)]
+    pairs.extend('{name}="{value}"'.format(name=name, value=value) for (name, value) in extra)
+    return pairs and '{{{pairs}}}'.format(pairs=','.join(pairs)) or ''
+    
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+    
+class _Timer(object):
+    __slots__ = ('_histogram', '_labels', '_start')
+    
+    def __init__(self, histogram, labels):
+        self._histogram = histogram
+        self._labels = labels
+        
+    def __enter__(self):
+        self._start = time.time()
+        return self
+        
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._histogram.observe(time.time() - self._start, *self._labels)
+        
+class Histogram(object):
+    """
+    Durations, in seconds, counted into buckets for each combination of
+    label values.
+    """
+    _lock = None
+    _series = None #label values: [per-bucket counts, with +Inf last; sum]
+    
+    def __init__(self, name, documentation, labels=(), buckets=_FAST_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}
+        REGISTRY.append(self)
+        
+    def observe(self, value, *labels):
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][position] += 1
+            series[1] += value
+            
+    def time(self, *labels):
+        """
+        Returns a context manager that observes how long its block takes.
+        """
+        return _Timer(self, labels)
+        
+    def collect(self):
+        with self._lock:
+            series = sorted((labels, (list(counts), total)) for (labels, (counts, total)) in self._series.iteritems())
+        lines = [
+            '# HELP {name} {documentation}'.format(name=self.name, documentation=self.documentation),
+            '# TYPE {name} histogram'.format(name=self.name),
+        ]
+        for (labels, (counts, total)) in series:
+            cumulative = 0
+            for (bound, count) in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                lines.append('{name}_bucket{labels} {count}'.format(
+                    name=self.name,
+                    labels=_format_labels(self.labels, labels, (('le', _format_value(bound)),)),
+                    count=cumulative,
+                ))
+            lines.append('{name}_sum{labels} {total}'.format(
+                name=self.name,
+                labels=_format_labels(self.labels, labels),
+                total=_format_value(total),
+            ))
+            lines.append('{name}_count{labels} {count}'.format(
+                name=self.name,
+                labels=_format_labels(self.labels, labels),
+                count=cumulative,
+            ))
+        return lines
+        
+class TimedLock(object):
+    """
+    A lock whose callers' waits for it, and how long they then hold it, are
+    observed by the given histograms.
+    """
+    _lock = None
+    _wait = None
+    _hold = None
+    _acquired = None #Only ever set by the lock's holder
+    
+    def __init__(self, wait, hold):
+        self._lock = threading.Lock()
+        self._wait = wait
+        self._hold = hold
+        
+    def __enter__(self):
+        start = time.time()
+        self._lock.acquire()
+        self._acquired = time.time()
+        self._wait.observe(self._acquired - start)
+        return self
+        
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        held = time.time() - self._acquired
+        self._lock.release()
+        self._hold.observe(held)
+        
+class Gauges(object):
+    """
+    Figures read from elsewhere each time metrics are collected: `read` is
+    called with no arguments and returns {metric suffix: value}.
+    """
+    def __init__(self, name, documentation, read):
+        self.name = name
+        self.documentation = documentation
+        self._read = read
+        REGISTRY.append(self)
+        
+    def collect(self):
+        lines = []
+        for (suffix, value) in sorted(self._read().iteritems()):
+            name = '{name}_{suffix}'.format(name=self.name, suffix=suffix)
+            lines.extend((
+                '# HELP {name} {documentation}: {suffix}'.format(name=name, documentation=self.documentation, suffix=suffix),
+                '# TYPE {name} gauge'.format(name=name),
+                '{name} {value}'.format(name=name, value=_format_value(value)),
+            ))
+        return lines
+        
+REGISTRY = []
+
+def render():
+    """
+    Returns every metric in Prometheus's text exposition format.
+    """
+    lines = []
+    for metric in REGISTRY:
+        try:
+            lines.extend(metric.collect())
+        except Exception as e:
+            _logger.error("Unable to collect {name}: {error}".format(name=metric.name, error=e))
+    lines.append('')
+    return '\n'.join(lines)
+    
+REQUEST_DURATION = Histogram(
+    'ffxiv_market_request_duration_seconds', "Time taken to handle requests",
+    labels=('handler', 'method', 'status'), buckets=_REQUEST_BUCKETS,
+)
+QUERY_DURATION = Histogram(
+    'ffxiv_market_query_duration_seconds', "Time taken to execute statements, by the database method running them",
+    labels=('method',),
+)
+POOL_WAIT = Histogram(
+    'ffxiv_market_pool_wait_seconds', "Time spent waiting to check a connection out of the pool",
+)
+CACHE_WRITE_WAIT = Histogram(
+    'ffxiv_market_cache_write_wait_seconds', "Time cache writers spent waiting for the write lock",
+)
+CACHE_WRITE_HOLD = Histogram(
+    'ffxiv_market_cache_write_hold_seconds', "Time cache writers held the write lock",
+)
+RENDER_DURATION = Histogram(
+    'ffxiv_market_render_duration_seconds', "Time taken to render templates",
+    labels=('template',),
+)
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+A pool of database connections that makes callers wait for one to come
+free, rather than failing the moment every connection is checked out.
+
+Connections are configured once, when opened, and checked before being
+handed out, so one the server dropped while it sat idle is replaced
+instead of failing its next statement.
+"""
+import logging
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+
+_PING_AFTER = 30 #Seconds a connection may sit idle before it's pinged on checkout
+
+_logger = logging.getLogger('pool')
+
+class PoolTimeout(psycopg2.pool.PoolError):
+    """
+    No connection came free in time.
+    """
+    
+class Pool(object):
+    _maxconn = None
+    _timeout = None
+    _configure = None
+    _kwargs = None
+    _condition = None
+    _idle = None #(connection, time it was returned), most recently returned last
+    _open = 0 #Connections open or being opened, including those checked out
+    _waiting = 0
+    
+    def __init__(self, minconn, maxconn, timeout, configure, **kwargs):
+        """
+        Callers wait up to `timeout` seconds for a connection; `configure`
+        is called with each new connection, and `kwargs` are passed to
+        psycopg2.connect().
+        """
+        self._maxconn = maxconn
+        self._timeout = timeout
+        self._configure = configure
+        self._kwargs = kwargs
+        self._condition = threading.Condition()
+        self._idle = []
+        for i in xrange(minconn):
+            self._idle.append((self._connect(), time.time()))
+            self._open += 1
+            
+    def _connect(self):
+        connection = psycopg2.connect(**self._kwargs)
+        try:
+            self._configure(connection)
+        except Exception:
+            connection.close()
+            raise
+        return connection
+        
+    def _is_usable(self, connection, idle_since):
+        if connection.closed:
+            return False
+        if connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if time.time() - idle_since >= _PING_AFTER:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+            except psycopg2.Error:
+                return False
+        return True
+        
+    def _release_slot(self):
+        with self._condition:
+            self._open -= 1
+            self._condition.notify()
+            
+    def getconn(self):
+        deadline = time.time() + self._timeout
+        connection = None
+        with self._condition:
+            while True:
+                if self._idle:
+                    #The most recently used connection is the likeliest to still be alive
+                    (connection, idle_since) = self._idle.pop()
+                    break
+                if self._open < self._maxconn:
+                    self._open += 1
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise PoolTimeout("No connection came free within {timeout}s; {waiting} others waiting".format(
+                        timeout=self._timeout,
+                        waiting=self._waiting,
+                    ))
+                self._waiting += 1
+                try:
+                    self._condition.wait(remaining)
+                finally:
+                    self._waiting -= 1
+                    
+        #The slot is this caller's now, so checks and connecting happen outside the lock
+        if connection is not None:
+            if self._is_usable(connection, idle_since):
+                return connection
+            _logger.warn("Replacing an unusable database connection")
+            if not connection.closed:
+                connection.close()
+        try:
+            return self._connect()
+        except Exception:
+            self._release_slot()
+            raise
+            
+    def putconn(self, connection):
+        if not connection.closed and connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                connection.rollback()
+            except psycopg2.Error:
+                connection.close()
+        if connection.closed:
+            self._release_slot()
+            return
+        with self._condition:
+            self._idle.append((connection, time.time()))
+            self._condition.notify()
+            
+    def closeall(self):
+        with self._condition:
+            (idle, self._idle) = (self._idle, [])
+            self._open -= len(idle)
+        for (connection, idle_since) in idle:
+            connection.close()
+            
+    def stats(self):
+        with self._condition:
+            return {
+                'open': self._open,
+                'idle': len(self._idle),
+                'waiting': self._waiting,
+            }
+            
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+Pushes price changes to open pages, so nobody has to reload to see them.
+
+Pages subscribe over a WebSocket, either to the dashboard, which hears of
+every item, or to the handful of items they show. Changes are gathered on
+the IOLoop for a moment, then each distinct message is encoded once and
+shared by every subscriber it's meant for.
+
+Messages are JSON objects: "p" lists items' latest prices as [item ID,
+timestamp, value, average], with nulls once an item has no price left, and
+"d" lists deleted prices as [item ID, timestamp], for subscribers to items.
+
+A subscriber that can't keep up is disconnected once `queue_limit` messages
+are waiting for it; the page reconnects and has what it shows corrected.
+"""
+import collections
+import json
+import logging
+
+import tornado.websocket
+
+import metrics
+from common import CONFIG
+
+_CLOSE_TOO_FAR_BEHIND = 1013 #"Try again later"
+
+_logger = logging.getLogger('push')
+
+class Subscriber(object):
+    """
+    A connection's subscription and the messages it has yet to be sent.
+    `connection` is a WebSocketHandler.
+    """
+    item_ids = frozenset()
+    dashboard = False
+    _connection = None
+    _queue_limit = None
+    _queue = None
+    _writing = False
+    
+    def __init__(self, connection, queue_limit):
+        self._connection = connection
+        self._queue_limit = queue_limit
+        self._queue = collections.deque()
+        
+    def send(self, message):
+        """
+        Writes `message`, an encoded JSON string, once those before it are
+        out; returns False if the connection was dropped for falling behind.
+        """
+        if self._writing:
+            if len(self._queue) >= self._queue_limit:
+                self._connection.close(_CLOSE_TOO_FAR_BEHIND, "Too far behind")
+                return False
+            self._queue.append(message)
+            return True
+        self._write(message)
+        return True
+        
+    def _write(self, message):
+        try:
+            future = self._connection.write_message(message)
+        except tornado.websocket.WebSocketClosedError: #on_close will unsubscribe it
+            future = None
+        if future is None: #Tornado returns no Future for a peer that's already gone
+            self._queue.clear()
+            return
+        self._writing = True
+        future.add_done_callback(self._written)
+        
+    def _written(self, future):
+        self._writing = False
+        if future.exception() is not None:
+            self._queue.clear()
+        elif self._queue:
+            self._write(self._queue.popleft())
+            
+class _Hub(object):
+    _io_loop = None
+    _flush_delay = None
+    _queue_limit = None
+    _dashboards = None #Subscribers to every item
+    _items = None #item ID: subscribers to it
+    _prices = None #item ID: latest price entry, not yet sent
+    _deleted = None #Deleted price entries, not yet sent
+    _flush_scheduled = False
+    _messages = 0
+    _dropped = 0
+    
+    def __init__(self, flush_delay, queue_limit):
+        self._flush_delay = flush_delay
+        self._queue_limit = queue_limit
+        self._dashboards = set()
+        self._items = collections.defaultdict(set)
+        self._prices = collections.OrderedDict()
+        self._deleted = []
+        
+    def start(self, io_loop):
+        """
+        Starts delivering what's published; until then, it's discarded.
+        """
+        self._io_loop = io_loop
+        
+    def publish(self, prices=(), deleted=()):
+        """
+        Queues latest prices, as (item ID, timestamp, value, average), and
+        deleted prices, as (item ID, timestamp), for delivery. Safe to call
+        from any thread.
+        """
+        if self._io_loop is None:
+            return
+        self._io_loop.add_callback(self._gather, [list(price) for price in prices], [list(price) for price in deleted])
+        
+    def _gather(self, prices, deleted):
+        if not self._dashboards and not self._items:
+            return
+        for price in prices:
+            self._prices.pop(price[0], None) #Keep them in the order they last changed
+            self._prices[price[0]] = price
+        self._deleted.extend(deleted)
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            self._io_loop.call_later(self._flush_delay, self._flush)
+            
+    def _flush(self):
+        (prices, deleted) = (self._prices, self._deleted)
+        (self._prices, self._deleted) = (collections.OrderedDict(), [])
+        self._flush_scheduled = False
+        
+        if prices and self._dashboards:
+            self._send(self._dashboards, json.dumps({'p': prices.values()}, separators=(',', ':')))
+            
+        targets = collections.defaultdict(lambda: ([], []))
+        for (item_id, price) in prices.iteritems():
+            for subscriber in self._items.get(item_id, ()):
+                targets[subscriber][0].append(price)
+        for price in deleted:
+            for subscriber in self._items.get(price[0], ()):
+                targets[subscriber][1].append(price)
+        audiences = collections.defaultdict(list)
+        for (subscriber, (item_prices, item_deleted)) in targets.iteritems():
+            audiences[json.dumps({'p': item_prices, 'd': item_deleted}, separators=(',', ':'))].append(subscriber)
+        for (message, subscribers) in audiences.iteritems():
+            self._send(subscribers, message)
+            
+    def _send(self, subscribers, message):
+        for subscriber in list(subscribers):
+            self._messages += 1
+            if not subscriber.send(message):
+                _logger.info("Dropped a subscriber more than {limit} messages behind".format(limit=self._queue_limit))
+                self._dropped += 1
+                self.unsubscribe(subscriber)
+                
+    def subscribe(self, subscriber, item_ids, dashboard):
+        """
+        Replaces the subscriber's subscription; a dashboard hears of every
+        item, so `item_ids` is then ignored. Call only on the IOLoop.
+        """
+        self.unsubscribe(subscriber)
+        if dashboard:
+            subscriber.dashboard = True
+            self._dashboards.add(subscriber)
+        else:
+            subscriber.item_ids = frozenset(item_ids)
+            for item_id in subscriber.item_ids:
+                self._items[item_id].add(subscriber)
+                
+    def unsubscribe(self, subscriber):
+        self._dashboards.discard(subscriber)
+        subscriber.dashboard = False
+        for item_id in subscriber.item_ids:
+            subscribers = self._items.get(item_id)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._items[item_id]
+        subscriber.item_ids = frozenset()
+        
+    def new_subscriber(self, connection):
+        return Subscriber(connection, self._queue_limit)
+        
+    def stats(self):
+        return {
+            'dashboards': len(self._dashboards),
+            'items': len(self._items),
+            'messages': self._messages,
+            'dropped': self._dropped,
+        }
+HUB = _Hub(
+    flush_delay=CONFIG['server']['push']['flush_delay'],
+    queue_limit=CONFIG['server']['push']['queue_limit'],
+)
+metrics.Gauges('ffxiv_market_push', "Live price push", HUB.stats)
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Per-item price summaries for the item page, kept up to date as prices
+arrive so a view needn't reload and re-analyse a month of history.
+
+Each rollup keeps only the lowest and highest price of each of the
+graph's slices, which is all the analytics module needs.
+"""
+import collections
+import logging
+import threading
+
+from analytics import (
+    PriceDatum, Slices,
+    analyse, get_timescale, reduce,
+)
+
+_logger = logging.getLogger('rollups')
+
+class _ItemRollup(object):
+    _timescale = None
+    _data_points = None
+    _slices = None #slice number: [low PriceDatum, high PriceDatum]
+    _revision = 0 #Bumped whenever the slices change
+    _analytics = None
+    _analytics_slice = None
+    
+    def __init__(self, timescale, data_points):
+        self._timescale = timescale
+        self._data_points = data_points
+        self._slices = {}
+        
+    def add(self, timestamp, value):
+        """
+        Folds a price into its slice; adding the same price twice is
+        harmless.
+        """
+        datum = PriceDatum(timestamp, value)
+        extremes = self._slices.get(timestamp // self._timescale)
+        if extremes is None:
+            self._slices[timestamp // self._timescale] = [datum, datum]
+        else:
+            #On ties, the most recent price is the one to show
+            if (value, -timestamp) < (extremes[0].value, -extremes[0].timestamp):
+                extremes[0] = datum
+            if (value, timestamp) > (extremes[1].value, extremes[1].timestamp):
+                extremes[1] = datum
+        self._revision += 1
+        self._analytics = None
+        
+    def add_slices(self, slices):
+        """
+        Takes the Slices of a freshly loaded history.
+        """
+        for (number, low_timestamp, low_value, high_timestamp, high_value) in zip(*(column.tolist() for column in slices)):
+            self._slices[number] = [PriceDatum(low_timestamp, low_value), PriceDatum(high_timestamp, high_value)]
+        self._revision += 1
+        self._analytics = None
+        
+    def get_analytics(self, current_time):
+        """
+        Returns the analytics last worked out, or None if the window has
+        rolled over or prices have changed since.
+        """
+        if self._analytics_slice == current_time // self._timescale:
+            return self._analytics
+        return None
+        
+    def get_slices(self, current_time):
+        """
+        Returns the revision and a copy of the Slices within the window, to
+        be analysed without holding up anything else.
+        """
+        current_slice = current_time // self._timescale
+        for number in [n for n in self._slices if current_slice - n >= self._data_points]:
+            del self._slices[number]
+        numbers = sorted(self._slices)
+        return (self._revision, Slices(
+            numbers,
+            [self._slices[n][0].timestamp for n in numbers], [self._slices[n][0].value for n in numbers],
+            [self._slices[n][1].timestamp for n in numbers], [self._slices[n][1].value for n in numbers],
+        ))
+        
+    def set_analytics(self, revision, current_time, analytics):
+        """
+        Keeps analytics worked out from get_slices(), unless prices have
+        changed since.
+        """
+        if revision == self._revision:
+            self._analytics = analytics
+            self._analytics_slice = current_time // self._timescale
+            
+class Rollups(object):
+    """
+    Rollups for recently viewed items, loaded on first view and then kept
+    current by add() and invalidate(), which must be called only once the
+    change is committed.
+    """
+    _lock = None
+    _rollups = None
+    _loading = None #item ID: prices added while its rollup was being loaded
+    _load = None
+    _size = None
+    _timescale = None
+    _data_points = None
+    
+    def __init__(self, load, size, days, data_points):
+        """
+        `load` is called with an item's ID and the oldest timestamp of
+        interest, returning the (timestamp, value) pairs since then.
+        """
+        self._lock = threading.Lock()
+        self._rollups = collections.OrderedDict()
+        self._loading = {}
+        self._load = load
+        self._size = size
+        self._timescale = get_timescale(days, data_points)
+        self._data_points = data_points
+        
+    def get_analytics(self, item_id, current_time):
+        with self._lock:
+            rollup = self._rollups.pop(item_id, None)
+            if rollup is not None:
+                self._rollups[item_id] = rollup
+                analytics = rollup.get_analytics(current_time)
+                if analytics is not None:
+                    return analytics
+                (revision, slices) = rollup.get_slices(current_time)
+            else:
+                pending = self._loading.setdefault(item_id, [])
+                
+        if rollup is None:
+            rollup = _ItemRollup(self._timescale, self._data_points)
+            oldest_slice = current_time // self._timescale - self._data_points + 1
+            prices = self._load(item_id, oldest_slice * self._timescale)
+            rollup.add_slices(reduce(
+                [timestamp for (timestamp, value) in prices], [value for (timestamp, value) in prices],
+                self._timescale,
+            ))
+            
+            with self._lock:
+                if self._loading.get(item_id) is pending: #Nothing was deleted in the meantime
+                    del self._loading[item_id]
+                    for (timestamp, value) in pending:
+                        rollup.add(timestamp, value)
+                    self._rollups[item_id] = rollup
+                    while len(self._rollups) > self._size:
+                        self._rollups.popitem(last=False)
+                (revision, slices) = rollup.get_slices(current_time)
+                
+        #Analysis is the slow part, so it's done outside the lock, where views
+        #of other items needn't wait on it
+        analytics = analyse(slices, current_time, self._timescale, self._data_points)
+        with self._lock:
+            rollup.set_analytics(revision, current_time, analytics)
+        return analytics
+        
+    def add(self, item_id, timestamp, value):
+        with self._lock:
+            rollup = self._rollups.get(item_id)
+            if rollup is not None:
+                rollup.add(timestamp, value)
+            elif item_id in self._loading:
+                self._loading[item_id].append((timestamp, value))
+                
+    def invalidate(self, item_id):
+        """
+        Drops an item's rollup, to be reloaded on its next view; slices only
+        know their extremes, so they can't account for deletions.
+        """
+        with self._lock:
+            self._rollups.pop(item_id, None)
+            self._loading.pop(item_id, None)
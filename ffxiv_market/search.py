@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Substring search over item names, so autocomplete needn't scan base_items
+with a leading-wildcard LIKE on every keystroke.
+"""
+import collections
+import logging
+import threading
+
+_GRAM = 3
+_TERM_CACHE_SIZE = 64
+
+_logger = logging.getLogger('search')
+
+def _grams(text):
+    return set(text[i:i + _GRAM] for i in xrange(len(text) - _GRAM + 1))
+    
+class _LanguageIndex(object):
+    """
+    One language's names, sorted as items_search always returned them, with
+    a trigram index of positions in that ordering.
+    
+    Names are matched case-insensitively as unicode, so the Japanese names'
+    trigrams are characters rather than bytes.
+    """
+    _entries = None
+    _grams = None
+    _terms = None
+    _lock = None
+    
+    def __init__(self, names):
+        """
+        `names` is an iterable of (name, item_id, hq), with name in UTF-8.
+        """
+        self._entries = sorted(
+            (name.decode('utf-8').lower(), hq, name, item_id)
+            for (name, item_id, hq) in names
+        )
+        self._grams = collections.defaultdict(list)
+        for (position, entry) in enumerate(self._entries):
+            for gram in _grams(entry[0]):
+                self._grams[gram].append(position)
+        self._terms = collections.OrderedDict()
+        self._lock = threading.Lock()
+        
+    def _get_candidates(self, term):
+        """
+        Returns an ordered sequence of positions that may match `term`: the
+        matches for an earlier term contained in it, if one was cached, or
+        else whatever its trigrams have in common.
+        """
+        with self._lock:
+            narrowest = None
+            for (cached_term, positions) in self._terms.iteritems():
+                if cached_term in term and (narrowest is None or len(positions) < len(narrowest)):
+                    narrowest = positions
+        if narrowest is not None:
+            return narrowest
+            
+        if len(term) < _GRAM:
+            return xrange(len(self._entries))
+        postings = sorted((self._grams.get(gram, ()) for gram in _grams(term)), key=len)
+        if not postings[0]:
+            return ()
+        candidates = set(postings[0])
+        for positions in postings[1:]:
+            candidates.intersection_update(positions)
+            if not candidates:
+                return ()
+        return sorted(candidates)
+        
+    def _match(self, term):
+        with self._lock:
+            positions = self._terms.pop(term, None)
+            if positions is not None:
+                self._terms[term] = positions
+                return positions
+                
+        entries = self._entries
+        positions = [p for p in self._get_candidates(term) if term in entries[p][0]]
+        with self._lock:
+            self._terms[term] = positions
+            while len(self._terms) > _TERM_CACHE_SIZE:
+                self._terms.popitem(last=False)
+        return positions
+        
+    def search(self, term, limit):
+        entries = self._entries
+        positions = self._match(term)
+        
+        #Names starting with the term come first, each group in name order
+        results = [p for p in positions if entries[p][0].startswith(term)][:limit]
+        if len(results) < limit:
+            results.extend([p for p in positions if not entries[p][0].startswith(term)][:limit - len(results)])
+        return [(entries[p][2], entries[p][3], entries[p][1]) for p in results]
+        
+class NameIndex(object):
+    def __init__(self, item_refs, languages):
+        """
+        `item_refs` is an iterable of ItemRefs; `languages` names their
+        ItemName fields to index.
+        """
+        item_states = [item_ref.item_state for item_ref in item_refs]
+        self._languages = dict(
+            (language, _LanguageIndex(
+                (getattr(item_state.name, language), item_state.id, item_state.hq)
+                for item_state in item_states
+            ))
+            for language in languages
+        )
+        
+    def search(self, language, term, limit):
+        """
+        Returns up to `limit` (name, item_id, hq) tuples whose name in
+        `language` contains `term`, those that start with it first.
+        """
+        if isinstance(term, str):
+            term = term.decode('utf-8')
+        term = term.lower()
+        if not term:
+            return []
+        return self._languages[language].search(term, limit)
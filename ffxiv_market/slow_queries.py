@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+A rolling log of statements that took too long, with query plans for a
+sample of them, so a slow page can be traced to the query at fault.
+
+Statements are logged as written, with placeholders where parameters go
+and, as pg_stat_statements does, in place of every constant, since some
+statements have values mogrified into them; parameter values are never
+kept. Plans come from EXPLAIN (ANALYZE, BUFFERS) on a connection of the
+log's own, in a transaction that's always rolled back, and only for
+SELECTs, including the prepared ones the pool EXECUTEs. Their string
+constants are scrubbed too, as are the numbers in their conditions and
+filters, leaving costs, timings and row counts alone.
+"""
+import collections
+import logging
+import random
+import re
+import threading
+import time
+
+import concurrent.futures
+
+_EXPLAINABLE = ('SELECT', 'EXECUTE') #Every statement the pool prepares is a SELECT
+
+_STRING_CONSTANT = re.compile(r"'(?:[^']|'')*'")
+_NUMERIC_CONSTANT = re.compile(r'(?<![\w.$])\d+(?:\.\d+)?(?:[eE][-+]?\d+)?(?![\w.])')
+_PLAN_CONDITION = re.compile(r'^(?!\s*Rows Removed)\s*[A-Za-z -]*(?:Cond|Filter|Key): ')
+
+_logger = logging.getLogger('slow_queries')
+
+def _describe_parameters(vars):
+    if vars is None:
+        return ''
+    if isinstance(vars, dict):
+        return ', '.join('{name}=?'.format(name=name) for name in sorted(vars))
+    return ', '.join('?' for value in vars)
+    
+def _scrub(text):
+    """
+    Replaces the string and numeric constants in `text` with ?.
+    """
+    return _NUMERIC_CONSTANT.sub('?', _STRING_CONSTANT.sub("'?'", text))
+    
+def _scrub_plan(plan):
+    return '\n'.join(
+        _PLAN_CONDITION.match(line) and _scrub(line) or _STRING_CONSTANT.sub("'?'", line)
+        for line in plan.split('\n')
+    )
+    
+class SlowQueryLog(object):
+    threshold = None #Seconds a statement may take before it's logged
+    _entries = None
+    _explain_rate = None
+    _connect = None
+    _connection = None
+    _executor = None
+    _explaining = False
+    _lock = None
+    
+    def __init__(self, threshold, size, explain_rate, connect):
+        """
+        `explain_rate` is the fraction of slow SELECTs to capture plans for;
+        `connect` returns a new connection to run EXPLAIN on.
+        """
+        self.threshold = threshold
+        self._entries = collections.deque(maxlen=size)
+        self._explain_rate = explain_rate
+        self._connect = connect
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._lock = threading.Lock()
+        
+    def record(self, cursor, method, query, vars, duration):
+        """
+        Logs a statement that `cursor` just executed for the _Database
+        `method`.
+        """
+        entry = {
+            'timestamp': int(time.time()),
+            'method': method,
+            'duration': duration,
+            'statement': _scrub(' '.join(query.split())),
+            'parameters': _describe_parameters(vars),
+            'plan': None,
+        }
+        self._entries.append(entry)
+        _logger.info("{method} took {duration:.3f}s".format(method=method, duration=duration))
+        
+        if not query.lstrip().upper().startswith(_EXPLAINABLE) or random.random() >= self._explain_rate:
+            return
+        with self._lock:
+            if self._explaining: #Plans are a sample anyway; don't let them queue up
+                return
+            self._explaining = True
+        statement = cursor.mogrify(query, vars)
+        self._executor.submit(self._explain, entry, statement)
+        
+    def _explain(self, entry, statement):
+        try:
+            if self._connection is None or self._connection.closed:
+                self._connection = self._connect()
+            try:
+                with self._connection.cursor() as cursor:
+                    cursor.execute("EXPLAIN (ANALYZE, BUFFERS) " + statement)
+                    plan = '\n'.join(line for (line,) in cursor.fetchall())
+            finally:
+                self._connection.rollback()
+            entry['plan'] = _scrub_plan(plan)
+        except Exception as e:
+            _logger.warn("Unable to explain a statement from {method}: {error}".format(
+                method=entry['method'],
+                error=e,
+            ))
+            if self._connection is not None: #Start afresh next time
+                self._connection.close()
+                self._connection = None
+        finally:
+            with self._lock:
+                self._explaining = False
+                
+    def list(self):
+        """
+        Returns the logged statements, newest first, as dicts of their
+        timestamp, method, duration, statement, parameters and plan.
+        """
+        return list(reversed(self._entries))
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Compact on-disk image of the item cache, so restarts only need to reconcile
+it with the item_latest rows that changed since it was taken.
+
+Layout (little-endian):
+    header: magic, format version, item count, high-water timestamp (when
+            the cache was read), write timestamp, catalogue digest
+    records: one fixed-size record per item, in id order
+    names: four length-prefixed UTF-8 names per item, in id order
+"""
+import logging
+import mmap
+import os
+import struct
+import time
+
+_MAGIC = 'FXMC'
+_VERSION = 2
+
+_HEADER = struct.Struct('<4sHIqq32s')
+_RECORD = struct.Struct('<IBBqii') #id, hq, flags, timestamp, value, average
+_NAME_LENGTH = struct.Struct('<H')
+
+_FLAG_PRICE = 1
+_FLAG_AVERAGE = 2
+
+_logger = logging.getLogger('snapshot')
+
+def write(path, item_refs, catalogue_digest, high_water):
+    """
+    Atomically replaces the snapshot at `path` with the given ItemRefs, which
+    must be sorted by id and read from the cache no earlier than
+    `high_water`.
+    """
+    records = []
+    names = []
+    for item_ref in item_refs:
+        item_state = item_ref.item_state
+        flags = 0
+        timestamp = value = average = 0
+        if item_state.price:
+            flags |= _FLAG_PRICE
+            timestamp = item_state.price.timestamp
+            value = item_state.price.value
+        if item_ref.average is not None:
+            flags |= _FLAG_AVERAGE
+            average = item_ref.average
+        records.append(_RECORD.pack(item_state.id, item_state.hq, flags, timestamp, value, average))
+        for name in item_state.name:
+            names.append(_NAME_LENGTH.pack(len(name)))
+            names.append(name)
+
+    temporary_path = '{path}.tmp'.format(path=path)
+    with open(temporary_path, 'wb') as snapshot_file:
+        snapshot_file.write(_HEADER.pack(
+            _MAGIC, _VERSION, len(records), int(high_water), int(time.time()), catalogue_digest,
+        ))
+        snapshot_file.write(''.join(records))
+        snapshot_file.write(''.join(names))
+        snapshot_file.flush()
+        os.fsync(snapshot_file.fileno())
+    os.rename(temporary_path, path)
+    _logger.info("Wrote snapshot of {count} items to {path}".format(
+        count=len(records),
+        path=path,
+    ))
+
+def read(path, catalogue_digest):
+    """
+    Returns (written_ts, high_water_ts, [(id, hq, names, timestamp, value, average)])
+    or None if the snapshot is missing, malformed, from another format
+    version, or describes a different catalogue.
+
+    Prices and averages are None when the snapshot has no data for them.
+    """
+    if not os.path.isfile(path):
+        _logger.info("No snapshot at {path}".format(path=path))
+        return None
+
+    with open(path, 'rb') as snapshot_file:
+        try:
+            snapshot = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, mmap.error) as e: #Empty file
+            _logger.warn("Unable to map snapshot {path}: {error}".format(path=path, error=e))
+            return None
+    try:
+        return _parse(snapshot, path, catalogue_digest)
+    except struct.error as e:
+        _logger.warn("Snapshot {path} is truncated: {error}".format(path=path, error=e))
+        return None
+    finally:
+        snapshot.close()
+
+def _parse(snapshot, path, catalogue_digest):
+    (magic, version, count, high_water, written, digest) = _HEADER.unpack_from(snapshot, 0)
+    if magic != _MAGIC or version != _VERSION:
+        _logger.warn("Snapshot {path} has an unsupported format".format(path=path))
+        return None
+    if digest != catalogue_digest:
+        _logger.warn("Snapshot {path} does not match the current catalogue".format(path=path))
+        return None
+
+    items = []
+    record_offset = _HEADER.size
+    name_offset = record_offset + _RECORD.size * count
+    for i in xrange(count):
+        (item_id, hq, flags, timestamp, value, average) = _RECORD.unpack_from(snapshot, record_offset)
+        record_offset += _RECORD.size
+
+        names = []
+        for j in xrange(4):
+            (length,) = _NAME_LENGTH.unpack_from(snapshot, name_offset)
+            name_offset += _NAME_LENGTH.size
+            name = snapshot[name_offset:name_offset + length]
+            if len(name) != length:
+                raise struct.error("name table ends early")
+            names.append(name)
+            name_offset += length
+
+        if not flags & _FLAG_PRICE:
+            timestamp = value = None
+        if not flags & _FLAG_AVERAGE:
+            average = None
+        items.append((item_id, bool(hq), names, timestamp, value, average))
+    return (written, high_water, items)
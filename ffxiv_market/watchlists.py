@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Everyone's watchlists, held in memory so pages needn't query for them.
+
+The watchlist table remains the record: changes are written to it first and
+then applied here. Besides each user's items, the index keeps how many users
+watch each item and a ranking of watched items by that count, which is
+adjusted one entry at a time as items are watched and unwatched, so the
+most-watched list is just its head.
+"""
+import bisect
+import collections
+import logging
+import threading
+
+_logger = logging.getLogger('watchlists')
+
+class Watchlists(object):
+    version = 0 #Changes whenever anyone's watchlist does
+    _items = None #user ID: set of item IDs
+    _watchers = None #item ID: how many users watch it
+    _ranking = None #(-watchers, item ID) for every watched item, most-watched first
+    _lock = None
+    
+    def __init__(self, entries):
+        """
+        `entries` are the (user ID, item ID) rows of the watchlist table.
+        """
+        self._items = collections.defaultdict(set)
+        self._watchers = collections.defaultdict(int)
+        for (user_id, item_id) in entries:
+            self._items[user_id].add(item_id)
+            self._watchers[item_id] += 1
+        self._ranking = sorted((-watchers, item_id) for (item_id, watchers) in self._watchers.iteritems())
+        self._lock = threading.Lock()
+        _logger.info("Watchlists hold {entries} entries of {users} users, over {items} items".format(
+            entries=sum(len(item_ids) for item_ids in self._items.itervalues()),
+            users=len(self._items),
+            items=len(self._watchers),
+        ))
+        
+    def _rerank(self, item_id, delta):
+        watchers = self._watchers[item_id]
+        if watchers:
+            del self._ranking[bisect.bisect_left(self._ranking, (-watchers, item_id))]
+        watchers += delta
+        if watchers:
+            self._watchers[item_id] = watchers
+            bisect.insort(self._ranking, (-watchers, item_id))
+        else:
+            del self._watchers[item_id]
+            
+    def add(self, user_id, item_id):
+        """
+        Returns whether the item wasn't already on the user's watchlist.
+        """
+        with self._lock:
+            item_ids = self._items[user_id]
+            if item_id in item_ids:
+                return False
+            item_ids.add(item_id)
+            self._rerank(item_id, 1)
+            self.version += 1
+            return True
+            
+    def remove(self, user_id, item_id):
+        """
+        Returns whether the item was on the user's watchlist.
+        """
+        with self._lock:
+            item_ids = self._items.get(user_id)
+            if not item_ids or item_id not in item_ids:
+                return False
+            item_ids.remove(item_id)
+            if not item_ids:
+                del self._items[user_id]
+            self._rerank(item_id, -1)
+            self.version += 1
+            return True
+            
+    def clear(self, user_id):
+        with self._lock:
+            item_ids = self._items.pop(user_id, None)
+            if not item_ids:
+                return
+            for item_id in item_ids:
+                self._rerank(item_id, -1)
+            self.version += 1
+            
+    def list(self, user_id):
+        """
+        Returns the IDs of the items the user watches, in ascending order.
+        """
+        with self._lock:
+            return sorted(self._items.get(user_id, ()))
+            
+    def count(self, user_id):
+        with self._lock:
+            return len(self._items.get(user_id, ()))
+            
+    def is_watching(self, user_id, item_id):
+        with self._lock:
+            return item_id in self._items.get(user_id, ())
+            
+    def get_most_watched(self, limit=None):
+        """
+        Returns the IDs of the most-watched items, most-watched first; ties
+        go to the lowest ID.
+        """
+        with self._lock:
+            return [item_id for (watchers, item_id) in self._ranking[:limit]]
+            
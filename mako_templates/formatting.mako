@@ -33,26 +33,31 @@ if age == 1:
 <%def name="_render_item(item_ref, callback_id)">
     <a href="/items/${item_ref.item_state.id}">${getattr(item_ref.item_state.name, identity['language']) | h}${item_ref.item_state.hq and ' HQ' or ''}</a>
     %if item_ref.item_state.price:
-        @ <span id="prc-${callback_id}">${item_ref.item_state.price.value and '{p:,}'.format(p=item_ref.item_state.price.value) or 'none'}</span>
-        %if item_ref.item_state.price.value and item_ref.average and item_ref.item_state.price.timestamp > (rendering['time_current'] - 43200):
-            <%
-                price_delta = item_ref.item_state.price.value - item_ref.average
-            %>
-            %if price_delta < 0:
-                <img src="/static/loss.png"/> ${price_delta * -1}</img>
-            %elif price_delta > 0:
-                <img src="/static/gain.png"/> ${price_delta}</img>
+        <span class="ffxivm-at">@</span> <span id="prc-${callback_id}" class="ffxivm-price">${item_ref.item_state.price.value and '{p:,}'.format(p=item_ref.item_state.price.value) or 'none'}</span>
+        <span class="ffxivm-change">
+            %if item_ref.item_state.price.value and item_ref.average and item_ref.item_state.price.timestamp > (rendering['time_current'] - 43200):
+                <%
+                    price_delta = item_ref.item_state.price.value - item_ref.average
+                %>
+                %if price_delta < 0:
+                    <img src="/static/loss.png"/> ${price_delta * -1}</img>
+                %elif price_delta > 0:
+                    <img src="/static/gain.png"/> ${price_delta}</img>
+                %endif
             %endif
-        %endif
+        </span>
     %else:
-        <span id="prc-${callback_id}"/>
+        <span class="ffxivm-at"></span> <span id="prc-${callback_id}" class="ffxivm-price"></span>
+        <span class="ffxivm-change"></span>
     %endif
     <div ${"id=\"ts-{callback_id}\" onclick=\"$('#frm-{callback_id}').show('blind');\"".format(callback_id=callback_id)} style="display: inline;">
-        %if item_ref.item_state.price:
-            ${render_timestamp(item_ref.item_state.price.timestamp)}
-        %else:
-            <span class="nodata">no history</span>
-        %endif
+        <span class="ffxivm-when">
+            %if item_ref.item_state.price:
+                ${render_timestamp(item_ref.item_state.price.timestamp)}
+            %else:
+                <span class="nodata">no history</span>
+            %endif
+        </span>
         <div style="display: none;" id="frm-${callback_id}">
             <form class="inl-up">
                 <input type="number" id="pin-${callback_id}" min="0" max="999999999" size="9" autocomplete="off" required class="inl-up"/>
@@ -76,7 +81,7 @@ if age == 1:
                 <%
                     callback_id += 1
                 %>
-                <li>${_render_item(item_ref, "{prefix}-{id}".format(prefix=callback_id_prefix, id=callback_id))}</li>
+                <li ffxivm_item="${item_ref.item_state.id}">${_render_item(item_ref, "{prefix}-{id}".format(prefix=callback_id_prefix, id=callback_id))}</li>
             %endfor
         </ul>
     %endif
@@ -1,5 +1,16 @@
+//When set, as on the dashboard, prices are held for a moment and sent
+//together, so filling in a list of them takes one request rather than one each
+var ffxivm_price_batching = false;
+var FFXIVM_PRICE_BATCH_DELAY = 2000; //Milliseconds to wait for another price
+var FFXIVM_PRICE_BATCH_LIMIT = parseInt(document.querySelector('meta[name="ffxivm-price-batch-limit"]').getAttribute('content'), 10); //The server's data.prices.batch_limit
+var ffxivm_price_batch = [];
+var ffxivm_price_batch_timer = null;
+
 function ffxivm_price_update(item_id, callback_id){
     var price = $.trim($('#pin-' + callback_id).val());
+    if(ffxivm_price_batching){
+        return ffxivm_price_queue(item_id, price, callback_id);
+    }
     $.ajax({
         url: '/items/ajax-price-update',
         type: 'POST',
@@ -20,6 +31,63 @@ function ffxivm_price_update(item_id, callback_id){
     return false;
 }
 
+function ffxivm_price_queue(item_id, price, callback_id){
+    ffxivm_price_batch.push({item_id: item_id, value: price, callback_id: callback_id});
+    $('#frm-' + callback_id).hide();
+    clearTimeout(ffxivm_price_batch_timer);
+    if(ffxivm_price_batch.length >= FFXIVM_PRICE_BATCH_LIMIT){
+        ffxivm_price_flush();
+    }else{
+        ffxivm_price_batch_timer = setTimeout(ffxivm_price_flush, FFXIVM_PRICE_BATCH_DELAY);
+    }
+    return false;
+}
+
+function ffxivm_price_batch_data(batch){
+    return {
+        item_id: $.map(batch, function(entry){return entry.item_id;}),
+        value: $.map(batch, function(entry){return entry.value;})
+    };
+}
+
+function ffxivm_price_flush(){
+    var batch = ffxivm_price_batch;
+    ffxivm_price_batch = [];
+    clearTimeout(ffxivm_price_batch_timer);
+    ffxivm_price_batch_timer = null;
+    if(!batch.length){
+        return;
+    }
+    $.ajax({
+        url: '/items/ajax-prices-update',
+        type: 'POST',
+        timeout: 5000,
+        traditional: true,
+        data: ffxivm_price_batch_data(batch),
+    })
+    .done(function(result){
+        $.each(batch, function(i, entry){
+            $('#ts-' + entry.callback_id).remove();
+            $('#prc-' + entry.callback_id).text(entry.value);
+        });
+    })
+    .fail(function(result){
+        alert("Unable to update " + $.map(batch, function(entry){return entry.item_id + "@" + entry.value;}).join(', '));
+        $.each(batch, function(i, entry){
+            $('#frm-' + entry.callback_id).show();
+        });
+    })
+    ;
+}
+
+//Anything still held when the page is left goes out with it
+window.addEventListener('pagehide', function(){
+    if(ffxivm_price_batch.length && navigator.sendBeacon){
+        navigator.sendBeacon('/items/ajax-prices-update', new URLSearchParams($.param(ffxivm_price_batch_data(ffxivm_price_batch), true)));
+        ffxivm_price_batch = [];
+    }
+});
+
 function ffxivm_price_delete(item_id, timestamp, callback_id){
     $.ajax({
         url: '/items/ajax-price-delete',
@@ -114,3 +182,117 @@ function ffxivm_flag_resolve(item_id, timestamp, remove, callback_id){
     ;
     return false;
 }
+
+//Prices submitted elsewhere are pushed to the dashboard and item pages and
+//patched in where they're shown; the messages are described in push.py
+var FFXIVM_PUSH_RETRY_MIN = 1000; //Milliseconds before reconnecting, doubling each time up to the max
+var FFXIVM_PUSH_RETRY_MAX = 60000;
+var ffxivm_push_subscription = null;
+var ffxivm_push_retry = FFXIVM_PUSH_RETRY_MIN;
+
+//Either {dashboard: true} or {item: item_id}; an item page also hears of the items it lists
+function ffxivm_push_subscribe(subscription){
+    ffxivm_push_subscription = subscription;
+    if(!window.WebSocket){
+        return;
+    }
+    window.addEventListener('DOMContentLoaded', ffxivm_push_connect);
+}
+
+//The price time an element shows, or null, so reconnecting catches up on changes and deletions alike
+function ffxivm_push_shown(element){
+    var timestamp = element.find('.timestamp').attr('ffxivm_ts');
+    return timestamp === undefined ? null : parseInt(timestamp, 10);
+}
+
+function ffxivm_push_connect(){
+    var subscription = {shown: []};
+    $('[ffxivm_item]').each(function(){
+        subscription.shown.push([parseInt($(this).attr('ffxivm_item'), 10), ffxivm_push_shown($(this).find('.ffxivm-when'))]);
+    });
+    if(ffxivm_push_subscription.dashboard){
+        subscription.dashboard = true;
+    }else{
+        subscription.items = [ffxivm_push_subscription.item];
+        $.each(subscription.shown, function(i, shown){
+            subscription.items.push(shown[0]);
+        });
+        subscription.shown.unshift([ffxivm_push_subscription.item, ffxivm_push_shown($('#ffxivm-latest'))]);
+        subscription.history = [];
+        $('#ffxivm-history [ffxivm_price_ts]').each(function(){
+            subscription.history.push(parseInt($(this).attr('ffxivm_price_ts'), 10));
+        });
+    }
+    
+    var socket = new WebSocket((location.protocol == 'https:' ? 'wss://' : 'ws://') + location.host + '/items/push');
+    socket.onopen = function(){
+        ffxivm_push_retry = FFXIVM_PUSH_RETRY_MIN;
+        socket.send(JSON.stringify(subscription));
+    };
+    socket.onmessage = function(event){
+        ffxivm_push_apply(JSON.parse(event.data));
+    };
+    socket.onclose = function(){
+        setTimeout(ffxivm_push_connect, ffxivm_push_retry);
+        ffxivm_push_retry = Math.min(ffxivm_push_retry * 2, FFXIVM_PUSH_RETRY_MAX);
+    };
+}
+
+function ffxivm_push_apply(message){
+    $.each(message.d || [], function(i, deleted){
+        if(deleted[0] == ffxivm_push_subscription.item){
+            $('#ffxivm-history [ffxivm_price_ts="' + deleted[1] + '"]').remove();
+        }
+    });
+    $.each(message.p || [], function(i, price){
+        ffxivm_push_item(price[0], price[1], price[2], price[3]);
+        if(price[0] == ffxivm_push_subscription.item){
+            ffxivm_push_latest(price[1], price[2]);
+        }
+    });
+    ffxivm_render_timestamps();
+}
+
+//Every listing of the item, wherever it appears
+function ffxivm_push_item(item_id, timestamp, value, average){
+    $('[ffxivm_item="' + item_id + '"]').each(function(){
+        var element = $(this);
+        if(timestamp === null){
+            element.find('.ffxivm-at').text("");
+            element.find('.ffxivm-price').text("");
+            element.find('.ffxivm-change').html("");
+            element.find('.ffxivm-when').html('<span class="nodata">no history</span>');
+        }else{
+            element.find('.ffxivm-at').text("@");
+            element.find('.ffxivm-price').text(ffxivm_format_price(value));
+            element.find('.ffxivm-change').html(ffxivm_format_change(timestamp, value, average));
+            element.find('.ffxivm-when').html('<span class="timestamp" ffxivm_ts="' + timestamp + '"></span>');
+        }
+    });
+}
+
+//The item page's own latest price, and its history if the price is new
+function ffxivm_push_latest(timestamp, value){
+    var latest_element = $('#ffxivm-latest');
+    if(timestamp === null){
+        latest_element.html('<span class="nodata">No data</span>');
+        return;
+    }
+    if(latest_element.find('.timestamp').attr('ffxivm_ts') == timestamp){
+        return;
+    }
+    //The deletion and flagging controls belonged to the price being replaced
+    var price_html = '<b>' + ffxivm_format_price(value) + '</b> <span class="timestamp" ffxivm_ts="' + timestamp + '"></span>';
+    latest_element.html(price_html);
+    
+    var newest = 0;
+    $('#ffxivm-history [ffxivm_price_ts]').each(function(){
+        newest = Math.max(newest, parseInt($(this).attr('ffxivm_price_ts'), 10));
+    });
+    if(timestamp > newest){
+        if(!$('#ffxivm-history ul').length){
+            $('#ffxivm-history').html('<ul class="ffxiv-list"></ul>');
+        }
+        $('#ffxivm-history ul').first().prepend($('<li/>').attr('ffxivm_price_ts', timestamp).html(price_html));
+    }
+}
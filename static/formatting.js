@@ -0,0 +1,74 @@
+//Seconds to add to the browser's clock to match the server's, set on load
+var ffxivm_clock_offset = 0;
+
+function ffxivm_format_age(age){
+    var qualifier = "ago";
+    if(age < 0){
+        qualifier = "from now";
+        age *= -1;
+    }
+    
+    var unit;
+    if(age < 60){
+        unit = "seconds";
+    }else if(age < 3600){
+        age = Math.floor(age / 60);
+        unit = "minutes";
+    }else if(age < 86400){
+        age = Math.floor(age / 3600);
+        unit = "hours";
+    }else{
+        age = Math.floor(age / 86400);
+        unit = "days";
+    }
+    
+    if(age == 1){
+        unit = unit.slice(0, -1);
+    }
+    return age + " " + unit + " " + qualifier;
+}
+
+function ffxivm_format_price(value){
+    return value ? value.toLocaleString('en-US') : "none";
+}
+
+//As rendered next to a price, for a price submitted within the past twelve hours
+function ffxivm_format_change(timestamp, value, average){
+    var current_time = Math.floor(new Date().getTime() / 1000) + ffxivm_clock_offset;
+    if(!value || !average || timestamp <= current_time - 43200){
+        return "";
+    }
+    var delta = value - average;
+    if(delta < 0){
+        return '<img src="/static/loss.png"/> ' + (delta * -1);
+    }else if(delta > 0){
+        return '<img src="/static/gain.png"/> ' + delta;
+    }
+    return "";
+}
+
+function ffxivm_render_timestamps(){
+    var current_time = Math.floor(new Date().getTime() / 1000) + ffxivm_clock_offset;
+    $('.timestamp[ffxivm_ts]').each(function(){
+        var element = $(this);
+        element.text(ffxivm_format_age(current_time - parseInt(element.attr('ffxivm_ts'), 10)));
+    });
+}
+
+function ffxivm_render_times(){
+    $('[ffxivm_ts_t]').each(function(){
+        var element = $(this);
+        element.text(new Date(parseInt(element.attr('ffxivm_ts_t'), 10) * 1000).toLocaleString());
+    });
+}
+
+//Cached page fragments carry absolute timestamps; describe them relative to now
+$(function(){
+    var server_time = parseInt($('meta[name="ffxivm-time"]').attr('content'), 10);
+    if(!isNaN(server_time)){
+        ffxivm_clock_offset = server_time - Math.floor(new Date().getTime() / 1000);
+    }
+    ffxivm_render_times();
+    ffxivm_render_timestamps();
+    setInterval(ffxivm_render_timestamps, 30000);
+});
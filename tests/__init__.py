@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the parts of the site that stand apart from Postgres and
+Tornado's HTTP machinery.
+
+    python -m unittest discover tests
+        runs them all, from the repository's root
+"""
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+import random
+import unittest
+
+from benchmarks import analytics as legacy
+from ffxiv_market import analytics
+
+_DAYS = legacy._DAYS
+_DATA_POINTS = legacy._DATA_POINTS
+_TIMESCALE = analytics.get_timescale(_DAYS, _DATA_POINTS)
+
+#The old analysis measured slices back from the moment of the request; a moment at the very end of an
+#epoch-aligned slice gives both the same slices
+_CURRENT_TIME = 100000 * _TIMESCALE + _TIMESCALE - 1
+
+def _generate_history(rng, count, highest_value):
+    """
+    Returns `count` prices, newest first, from the month before
+    _CURRENT_TIME. The old extremes took in the price exactly a day or a
+    week old, a second more than the whole slices they cover now, so those
+    moments are left out.
+    """
+    ages = []
+    while len(ages) < count:
+        age = rng.randint(0, legacy._ONE_MONTH - 1)
+        if age not in (legacy._ONE_DAY, legacy._ONE_WEEK):
+            ages.append(age)
+    return [
+        legacy.ItemPrice(_CURRENT_TIME - age, rng.randint(1, highest_value), None, False)
+        for age in sorted(ages)
+    ]
+    
+def _analyse(history):
+    return analytics.analyse(
+        analytics.reduce([price.timestamp for price in history], [price.value for price in history], _TIMESCALE),
+        _CURRENT_TIME, _TIMESCALE, _DATA_POINTS,
+    )
+    
+def _datum(price, sign=1):
+    return price and (price.timestamp, sign * price.value)
+    
+class LegacyComparisonTest(unittest.TestCase):
+    def _compare(self, history):
+        result = _analyse(history)
+        (normalised_data, timescale) = legacy._legacy_normalise_data(history, _CURRENT_TIME)
+        self.assertEqual(timescale, _TIMESCALE)
+        self.assertEqual(list(result.normalised_data), normalised_data)
+        
+        #The old loop only looked for a high in prices that weren't a new low, so highs are taken as the lows of the negated prices
+        lows = legacy._legacy_compute_maxmin(history, _CURRENT_TIME)[:3]
+        highs = legacy._legacy_compute_maxmin(
+            [price._replace(value=-price.value) for price in history], _CURRENT_TIME,
+        )[:3]
+        self.assertEqual(
+            [_datum(price) for price in (result.low_24h, result.low_week, result.low_month)],
+            [_datum(price) for price in lows],
+        )
+        self.assertEqual(
+            [_datum(price) for price in (result.high_24h, result.high_week, result.high_month)],
+            [_datum(price, -1) for price in highs],
+        )
+        
+        (days, weeks) = legacy._legacy_compute_timeblock_averages(normalised_data, timescale)
+        self.assertEqual(
+            (result.average_24h, result.average_week, result.average_month),
+            legacy._legacy_compute_averages(days, weeks),
+        )
+        self.assertEqual(
+            (result.trend_current, result.trend_daily, result.trend_weekly),
+            legacy._legacy_compute_trends(normalised_data, days, weeks),
+        )
+        if len(normalised_data) > 1:
+            self.assertEqual(
+                analytics.pad(result.normalised_data, _DATA_POINTS),
+                legacy._legacy_pad(list(normalised_data)),
+            )
+            
+    def test_random_histories(self):
+        rng = random.Random(0)
+        for count in (1, 2, 3, 10, 100, 1000, 3000):
+            for i in xrange(5):
+                self._compare(_generate_history(rng, count, 50000))
+                
+    def test_tied_prices(self):
+        rng = random.Random(1)
+        for count in (2, 10, 100, 1000):
+            for i in xrange(5):
+                self._compare(_generate_history(rng, count, 5))
+                
+    def test_recent_prices_only(self):
+        history = [
+            legacy.ItemPrice(_CURRENT_TIME - 10, 300, None, False),
+            legacy.ItemPrice(_CURRENT_TIME - _TIMESCALE - 10, 200, None, False),
+            legacy.ItemPrice(_CURRENT_TIME - _TIMESCALE - 20, 400, None, False),
+        ]
+        self._compare(history)
+        result = _analyse(history)
+        self.assertEqual(result.normalised_data, ((0, 300), (1, 300)))
+        self.assertEqual(result.trend_current, 0.0)
+        
+class AnalyticsTest(unittest.TestCase):
+    def test_empty_history(self):
+        result = _analyse([])
+        self.assertEqual(result.normalised_data, ())
+        self.assertEqual(result.low_month, None)
+        self.assertEqual(result.average_month, None)
+        self.assertEqual(result.end, _CURRENT_TIME + 1)
+        
+    def test_old_and_future_prices_are_ignored(self):
+        history = [
+            legacy.ItemPrice(_CURRENT_TIME + _TIMESCALE, 1, None, False),
+            legacy.ItemPrice(_CURRENT_TIME - 10, 300, None, False),
+            legacy.ItemPrice(_CURRENT_TIME - _DATA_POINTS * _TIMESCALE, 2, None, False),
+        ]
+        result = _analyse(history)
+        self.assertEqual(result.normalised_data, ((0, 300),))
+        self.assertEqual(_datum(result.low_month), (_CURRENT_TIME - 10, 300))
+        
+    def test_trend_against_zero(self):
+        result = _analyse([
+            legacy.ItemPrice(_CURRENT_TIME - 10, 300, None, False),
+            legacy.ItemPrice(_CURRENT_TIME - _TIMESCALE - 10, 0, None, False),
+        ])
+        self.assertIsNone(result.trend_current)
+        
+    def test_analyse_many(self):
+        rng = random.Random(2)
+        histories = [_generate_history(rng, count, 50000) for count in (0, 1, 50, 0, 500)]
+        results = analytics.analyse_many(
+            [([price.timestamp for price in history], [price.value for price in history]) for history in histories],
+            _CURRENT_TIME, _TIMESCALE, _DATA_POINTS,
+        )
+        self.assertEqual(results, [_analyse(history) for history in histories])
+        self.assertEqual(analytics.analyse_many([], _CURRENT_TIME, _TIMESCALE, _DATA_POINTS), [])
+        
+    def test_pad(self):
+        self.assertEqual(analytics.pad(((1, 5), (3, 7)), 5), [None, 7, 7, 5, 5])
+        self.assertEqual(analytics.pad(((0, 5), (2, 0), (4, 7)), 5), [7, 7, None, None, 5])
+        
+if __name__ == '__main__':
+    unittest.main()
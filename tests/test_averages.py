@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+import logging
+import unittest
+
+from ffxiv_market import averages
+
+logging.getLogger('averages').addHandler(logging.NullHandler()) #Failures are expected here
+
+class _Clock(object):
+    def __init__(self, now):
+        self.now = now
+        
+    def time(self):
+        return self.now
+        
+class RefresherTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = _Clock(1000.0)
+        self._time = averages.time
+        averages.time = self.clock
+        self.candidates = range(1, 11)
+        self.loads = []
+        self.batches = []
+        self.failing = False
+        self.failing_load = False
+        self.refresher = averages.Refresher(
+            candidates=self._load_candidates, refresh=self._refresh,
+            interval=100, batch_size=3, budget=2,
+        )
+        
+    def tearDown(self):
+        averages.time = self._time
+        
+    def _load_candidates(self, current_time):
+        self.loads.append(current_time)
+        if self.failing_load:
+            raise ValueError("connection lost")
+        return list(self.candidates)
+        
+    def _refresh(self, batch):
+        self.clock.now += 1 #Each batch takes a second
+        if self.failing:
+            raise ValueError("connection lost")
+        self.batches.append(batch)
+        
+    def test_batches_fit_the_budget(self):
+        self.refresher.tick()
+        self.assertEqual(self.loads, [1000])
+        self.assertEqual(self.batches, [[1, 2, 3], [4, 5, 6]])
+        
+        self.refresher.tick()
+        self.refresher.tick()
+        self.assertEqual(self.loads, [1000])
+        self.assertEqual(self.batches, [[1, 2, 3], [4, 5, 6], [7, 8, 9], [10]])
+        
+        #Nothing more to do until the next bucket
+        self.refresher.tick()
+        self.assertEqual(len(self.batches), 4)
+        
+    def test_each_bucket_reloads(self):
+        self.refresher.tick()
+        self.clock.now = 1100.5
+        self.candidates = [20, 21]
+        self.refresher.tick()
+        self.assertEqual(self.loads, [1000, 1100])
+        #What was left of the last bucket is given up, its items being due again anyway
+        self.assertEqual(self.batches, [[1, 2, 3], [4, 5, 6], [20, 21]])
+        
+    def test_failed_batches_end_the_tick(self):
+        self.failing = True
+        self.refresher.tick()
+        self.assertEqual(self.clock.now, 1001)
+        
+        self.failing = False
+        self.refresher.tick()
+        self.assertEqual(self.batches, [[4, 5, 6], [7, 8, 9]])
+        
+    def test_failed_loads_are_retried(self):
+        self.failing_load = True
+        self.refresher.tick()
+        self.assertEqual(self.batches, [])
+        
+        #The bucket wasn't taken as started, so the next tick loads it again
+        self.failing_load = False
+        self.refresher.tick()
+        self.assertEqual(self.loads, [1000, 1000])
+        self.assertEqual(self.batches, [[1, 2, 3], [4, 5, 6]])
+        
+    def test_overlapping_ticks(self):
+        self.refresher._lock.acquire()
+        try:
+            self.refresher.tick()
+        finally:
+            self.refresher._lock.release()
+        self.assertEqual(self.loads, [])
+        self.assertEqual(self.batches, [])
+        
+if __name__ == '__main__':
+    unittest.main()
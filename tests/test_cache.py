@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+import random
+import unittest
+
+import numpy
+
+from ffxiv_market import cache
+from ffxiv_market.cache import (
+    ItemName, ItemPrice, ItemRef, ItemState,
+)
+
+_NAMES = (
+    ItemName('Cobalt Ingot', 'コバルトインゴット', 'Lingot de cobalt', 'Kobaltbarren'),
+    ItemName('Maple Log', 'メープル材', 'Rondin d\'érable', 'Ahorn-Stamm'),
+)
+
+def _build_cache():
+    """
+    Items 10 and 11 are the NQ and HQ of one name, 20 has no price yet.
+    """
+    return cache.Cache([
+        ItemRef(ItemState(_NAMES[0], 10, False, ItemPrice(1000, 500, None, False)), 450),
+        ItemRef(ItemState(_NAMES[0], 11, True, ItemPrice(1010, 900, None, False)), None),
+        ItemRef(ItemState(_NAMES[1], 20, False, None), None),
+    ])
+    
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = _build_cache()
+        
+    def test_materialises_items(self):
+        item_ref = self.cache.get_item_by_id(11)
+        self.assertEqual(item_ref.item_state.name, _NAMES[0])
+        self.assertEqual(item_ref.item_state.id, 11)
+        self.assertTrue(item_ref.item_state.hq)
+        self.assertEqual(item_ref.item_state.price, ItemPrice(1010, 900, None, False))
+        self.assertIsNone(item_ref.average)
+        
+        item_ref = self.cache.get_item_by_id(20)
+        self.assertIsNone(item_ref.item_state.price)
+        self.assertEqual(item_ref.item_state.name.de, 'Ahorn-Stamm')
+        
+    def test_unknown_item_lookups(self):
+        self.assertIsNone(self.cache.get_item_by_id(15))
+        self.assertIsNone(self.cache.get_item_by_id(99))
+        self.assertIsNone(self.cache.get_fingerprint(15))
+        
+    def test_update_many(self):
+        self.cache.update_many([(10, 2000, 600, 550), (20, 2001, 70, None)])
+        self.assertEqual(self.cache.version, 1)
+        self.assertEqual(self.cache.get_item_by_id(10), ItemRef(
+            ItemState(_NAMES[0], 10, False, ItemPrice(2000, 600, None, False)), 550,
+        ))
+        self.assertEqual(self.cache.get_item_by_id(20).item_state.price, ItemPrice(2001, 70, None, False))
+        self.assertIsNone(self.cache.get_item_by_id(20).average)
+        self.assertEqual(self.cache.get_fingerprint(11), (0, 1010, 900, cache.NO_PRICE))
+        
+    def test_update_many_skips_unknown_items(self):
+        self.cache.update_many([(15, 2000, 600, None), (10, 2001, 610, None), (99, 2002, 620, None)])
+        self.assertEqual(self.cache.version, 1)
+        self.assertEqual(self.cache.get_item_by_id(10).item_state.price.value, 610)
+        self.assertIsNone(self.cache.get_item_by_id(15))
+        self.assertIsNone(self.cache.get_item_by_id(99))
+        self.assertEqual([i.item_state.id for i in self.cache.query(list)], [10, 11, 20])
+        
+        #Nothing known to change means nothing to publish
+        self.cache.update(99, 2003, 630, None)
+        self.assertEqual(self.cache.version, 1)
+        
+    def test_delete(self):
+        self.assertFalse(self.cache.delete(10, 999))
+        self.assertFalse(self.cache.delete(99, 1000))
+        self.assertEqual(self.cache.version, 0)
+        
+        self.assertTrue(self.cache.delete(10, 1000))
+        self.assertEqual(self.cache.version, 1)
+        self.assertIsNone(self.cache.get_item_by_id(10).item_state.price)
+        self.assertIsNone(self.cache.get_item_by_id(10).average)
+        
+    def test_fingerprints_track_every_change(self):
+        fingerprint = self.cache.get_fingerprint(10)
+        self.assertEqual(fingerprint, (0, 1000, 500, 450))
+        
+        self.cache.touch([10, 99])
+        touched = self.cache.get_fingerprint(10)
+        self.assertNotEqual(touched, fingerprint)
+        self.assertEqual(touched[1:], fingerprint[1:])
+        self.assertEqual(self.cache.get_fingerprint(11)[0], 0)
+        
+        #The same price arriving again is still a change to the item's history
+        self.cache.update(10, 1000, 500, 450)
+        self.assertNotEqual(self.cache.get_fingerprint(10), touched)
+        
+    def test_set_averages(self):
+        self.cache.set_averages([(10, 450)])
+        self.assertEqual(self.cache.version, 0)
+        
+        #Items without a price keep no average, and unknown items are skipped
+        self.cache.set_averages([(10, 480), (20, 300), (99, 1)])
+        self.assertEqual(self.cache.version, 1)
+        self.assertEqual(self.cache.get_item_by_id(10).average, 480)
+        self.assertIsNone(self.cache.get_item_by_id(20).average)
+        
+    def test_snapshots_are_immutable(self):
+        snapshot = self.cache._snapshot
+        self.assertRaises(ValueError, snapshot.columns.values.__setitem__, 0, 1)
+        
+        self.cache.update(10, 2000, 600, None)
+        self.assertEqual(snapshot.columns.values.tolist(), [500, 900, cache.NO_PRICE])
+        self.assertIs(self.cache._snapshot.columns.ids, snapshot.columns.ids)
+        
+    def test_select(self):
+        item_refs = self.cache.select(lambda columns: numpy.flatnonzero(columns.values > 600))
+        self.assertEqual([i.item_state.id for i in item_refs], [11])
+        
+    def test_indexes_follow_changes(self):
+        rng = random.Random(0)
+        item_cache = cache.Cache([
+            ItemRef(ItemState(_NAMES[0], item_id, False, rng.random() < 0.8 and ItemPrice(rng.randint(0, 50), rng.randint(0, 20), None, False) or None), None)
+            for item_id in xrange(1, 301)
+        ])
+        for i in xrange(60):
+            if i % 3:
+                item_cache.update_many([
+                    (rng.randint(1, 300), rng.randint(0, 50), rng.choice((0, rng.randint(0, 20))), None)
+                    for j in xrange(rng.randint(1, 8))
+                ])
+            else:
+                columns = item_cache._snapshot.columns
+                row = rng.randrange(len(columns.ids))
+                item_cache.delete(int(columns.ids[row]), int(columns.timestamps[row]))
+                
+            (columns, indexes) = (item_cache._snapshot.columns, item_cache._snapshot.indexes)
+            rows = numpy.flatnonzero(columns.timestamps != cache.NO_PRICE)
+            by_timestamp = rows[numpy.lexsort((rows, columns.timestamps[rows]))]
+            by_value = rows[numpy.lexsort((rows, columns.timestamps[rows], columns.values[rows]))]
+            self.assertEqual(indexes.timestamps.rows.tolist(), by_timestamp.tolist())
+            self.assertEqual(indexes.timestamps.keys.tolist(), columns.timestamps[by_timestamp].tolist())
+            self.assertEqual(indexes.values.rows.tolist(), by_value.tolist())
+            self.assertEqual(cache.value_key_timestamps(indexes.values.keys).tolist(), columns.timestamps[by_value].tolist())
+            
+    def test_indexes_are_shared(self):
+        indexes = self.cache._snapshot.indexes
+        self.cache.set_averages([(10, 480)])
+        self.cache.touch([11])
+        self.assertIs(self.cache._snapshot.indexes, indexes)
+        self.assertRaises(ValueError, indexes.values.keys.__setitem__, 0, 1)
+        
+    def test_walk(self):
+        index = cache.SortedIndex(numpy.array([3, 5, 5, 7, 9]), numpy.array([4, 1, 2, 0, 3]))
+        self.assertEqual(cache.walk(index, None, None, 10).tolist(), [4, 1, 2, 0, 3])
+        self.assertEqual(cache.walk(index, None, None, 10, reverse=True).tolist(), [3, 0, 2, 1, 4])
+        self.assertEqual(cache.walk(index, 4, 9, 10, reverse=True).tolist(), [0, 2, 1])
+        self.assertEqual(cache.walk(index, 4, 9, 2).tolist(), [1, 2])
+        self.assertEqual(cache.walk(index, 10, None, 2).tolist(), [])
+        self.assertEqual(cache.walk(index, None, None, 2, reverse=True, where=(lambda keys: keys != 9)).tolist(), [0, 2])
+        self.assertEqual(cache.walk(index, 6, None, 5, where=(lambda keys: keys > 100)).tolist(), [])
+        
+    def test_value_keys(self):
+        self.assertLess(cache.value_key(5, 1000), cache.value_key(5, 1001))
+        self.assertLess(cache.value_key(5, 2 ** 32 - 1), cache.value_key(6, 0))
+        self.assertEqual(cache.value_key_timestamps(numpy.array([cache.value_key(7, 1234)])).tolist(), [1234])
+        self.assertEqual(cache.value_key(2 ** 40, 0), 2 ** 63 - 1)
+        
+    def test_memory_usage(self):
+        self.assertGreater(self.cache.memory_usage(), 0)
+        
+if __name__ == '__main__':
+    unittest.main()
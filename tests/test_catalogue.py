@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from ffxiv_market import catalogue
+
+_BASE_ITEMS = [
+    (100, 'Cobalt Ore', 'コバルト鉱', 'Minerai de cobalt', 'Kobalterz', 'a1'),
+    (101, 'Cobalt Ingot', 'コバルトインゴット', 'Lingot de cobalt', 'Kobaltbarren', 'a2'),
+    (102, 'Cobalt Rivets', 'コバルトリベット', 'Rivets en cobalt', 'Kobaltnieten', 'a3'),
+    (103, 'Fire Crystal', 'ファイアクリスタル', 'Cristal de feu', 'Feuerkristall', None),
+]
+_ITEMS = [
+    (1, 100, False),
+    (2, 101, False), (3, 101, True),
+    (4, 102, False), (5, 102, True),
+    (6, 103, False),
+]
+_CRAFTED_FROM = [(101, 100), (101, 103), (102, 101), (102, 999)]
+_CRAFTS_INTO = [(100, 101), (101, 102), (103, 101)]
+
+class CatalogueTest(unittest.TestCase):
+    def setUp(self):
+        self.catalogue = catalogue.Catalogue(_BASE_ITEMS, _ITEMS, _CRAFTED_FROM, _CRAFTS_INTO)
+        
+    def test_get_related(self):
+        #Both variants of each related base item, in the order the relations came
+        self.assertEqual(self.catalogue.get_related(101), ([1, 6], [4, 5]))
+        self.assertEqual(self.catalogue.get_related(100), ([], [2, 3]))
+        self.assertEqual(self.catalogue.get_related(103), ([], [2, 3]))
+        
+    def test_get_related_skips_unknown_items(self):
+        self.assertEqual(self.catalogue.get_related(102), ([2, 3], []))
+        self.assertEqual(self.catalogue.get_related(999), ([], []))
+        
+    def test_no_relations(self):
+        empty = catalogue.Catalogue(_BASE_ITEMS, _ITEMS, [], [])
+        self.assertEqual(empty.get_related(101), ([], []))
+        
+    def test_get_properties(self):
+        self.assertEqual(self.catalogue.get_properties('fr', 3), ('Lingot de cobalt', 101, 'a2', True))
+        self.assertEqual(self.catalogue.get_properties('en', 6), ('Fire Crystal', 103, None, False))
+        self.assertIsNone(self.catalogue.get_properties('en', 99))
+        
+    def test_get_variant_id(self):
+        self.assertEqual(self.catalogue.get_variant_id(102, True), 5)
+        self.assertEqual(self.catalogue.get_variant_id(102, False), 4)
+        self.assertIsNone(self.catalogue.get_variant_id(100, True))
+        self.assertIsNone(self.catalogue.get_variant_id(999, False))
+        
+if __name__ == '__main__':
+    unittest.main()
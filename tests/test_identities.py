@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from ffxiv_market import identities
+
+class _Clock(object):
+    def __init__(self, now):
+        self.now = now
+        
+    def time(self):
+        return self.now
+        
+class IdentityCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = _Clock(1000.0)
+        self._time = identities.time
+        identities.time = self.clock
+        self.identities = identities.IdentityCache(size=2, ttl=60)
+        
+    def tearDown(self):
+        identities.time = self._time
+        
+    def _load(self, user_id, identity):
+        (cached, token) = self.identities.get(user_id)
+        self.assertFalse(cached)
+        self.identities.set(user_id, identity, token)
+        
+    def test_hits(self):
+        self._load(1, ('Admin User', 'en', 3, False))
+        self.assertEqual(self.identities.get(1), (True, ('Admin User', 'en', 3, False)))
+        
+    def test_unknown_users_are_cached(self):
+        self._load(99, None)
+        self.assertEqual(self.identities.get(99), (True, None))
+        
+    def test_expiry(self):
+        self._load(1, ('Admin User', 'en', 3, False))
+        self.clock.now += 59
+        self.assertTrue(self.identities.get(1)[0])
+        self.clock.now += 1
+        self.assertFalse(self.identities.get(1)[0])
+        
+    def test_invalidate(self):
+        self._load(1, ('Admin User', 'en', 3, False))
+        self.identities.invalidate(1)
+        self.assertFalse(self.identities.get(1)[0])
+        
+    def test_changes_while_loading(self):
+        #The identity read may predate the change, so it isn't kept
+        (cached, token) = self.identities.get(1)
+        self.identities.invalidate(1)
+        self.identities.set(1, ('Admin User', 'en', 3, False), token)
+        self.assertFalse(self.identities.get(1)[0])
+        
+    def test_least_recently_used_are_dropped(self):
+        self._load(1, ('Admin User', 'en', 3, False))
+        self._load(2, ('Moderator', 'ja', 2, True))
+        self.identities.get(1)
+        self._load(3, ('Member', 'fr', 1, False))
+        self.assertTrue(self.identities.get(1)[0])
+        self.assertFalse(self.identities.get(2)[0])
+        self.assertTrue(self.identities.get(3)[0])
+        
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import calendar
+import datetime
+import logging
+import unittest
+
+from ffxiv_market import maintenance
+
+logging.getLogger('maintenance').addHandler(logging.NullHandler())
+
+def _epoch(*fields):
+    return calendar.timegm(datetime.datetime(*fields).timetuple())
+    
+class _Cursor(object):
+    """
+    Stands in for a cursor on a database whose prices have the partitions
+    `partitions` and whose default partition holds prices from the months
+    `defaulted`.
+    """
+    def __init__(self, partitions, defaulted):
+        self.partitions = partitions
+        self.defaulted = defaulted
+        self.statements = []
+        self._result = None
+        
+    def execute(self, statement, parameters=None):
+        self.statements.append(' '.join(statement.split()))
+        if 'FROM pg_inherits' in statement:
+            self._result = [(name,) for name in self.partitions + ['prices_default']]
+        elif 'FROM prices_default' in statement:
+            self._result = [(1,)] if parameters['start'] in self.defaulted else []
+        else:
+            self._result = None
+            
+    def fetchall(self):
+        return self._result
+        
+    def fetchone(self):
+        return self._result and self._result[0] or None
+    
+class HorizonTest(unittest.TestCase):
+    def test_on_the_hour(self):
+        self.assertEqual(maintenance.get_horizon(_epoch(2024, 3, 31, 14, 25, 7), 90), _epoch(2024, 1, 1, 14))
+        self.assertEqual(maintenance.get_horizon(_epoch(2024, 3, 31, 14, 0, 0), 90), _epoch(2024, 1, 1, 14))
+        self.assertEqual(maintenance.get_horizon(_epoch(2024, 3, 31, 13, 59, 59), 90), _epoch(2024, 1, 1, 13))
+        
+    def test_retention(self):
+        current_time = _epoch(2024, 3, 1, 0, 30)
+        self.assertEqual(maintenance.get_horizon(current_time, 0), _epoch(2024, 3, 1, 0))
+        self.assertEqual(maintenance.get_horizon(current_time, 1), _epoch(2024, 2, 29, 0))
+        self.assertEqual(maintenance.get_horizon(current_time, 366), _epoch(2023, 3, 1, 0))
+        
+    def test_next_month(self):
+        self.assertEqual(maintenance._next_month(datetime.datetime(2024, 1, 1)), datetime.datetime(2024, 2, 1))
+        self.assertEqual(maintenance._next_month(datetime.datetime(2024, 12, 1)), datetime.datetime(2025, 1, 1))
+        
+class PartitionsTest(unittest.TestCase):
+    def test_create_partitions(self):
+        cursor = _Cursor(['prices_y2024m01', 'prices_y2024m03'], [])
+        self.assertEqual(maintenance.create_partitions(cursor, _epoch(2024, 1, 31, 23), 2), ['prices_y2024m02'])
+        self.assertEqual(cursor.statements[-1], "CREATE TABLE prices_y2024m02 PARTITION OF prices FOR VALUES FROM (%(start)s) TO (%(end)s)")
+        
+        cursor = _Cursor(['prices_y2023m12'], [])
+        self.assertEqual(maintenance.create_partitions(cursor, _epoch(2023, 12, 15), 1), ['prices_y2024m01'])
+        
+    def test_default_partition_is_left_alone(self):
+        #Moving prices out would lock prices and flags, so that month is skipped
+        cursor = _Cursor([], [datetime.datetime(2024, 2, 1)])
+        self.assertEqual(maintenance.create_partitions(cursor, _epoch(2024, 1, 10), 2), ['prices_y2024m01', 'prices_y2024m03'])
+        self.assertFalse([statement for statement in cursor.statements if statement.startswith(('ALTER', 'DELETE', 'BEGIN'))])
+        
+if __name__ == '__main__':
+    unittest.main()
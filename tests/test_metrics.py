@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import logging
+import unittest
+
+from ffxiv_market import metrics
+
+logging.getLogger('metrics').addHandler(logging.NullHandler()) #Failures are expected here
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.registered = list(metrics.REGISTRY)
+        
+    def tearDown(self):
+        metrics.REGISTRY[:] = self.registered
+        
+    def test_histogram_collect(self):
+        histogram = metrics.Histogram('test_duration_seconds', "Time taken", labels=('handler', 'status'), buckets=(0.1, 1.0))
+        histogram.observe(0.05, 'Item', 200)
+        histogram.observe(0.1, 'Item', 200)
+        histogram.observe(0.5, 'Item', 200)
+        histogram.observe(5, 'Item', 200)
+        histogram.observe(0.2, 'Dash"board\\', 500)
+        self.assertEqual(histogram.collect(), [
+            '# HELP test_duration_seconds Time taken',
+            '# TYPE test_duration_seconds histogram',
+            'test_duration_seconds_bucket{handler="Dash\\"board\\\\",status="500",le="0.1"} 0',
+            'test_duration_seconds_bucket{handler="Dash\\"board\\\\",status="500",le="1.0"} 1',
+            'test_duration_seconds_bucket{handler="Dash\\"board\\\\",status="500",le="+Inf"} 1',
+            'test_duration_seconds_sum{handler="Dash\\"board\\\\",status="500"} 0.2',
+            'test_duration_seconds_count{handler="Dash\\"board\\\\",status="500"} 1',
+            'test_duration_seconds_bucket{handler="Item",status="200",le="0.1"} 2',
+            'test_duration_seconds_bucket{handler="Item",status="200",le="1.0"} 3',
+            'test_duration_seconds_bucket{handler="Item",status="200",le="+Inf"} 4',
+            'test_duration_seconds_sum{handler="Item",status="200"} 5.65',
+            'test_duration_seconds_count{handler="Item",status="200"} 4',
+        ])
+        
+    def test_unlabelled_histogram(self):
+        histogram = metrics.Histogram('test_wait_seconds', "Time waited", buckets=(0.5,))
+        self.assertEqual(histogram.collect(), [
+            '# HELP test_wait_seconds Time waited',
+            '# TYPE test_wait_seconds histogram',
+        ])
+        with histogram.time():
+            pass
+        self.assertEqual(histogram.collect()[2:], [
+            'test_wait_seconds_bucket{le="0.5"} 1',
+            'test_wait_seconds_bucket{le="+Inf"} 1',
+            'test_wait_seconds_sum ' + repr(histogram._series[()][1]),
+            'test_wait_seconds_count 1',
+        ])
+        
+    def test_gauges(self):
+        metrics.Gauges('test_pool', "Pool", lambda: {'open': 3, 'idle': 1})
+        self.assertEqual(metrics.REGISTRY[-1].collect(), [
+            '# HELP test_pool_idle Pool: idle',
+            '# TYPE test_pool_idle gauge',
+            'test_pool_idle 1.0',
+            '# HELP test_pool_open Pool: open',
+            '# TYPE test_pool_open gauge',
+            'test_pool_open 3.0',
+        ])
+        
+    def test_render_skips_failing_metrics(self):
+        def fail():
+            raise ValueError("closed")
+        metrics.REGISTRY[:] = []
+        metrics.Gauges('test_broken', "Broken", fail)
+        metrics.Gauges('test_working', "Working", lambda: {'count': 2})
+        self.assertEqual(metrics.render().split('\n')[-2:], ['test_working_count 2.0', ''])
+        
+if __name__ == '__main__':
+    unittest.main()
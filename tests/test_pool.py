@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+import time
+import unittest
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+
+from ffxiv_market import pool
+
+logging.getLogger('pool').addHandler(logging.NullHandler()) #Replacing connections is expected here
+
+class _Cursor(object):
+    def __init__(self, connection):
+        self._connection = connection
+        
+    def __enter__(self):
+        return self
+        
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+        
+    def execute(self, statement):
+        self._connection.pings += 1
+        if self._connection.broken:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+            
+class _Connection(object):
+    """
+    Stands in for a psycopg2 connection, doing only what the pool asks of
+    one.
+    """
+    def __init__(self, number, kwargs):
+        self.number = number
+        self.kwargs = kwargs
+        self.closed = 0
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        self.broken = False
+        self.pings = 0
+        self.rollbacks = 0
+        
+    def get_transaction_status(self):
+        return self.status
+        
+    def cursor(self):
+        return _Cursor(self)
+        
+    def rollback(self):
+        self.rollbacks += 1
+        if self.broken:
+            raise psycopg2.InterfaceError("connection already closed")
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        
+    def close(self):
+        self.closed = 1
+        
+class PoolTest(unittest.TestCase):
+    def setUp(self):
+        self.connections = []
+        self.configured = []
+        self.fail_connect = False
+        self._connect = pool.psycopg2.connect
+        self._ping_after = pool._PING_AFTER
+        pool.psycopg2.connect = self._fake_connect
+        
+    def tearDown(self):
+        pool.psycopg2.connect = self._connect
+        pool._PING_AFTER = self._ping_after
+        
+    def _fake_connect(self, **kwargs):
+        if self.fail_connect:
+            raise psycopg2.OperationalError("could not connect to server")
+        connection = _Connection(len(self.connections), kwargs)
+        self.connections.append(connection)
+        return connection
+        
+    def _build_pool(self, minconn=1, maxconn=3, timeout=0.05, configure=None):
+        return pool.Pool(minconn, maxconn, timeout, configure or self.configured.append, database='ffxiv_market')
+        
+    def test_opens_minimum_up_front(self):
+        connections = self._build_pool(minconn=2)
+        self.assertEqual(len(self.connections), 2)
+        self.assertEqual(self.configured, self.connections)
+        self.assertEqual(self.connections[0].kwargs, {'database': 'ffxiv_market'})
+        self.assertEqual(connections.stats(), {'open': 2, 'idle': 2, 'waiting': 0})
+        
+    def test_reuses_the_most_recently_returned(self):
+        connections = self._build_pool(minconn=0)
+        (first, second) = (connections.getconn(), connections.getconn())
+        connections.putconn(first)
+        connections.putconn(second)
+        self.assertIs(connections.getconn(), second)
+        self.assertEqual(len(self.connections), 2)
+        self.assertEqual(connections.stats(), {'open': 2, 'idle': 1, 'waiting': 0})
+        
+    def test_times_out_when_exhausted(self):
+        connections = self._build_pool(maxconn=2)
+        held = [connections.getconn(), connections.getconn()]
+        start = time.time()
+        self.assertRaises(pool.PoolTimeout, connections.getconn)
+        self.assertGreaterEqual(time.time() - start, 0.05)
+        self.assertTrue(issubclass(pool.PoolTimeout, psycopg2.pool.PoolError))
+        self.assertEqual(len(self.connections), 2)
+        self.assertEqual(connections.stats(), {'open': 2, 'idle': 0, 'waiting': 0})
+        
+    def test_waiters_get_returned_connections(self):
+        connections = self._build_pool(maxconn=1, timeout=5)
+        held = connections.getconn()
+        received = []
+        waiter = threading.Thread(target=lambda: received.append(connections.getconn()))
+        waiter.start()
+        deadline = time.time() + 5
+        while connections.stats()['waiting'] != 1 and time.time() < deadline:
+            time.sleep(0.001)
+        self.assertEqual(connections.stats()['waiting'], 1)
+        
+        connections.putconn(held)
+        waiter.join(5)
+        self.assertEqual(received, [held])
+        self.assertEqual(connections.stats(), {'open': 1, 'idle': 0, 'waiting': 0})
+        
+    def test_returned_transactions_are_rolled_back(self):
+        connections = self._build_pool()
+        connection = connections.getconn()
+        connection.status = psycopg2.extensions.TRANSACTION_STATUS_INERROR
+        connections.putconn(connection)
+        self.assertEqual(connection.rollbacks, 1)
+        self.assertIs(connections.getconn(), connection)
+        
+    def test_failed_rollbacks_free_the_slot(self):
+        connections = self._build_pool(maxconn=1)
+        connection = connections.getconn()
+        connection.status = psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+        connection.broken = True
+        connections.putconn(connection)
+        self.assertTrue(connection.closed)
+        self.assertEqual(connections.stats(), {'open': 0, 'idle': 0, 'waiting': 0})
+        self.assertIsNot(connections.getconn(), connection)
+        
+    def test_unusable_idle_connections_are_replaced(self):
+        connections = self._build_pool(minconn=2)
+        self.connections[0].closed = 2 #Dropped by the server
+        self.connections[1].status = psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN
+        self.assertIs(connections.getconn(), self.connections[2])
+        self.assertIs(connections.getconn(), self.connections[3])
+        self.assertTrue(self.connections[1].closed)
+        self.assertEqual(connections.stats(), {'open': 2, 'idle': 0, 'waiting': 0})
+        
+    def test_idle_connections_are_pinged(self):
+        connections = self._build_pool(minconn=2)
+        self.assertIs(connections.getconn(), self.connections[1])
+        self.assertEqual(self.connections[1].pings, 0)
+        
+        pool._PING_AFTER = 0
+        self.connections[0].broken = True
+        replacement = connections.getconn()
+        self.assertEqual(self.connections[0].pings, 1)
+        self.assertTrue(self.connections[0].closed)
+        self.assertIs(replacement, self.connections[2])
+        
+        connections.putconn(replacement)
+        self.assertIs(connections.getconn(), replacement)
+        self.assertEqual(replacement.pings, 1)
+        
+    def test_failed_connections_free_the_slot(self):
+        connections = self._build_pool(minconn=0, maxconn=1)
+        self.fail_connect = True
+        self.assertRaises(psycopg2.OperationalError, connections.getconn)
+        self.assertEqual(connections.stats(), {'open': 0, 'idle': 0, 'waiting': 0})
+        
+        def configure(connection):
+            raise psycopg2.ProgrammingError("prepared statement already exists")
+        connections = self._build_pool(minconn=0, maxconn=1, configure=configure)
+        self.fail_connect = False
+        self.assertRaises(psycopg2.ProgrammingError, connections.getconn)
+        self.assertTrue(self.connections[0].closed)
+        self.assertEqual(connections.stats(), {'open': 0, 'idle': 0, 'waiting': 0})
+        
+    def test_closeall(self):
+        connections = self._build_pool(minconn=2)
+        held = connections.getconn()
+        connections.closeall()
+        self.assertTrue(self.connections[0].closed)
+        self.assertFalse(held.closed)
+        self.assertEqual(connections.stats(), {'open': 1, 'idle': 0, 'waiting': 0})
+        
+        connections.putconn(held)
+        self.assertEqual(connections.stats(), {'open': 1, 'idle': 1, 'waiting': 0})
+        
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+import json
+import unittest
+
+import tornado.concurrent
+import tornado.websocket
+
+from ffxiv_market import common
+if common.CONFIG is None: #The hub is built from the config on import
+    common.CONFIG = {'server': {'push': {'flush_delay': 0.05, 'queue_limit': 100}}}
+from ffxiv_market import push
+
+class _IOLoop(object):
+    """
+    Runs callbacks at once and delayed calls only when told to.
+    """
+    def __init__(self):
+        self.delayed = []
+        
+    def add_callback(self, callback, *args):
+        callback(*args)
+        
+    def call_later(self, delay, callback):
+        self.delayed.append(callback)
+        
+    def run_delayed(self):
+        (delayed, self.delayed) = (self.delayed, [])
+        for callback in delayed:
+            callback()
+            
+class _Connection(object):
+    """
+    Stands in for a WebSocketHandler. Writes complete at once unless the
+    connection is stalled, when they wait for finish_writes().
+    """
+    def __init__(self, stalled=False):
+        self.stalled = stalled
+        self.gone = False
+        self.sent = []
+        self.pending = []
+        self.closed = None
+        
+    def write_message(self, message):
+        if self.gone:
+            raise tornado.websocket.WebSocketClosedError()
+        self.sent.append(message)
+        future = tornado.concurrent.Future()
+        if self.stalled:
+            self.pending.append(future)
+        else:
+            future.set_result(None)
+        return future
+        
+    def finish_writes(self, exception=None):
+        (pending, self.pending) = (self.pending, [])
+        for future in pending:
+            if exception is None:
+                future.set_result(None)
+            else:
+                future.set_exception(exception)
+                
+    def close(self, code, reason):
+        self.closed = code
+        
+class HubTest(unittest.TestCase):
+    def setUp(self):
+        self.io_loop = _IOLoop()
+        self.hub = push._Hub(flush_delay=0.05, queue_limit=2)
+        self.hub.start(self.io_loop)
+        
+    def _subscribe(self, item_ids=(), dashboard=False, connection=None):
+        connection = connection or _Connection()
+        subscriber = self.hub.new_subscriber(connection)
+        self.hub.subscribe(subscriber, item_ids, dashboard)
+        return (connection, subscriber)
+        
+    def _publish(self, prices=(), deleted=()):
+        self.hub.publish(prices, deleted)
+        self.io_loop.run_delayed()
+        
+    def test_discarded_until_started_or_subscribed(self):
+        hub = push._Hub(flush_delay=0.05, queue_limit=2)
+        hub.publish([(7, 100, 10, None)])
+        self.hub.publish([(7, 100, 10, None)])
+        self.assertEqual(self.io_loop.delayed, [])
+        
+        (connection, subscriber) = self._subscribe(dashboard=True)
+        self._publish([(8, 100, 10, None)])
+        self.assertEqual([json.loads(message) for message in connection.sent], [{'p': [[8, 100, 10, None]]}])
+        
+    def test_changes_are_gathered_until_flushed(self):
+        (connection, subscriber) = self._subscribe(dashboard=True)
+        self.hub.publish([(7, 100, 10, 9), (9, 101, 20, None)])
+        self.hub.publish([(7, 102, 11, 9)])
+        self.assertEqual(len(self.io_loop.delayed), 1)
+        self.assertEqual(connection.sent, [])
+        
+        self.io_loop.run_delayed()
+        #Each item's latest price only, in the order they last changed
+        self.assertEqual([json.loads(message) for message in connection.sent], [{'p': [[9, 101, 20, None], [7, 102, 11, 9]]}])
+        
+        self._publish(deleted=[(7, 102)])
+        self.assertEqual(len(connection.sent), 1)
+        
+    def test_fan_out(self):
+        (dashboard, dashboard_subscriber) = self._subscribe(dashboard=True)
+        (other_dashboard, other_dashboard_subscriber) = self._subscribe(dashboard=True)
+        (item, item_subscriber) = self._subscribe([7, 8])
+        (same_item, same_item_subscriber) = self._subscribe([7, 8, 20])
+        (other_item, other_item_subscriber) = self._subscribe([9])
+        (idle_item, idle_item_subscriber) = self._subscribe([30])
+        self.assertEqual(self.hub.stats()['dashboards'], 2)
+        self.assertEqual(self.hub.stats()['items'], 5)
+        
+        self._publish([(7, 100, 10, None), (9, 101, 20, None)], [(8, 50)])
+        self.assertEqual(json.loads(dashboard.sent[0]), {'p': [[7, 100, 10, None], [9, 101, 20, None]]})
+        self.assertEqual(json.loads(item.sent[0]), {'p': [[7, 100, 10, None]], 'd': [[8, 50]]})
+        self.assertEqual(json.loads(other_item.sent[0]), {'p': [[9, 101, 20, None]], 'd': []})
+        self.assertEqual(idle_item.sent, [])
+        
+        #Each distinct message is encoded once and shared
+        self.assertIs(dashboard.sent[0], other_dashboard.sent[0])
+        self.assertIs(item.sent[0], same_item.sent[0])
+        self.assertEqual(self.hub.stats()['messages'], 5)
+        
+    def test_subscriptions_are_replaced(self):
+        (connection, subscriber) = self._subscribe([7])
+        self.hub.subscribe(subscriber, [8], False)
+        self._publish([(7, 100, 10, None), (8, 101, 20, None)])
+        self.assertEqual(json.loads(connection.sent[0])['p'], [[8, 101, 20, None]])
+        
+        self.hub.subscribe(subscriber, [8], True)
+        self.assertEqual(subscriber.item_ids, frozenset())
+        self.assertEqual(self.hub.stats()['items'], 0)
+        self.hub.unsubscribe(subscriber)
+        self.assertEqual(self.hub.stats()['dashboards'], 0)
+        self._publish([(8, 102, 30, None)])
+        self.assertEqual(len(connection.sent), 1)
+        
+    def test_slow_subscribers_queue_in_order(self):
+        (connection, subscriber) = self._subscribe(dashboard=True, connection=_Connection(stalled=True))
+        for timestamp in (100, 101, 102):
+            self._publish([(7, timestamp, 10, None)])
+        self.assertEqual(len(connection.sent), 1)
+        
+        connection.finish_writes()
+        connection.finish_writes()
+        self.assertEqual([json.loads(message)['p'][0][1] for message in connection.sent], [100, 101, 102])
+        self.assertIsNone(connection.closed)
+        
+    def test_subscribers_too_far_behind_are_dropped(self):
+        (slow, slow_subscriber) = self._subscribe(dashboard=True, connection=_Connection(stalled=True))
+        (fast, fast_subscriber) = self._subscribe(dashboard=True)
+        for timestamp in (100, 101, 102):
+            self._publish([(7, timestamp, 10, None)])
+        self.assertIsNone(slow.closed)
+        
+        #One being written and two queued; a fourth is one too many
+        self._publish([(7, 103, 10, None)])
+        self.assertEqual(slow.closed, 1013)
+        self.assertEqual(self.hub.stats()['dropped'], 1)
+        self.assertEqual(self.hub.stats()['dashboards'], 1)
+        self._publish([(7, 104, 10, None)])
+        self.assertEqual(len(fast.sent), 5)
+        self.assertEqual(len(slow.sent), 1)
+        
+    def test_failed_writes_discard_the_queue(self):
+        (connection, subscriber) = self._subscribe(dashboard=True, connection=_Connection(stalled=True))
+        for timestamp in (100, 101):
+            self._publish([(7, timestamp, 10, None)])
+        connection.finish_writes(tornado.websocket.WebSocketClosedError())
+        self.assertEqual(len(connection.sent), 1)
+        
+    def test_writes_to_dropped_peers(self):
+        #Tornado raises, or returns no Future, once the peer is gone; on_close then unsubscribes
+        (connection, subscriber) = self._subscribe(dashboard=True)
+        connection.gone = True
+        self._publish([(7, 100, 10, None)])
+        self.assertEqual(connection.sent, [])
+        
+        connection.write_message = lambda message: None
+        self._publish([(7, 101, 10, None)])
+        self._publish([(7, 102, 10, None)])
+        self.assertEqual(self.hub.stats()['dropped'], 0)
+        
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+import random
+import unittest
+
+from benchmarks import analytics as legacy
+from ffxiv_market import analytics
+from ffxiv_market import rollups
+
+_DAYS = legacy._DAYS
+_DATA_POINTS = legacy._DATA_POINTS
+_TIMESCALE = analytics.get_timescale(_DAYS, _DATA_POINTS)
+_CURRENT_TIME = 100000 * _TIMESCALE + _TIMESCALE - 1 #The last second of a slice, as the old analysis saw it
+
+def _analyse(prices, current_time):
+    return analytics.analyse(
+        analytics.reduce([timestamp for (timestamp, value) in prices], [value for (timestamp, value) in prices], _TIMESCALE),
+        current_time, _TIMESCALE, _DATA_POINTS,
+    )
+    
+class _Store(object):
+    """
+    Stands in for the prices table, recording every load.
+    """
+    def __init__(self, prices):
+        self.prices = dict((item_id, list(item_prices)) for (item_id, item_prices) in prices.iteritems())
+        self.loads = []
+        self.during_load = None
+        
+    def load(self, item_id, oldest_timestamp):
+        self.loads.append((item_id, oldest_timestamp))
+        prices = sorted(
+            ((timestamp, value) for (timestamp, value) in self.prices.get(item_id, ()) if timestamp >= oldest_timestamp),
+            reverse=True,
+        )
+        if self.during_load is not None:
+            self.during_load()
+        return prices
+        
+class RollupsTest(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(0)
+        self.store = _Store(dict(
+            (item_id, [(_CURRENT_TIME - rng.randint(0, 40 * legacy._ONE_DAY), rng.randint(1, 50000)) for i in xrange(500)])
+            for item_id in (1, 2, 3)
+        ))
+        self.rollups = rollups.Rollups(self.store.load, 2, _DAYS, _DATA_POINTS)
+        
+    def test_matches_the_original_analysis(self):
+        result = self.rollups.get_analytics(1, _CURRENT_TIME)
+        self.assertEqual(self.store.loads, [(1, (_CURRENT_TIME // _TIMESCALE - _DATA_POINTS + 1) * _TIMESCALE)])
+        self.assertEqual(result, _analyse(self.store.prices[1], _CURRENT_TIME))
+        
+        history = [
+            legacy.ItemPrice(timestamp, value, None, False)
+            for (timestamp, value) in sorted(self.store.prices[1], reverse=True)
+        ]
+        (normalised_data, timescale) = legacy._legacy_normalise_data(history, _CURRENT_TIME)
+        self.assertEqual(list(result.normalised_data), normalised_data)
+        (days, weeks) = legacy._legacy_compute_timeblock_averages(normalised_data, timescale)
+        self.assertEqual(
+            (result.average_24h, result.average_week, result.average_month),
+            legacy._legacy_compute_averages(days, weeks),
+        )
+        self.assertEqual(
+            (result.trend_current, result.trend_daily, result.trend_weekly),
+            legacy._legacy_compute_trends(normalised_data, days, weeks),
+        )
+        
+    def test_added_prices_are_folded_in(self):
+        self.rollups.get_analytics(1, _CURRENT_TIME)
+        added = [
+            (_CURRENT_TIME - 5, 1), #A new low
+            (_CURRENT_TIME - 6, 60000), #A new high, in the same slice
+            (_CURRENT_TIME - 3 * legacy._ONE_DAY, 25000), #Late to arrive
+            (_CURRENT_TIME - 5, 1), #Again
+        ]
+        for (timestamp, value) in added:
+            self.rollups.add(1, timestamp, value)
+        self.rollups.add(3, _CURRENT_TIME - 5, 1) #Not loaded, so nothing to do
+        
+        result = self.rollups.get_analytics(1, _CURRENT_TIME)
+        self.assertEqual(len(self.store.loads), 1)
+        self.assertEqual(result, _analyse(self.store.prices[1] + added, _CURRENT_TIME))
+        self.assertEqual(result.low_24h, analytics.PriceDatum(_CURRENT_TIME - 5, 1))
+        self.assertEqual(result.high_24h, analytics.PriceDatum(_CURRENT_TIME - 6, 60000))
+        
+    def test_ties_go_to_the_latest_price(self):
+        self.rollups.get_analytics(1, _CURRENT_TIME)
+        self.rollups.add(1, _CURRENT_TIME - 20, 0)
+        self.rollups.add(1, _CURRENT_TIME - 10, 0)
+        self.rollups.add(1, _CURRENT_TIME - 30, 0)
+        self.assertEqual(self.rollups.get_analytics(1, _CURRENT_TIME).low_24h, analytics.PriceDatum(_CURRENT_TIME - 10, 0))
+        
+    def test_window_rolls_over(self):
+        self.rollups.get_analytics(1, _CURRENT_TIME)
+        for later in (1, _TIMESCALE, 10 * _TIMESCALE, 3 * legacy._ONE_DAY):
+            self.assertEqual(
+                self.rollups.get_analytics(1, _CURRENT_TIME + later),
+                _analyse(self.store.prices[1], _CURRENT_TIME + later),
+            )
+        self.assertEqual(len(self.store.loads), 1)
+        
+    def test_invalidate_reloads(self):
+        self.rollups.get_analytics(1, _CURRENT_TIME)
+        latest = max(self.store.prices[1])
+        self.store.prices[1].remove(latest)
+        self.rollups.invalidate(1)
+        self.rollups.invalidate(3) #Never loaded
+        
+        self.assertEqual(self.rollups.get_analytics(1, _CURRENT_TIME), _analyse(self.store.prices[1], _CURRENT_TIME))
+        self.assertEqual([item_id for (item_id, oldest_timestamp) in self.store.loads], [1, 1])
+        
+    def test_prices_added_while_loading(self):
+        added = (_CURRENT_TIME - 5, 1)
+        self.store.during_load = lambda: self.rollups.add(1, *added)
+        result = self.rollups.get_analytics(1, _CURRENT_TIME)
+        self.assertEqual(result, _analyse(self.store.prices[1] + [added], _CURRENT_TIME))
+        
+        self.store.during_load = None
+        self.assertEqual(self.rollups.get_analytics(1, _CURRENT_TIME), result)
+        self.assertEqual(len(self.store.loads), 1)
+        
+    def test_deletions_while_loading(self):
+        #The load may have read the deleted price, so its rollup is used once and not kept
+        self.store.during_load = lambda: self.rollups.invalidate(1)
+        self.rollups.get_analytics(1, _CURRENT_TIME)
+        self.store.during_load = None
+        self.rollups.get_analytics(1, _CURRENT_TIME)
+        self.assertEqual(len(self.store.loads), 2)
+        self.rollups.get_analytics(1, _CURRENT_TIME)
+        self.assertEqual(len(self.store.loads), 2)
+        
+    def test_prices_added_while_analysing(self):
+        #Analysis runs outside the lock, so a price may arrive part-way through
+        self.rollups.get_analytics(1, _CURRENT_TIME)
+        added = (_CURRENT_TIME - 5, 1)
+        original_analyse = rollups.analyse
+        def analyse(*args):
+            self.assertFalse(self.rollups._lock.locked())
+            rollups.analyse = original_analyse
+            self.rollups.add(1, *added)
+            return original_analyse(*args)
+        rollups.analyse = analyse
+        try:
+            self.rollups.get_analytics(1, _CURRENT_TIME + _TIMESCALE)
+        finally:
+            rollups.analyse = original_analyse
+            
+        #What was worked out beforehand isn't kept over the added price
+        self.assertEqual(
+            self.rollups.get_analytics(1, _CURRENT_TIME + _TIMESCALE),
+            _analyse(self.store.prices[1] + [added], _CURRENT_TIME + _TIMESCALE),
+        )
+        self.assertEqual(len(self.store.loads), 1)
+        
+    def test_least_recently_viewed_are_dropped(self):
+        self.rollups.get_analytics(1, _CURRENT_TIME)
+        self.rollups.get_analytics(2, _CURRENT_TIME)
+        self.rollups.get_analytics(1, _CURRENT_TIME)
+        self.rollups.get_analytics(3, _CURRENT_TIME)
+        self.rollups.get_analytics(1, _CURRENT_TIME)
+        self.rollups.get_analytics(2, _CURRENT_TIME)
+        self.assertEqual([item_id for (item_id, oldest_timestamp) in self.store.loads], [1, 2, 3, 2])
+        
+    def test_unknown_item(self):
+        result = self.rollups.get_analytics(99, _CURRENT_TIME)
+        self.assertEqual(result.normalised_data, ())
+        self.assertIsNone(result.average_month)
+        
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import collections
+import unittest
+
+from ffxiv_market import search
+
+#Just the fields the index reads of the cache's ItemRefs
+_ItemName = collections.namedtuple('_ItemName', ['en', 'ja'])
+_ItemState = collections.namedtuple('_ItemState', ['name', 'id', 'hq'])
+_ItemRef = collections.namedtuple('_ItemRef', ['item_state'])
+
+def _item_ref(item_id, hq, en, ja):
+    return _ItemRef(_ItemState(_ItemName(en, ja), item_id, hq))
+    
+_ITEM_REFS = [
+    _item_ref(1, False, 'Cobalt Ingot', 'コバルトインゴット'),
+    _item_ref(2, True, 'Cobalt Ingot', 'コバルトインゴット'),
+    _item_ref(3, False, 'Iron Ingot', 'アイアンインゴット'),
+    _item_ref(4, False, 'Ingot Mold', 'インゴット型'),
+    _item_ref(5, False, 'Cobalt Rivets', 'コバルトリベット'),
+    _item_ref(6, False, 'Maple Log', 'メープル材'),
+]
+
+def _linear_search(language, term, limit):
+    """
+    What the index must agree with: a scan of every name, those starting
+    with the term first, each group in name order.
+    """
+    term = term.decode('utf-8').lower()
+    entries = sorted(
+        (getattr(i.item_state.name, language).decode('utf-8').lower(), i.item_state.hq, getattr(i.item_state.name, language), i.item_state.id)
+        for i in _ITEM_REFS
+    )
+    matches = [entry for entry in entries if term in entry[0]]
+    ordered = [entry for entry in matches if entry[0].startswith(term)] + [entry for entry in matches if not entry[0].startswith(term)]
+    return [(name, item_id, hq) for (lowered, hq, name, item_id) in ordered[:limit]]
+    
+class NameIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = search.NameIndex(_ITEM_REFS, _ItemName._fields)
+        
+    def test_prefixes_rank_first(self):
+        self.assertEqual(self.index.search('en', 'ingot', 10), [
+            ('Ingot Mold', 4, False),
+            ('Cobalt Ingot', 1, False),
+            ('Cobalt Ingot', 2, True),
+            ('Iron Ingot', 3, False),
+        ])
+        self.assertEqual(self.index.search('en', 'INGOT', 2), [('Ingot Mold', 4, False), ('Cobalt Ingot', 1, False)])
+        
+    def test_short_and_empty_terms(self):
+        self.assertEqual(self.index.search('en', 'co', 10), _linear_search('en', 'co', 10))
+        self.assertEqual(self.index.search('en', 'g', 3), _linear_search('en', 'g', 3))
+        self.assertEqual(self.index.search('en', '', 10), [])
+        self.assertEqual(self.index.search('en', 'zzz', 10), [])
+        
+    def test_japanese_names_match_by_character(self):
+        self.assertEqual(self.index.search('ja', 'インゴット', 10), _linear_search('ja', 'インゴット', 10))
+        self.assertEqual(self.index.search('ja', u'コバルト', 10), [
+            ('コバルトインゴット', 1, False),
+            ('コバルトインゴット', 2, True),
+            ('コバルトリベット', 5, False),
+        ])
+        
+    def test_narrowing_terms(self):
+        #Each keystroke narrows the last term's cached matches, which must give the same results as starting afresh
+        typed = 'cobalt rivets'
+        for length in xrange(1, len(typed) + 1):
+            term = typed[:length]
+            self.assertEqual(self.index.search('en', term, 10), _linear_search('en', term, 10))
+        fresh = search.NameIndex(_ITEM_REFS, _ItemName._fields)
+        self.assertEqual(fresh.search('en', 'rivets', 10), self.index.search('en', 'rivets', 10))
+        
+        #Terms that aren't narrowings of a cached one can't use its matches
+        self.assertEqual(self.index.search('en', 'log', 10), [('Maple Log', 6, False)])
+        
+    def test_term_cache_is_bounded(self):
+        for i in xrange(search._TERM_CACHE_SIZE * 2):
+            self.index.search('en', 'ingot{i}'.format(i=i), 10)
+        self.assertEqual(len(self.index._languages['en']._terms), search._TERM_CACHE_SIZE)
+        self.assertEqual(len(self.index.search('en', 'ingot', 10)), 4)
+        
+if __name__ == '__main__':
+    unittest.main()
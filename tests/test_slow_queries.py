@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+import logging
+import unittest
+
+from ffxiv_market import slow_queries
+
+logging.getLogger('slow_queries').addHandler(logging.NullHandler())
+
+def _quote(value):
+    if isinstance(value, basestring):
+        return "'{value}'".format(value=value.replace("'", "''"))
+    return str(value)
+    
+class _Cursor(object):
+    """
+    Stands in for a psycopg2 cursor, both the one whose statement was slow
+    and the explaining connection's.
+    """
+    def __init__(self, connection=None):
+        self._connection = connection
+        
+    def __enter__(self):
+        return self
+        
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+        
+    def mogrify(self, query, vars):
+        if isinstance(vars, dict):
+            return query % dict((name, _quote(value)) for (name, value) in vars.iteritems())
+        return query % tuple(_quote(value) for value in vars or ())
+        
+    def execute(self, statement):
+        self._connection.executed.append(statement)
+        if self._connection.broken:
+            raise ValueError("server closed the connection unexpectedly")
+            
+    def fetchall(self):
+        return [(line,) for line in self._connection.plan]
+        
+class _Connection(object):
+    def __init__(self, plan):
+        self.plan = plan
+        self.executed = []
+        self.broken = False
+        self.closed = 0
+        self.rollbacks = 0
+        
+    def cursor(self):
+        return _Cursor(self)
+        
+    def rollback(self):
+        self.rollbacks += 1
+        
+    def close(self):
+        self.closed = 1
+        
+class SlowQueryLogTest(unittest.TestCase):
+    def setUp(self):
+        self.connections = []
+        self.plan = ['Seq Scan on prices']
+        
+    def _connect(self):
+        connection = _Connection(self.plan)
+        self.connections.append(connection)
+        return connection
+        
+    def _build_log(self, explain_rate=0, size=10):
+        return slow_queries.SlowQueryLog(threshold=0.1, size=size, explain_rate=explain_rate, connect=self._connect)
+        
+    def _record(self, log, query, vars=None, duration=0.5):
+        log.record(_Cursor(), 'items_get', query, vars, duration)
+        log._executor.submit(lambda: None).result() #Wait for any explaining to finish
+        
+    def test_statements_are_logged_without_values(self):
+        log = self._build_log()
+        self._record(log, """SELECT prices.value
+            FROM prices
+            WHERE prices.item_id = %(item_id)s
+              AND prices.reporter = %(name)s""", {'name': 'Alice', 'item_id': 5})
+        self._record(log, "DELETE FROM prices WHERE ts < %s", (1000,), duration=0.25)
+        entries = log.list()
+        self.assertEqual([entry['duration'] for entry in entries], [0.25, 0.5])
+        self.assertEqual(entries[0]['statement'], "DELETE FROM prices WHERE ts < %s")
+        self.assertEqual(entries[0]['parameters'], '?')
+        self.assertEqual(entries[1]['statement'], "SELECT prices.value FROM prices WHERE prices.item_id = %(item_id)s AND prices.reporter = %(name)s")
+        self.assertEqual(entries[1]['parameters'], 'item_id=?, name=?')
+        self.assertEqual(entries[1]['method'], 'items_get')
+        self.assertIsNone(entries[1]['plan'])
+        
+    def test_log_is_bounded(self):
+        log = self._build_log(size=3)
+        for i in xrange(5):
+            self._record(log, "SELECT {i}".format(i=i), duration=i)
+        self.assertEqual([entry['duration'] for entry in log.list()], [4, 3, 2])
+        
+    def test_constants_are_scrubbed(self):
+        log = self._build_log()
+        self._record(log, "SELECT items.id FROM items WHERE items.name = 'Bob''s' AND items.id IN (1, 2.5, 3e10) AND items.t1 = $1")
+        self.assertEqual(
+            log.list()[0]['statement'],
+            "SELECT items.id FROM items WHERE items.name = '?' AND items.id IN (?, ?, ?) AND items.t1 = $1",
+        )
+        
+    def test_selects_are_explained(self):
+        self.plan = [
+            "Index Scan using prices_pkey on prices  (cost=0.42..8.44 rows=1 width=4) (actual time=0.01..0.02 rows=1 loops=1)",
+            "  Index Cond: ((item_id = 5) AND (reporter = 'Alice'::text))",
+            "  Filter: (value > 100.5)",
+            "  Rows Removed by Filter: 12",
+            "  Buffers: shared hit=4",
+            "Planning Time: 0.100 ms",
+        ]
+        log = self._build_log(explain_rate=1)
+        self._record(log, "SELECT prices.value FROM prices WHERE prices.item_id = %(item_id)s AND prices.reporter = %(name)s", {'name': 'Alice', 'item_id': 5})
+        self.assertEqual(self.connections[0].executed, [
+            "EXPLAIN (ANALYZE, BUFFERS) SELECT prices.value FROM prices WHERE prices.item_id = 5 AND prices.reporter = 'Alice'",
+        ])
+        self.assertEqual(self.connections[0].rollbacks, 1)
+        self.assertEqual(log.list()[0]['plan'].split('\n'), [
+            "Index Scan using prices_pkey on prices  (cost=0.42..8.44 rows=1 width=4) (actual time=0.01..0.02 rows=1 loops=1)",
+            "  Index Cond: ((item_id = ?) AND (reporter = '?'::text))",
+            "  Filter: (value > ?)",
+            "  Rows Removed by Filter: 12",
+            "  Buffers: shared hit=4",
+            "Planning Time: 0.100 ms",
+        ])
+        
+        #Prepared statements the pool executes are SELECTs too
+        self._record(log, "EXECUTE items_get_price (%s)", (5,))
+        self.assertEqual(self.connections[0].executed[-1], "EXPLAIN (ANALYZE, BUFFERS) EXECUTE items_get_price (5)")
+        
+    def test_only_selects_are_explained(self):
+        log = self._build_log(explain_rate=1)
+        self._record(log, "DELETE FROM prices WHERE ts < %s", (1000,))
+        self._record(log, "  update prices SET value = 1")
+        self.assertEqual(self.connections, [])
+        
+    def test_failed_explains_reconnect(self):
+        log = self._build_log(explain_rate=1)
+        self._record(log, "SELECT 1")
+        self.connections[0].broken = True
+        self._record(log, "SELECT 2")
+        self.assertTrue(self.connections[0].closed)
+        self.assertIsNone(log.list()[0]['plan'])
+        
+        self._record(log, "SELECT 3")
+        self.assertEqual(len(self.connections), 2)
+        self.assertEqual(log.list()[0]['plan'], 'Seq Scan on prices')
+        
+class ScrubTest(unittest.TestCase):
+    def test_scrub(self):
+        self.assertEqual(slow_queries._scrub("WHERE a = 'x' AND b = 'it''s' AND c > -12.5"), "WHERE a = '?' AND b = '?' AND c > -?")
+        self.assertEqual(slow_queries._scrub("LIMIT 1000 OFFSET 20"), "LIMIT ? OFFSET ?")
+        self.assertEqual(slow_queries._scrub("prices_y2024m01.ts, item_latest, $1, 1.5e3"), "prices_y2024m01.ts, item_latest, $1, ?")
+        
+    def test_scrub_plan(self):
+        self.assertEqual(slow_queries._scrub_plan('\n'.join([
+            "Limit  (cost=0.29..1.50 rows=100 width=12)",
+            "  Hash Cond: (a.id = 7)",
+            "  Join Filter: (a.x <> b.x)",
+            "  Sort Key: prices.ts DESC",
+            "  ->  Seq Scan on users  (cost=0.00..1.01 rows=1 width=8)",
+            "        Filter: (name = 'Bob'::text)",
+            "        Rows Removed by Filter: 3",
+            "  Output: 'literal'",
+        ])).split('\n'), [
+            "Limit  (cost=0.29..1.50 rows=100 width=12)",
+            "  Hash Cond: (a.id = ?)",
+            "  Join Filter: (a.x <> b.x)",
+            "  Sort Key: prices.ts DESC",
+            "  ->  Seq Scan on users  (cost=0.00..1.01 rows=1 width=8)",
+            "        Filter: (name = '?'::text)",
+            "        Rows Removed by Filter: 3",
+            "  Output: '?'",
+        ])
+        
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import collections
+import logging
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from ffxiv_market import snapshot
+
+logging.getLogger('snapshot').addHandler(logging.NullHandler()) #Rejected snapshots are expected here
+
+#Just the fields snapshots read of the cache's ItemRefs
+_ItemPrice = collections.namedtuple('_ItemPrice', ['timestamp', 'value'])
+_ItemState = collections.namedtuple('_ItemState', ['name', 'id', 'hq', 'price'])
+_ItemRef = collections.namedtuple('_ItemRef', ['item_state', 'average'])
+
+_DIGEST = 'd' * 32
+
+_ITEM_REFS = [
+    _ItemRef(_ItemState(('Cobalt Ingot', 'コバルトインゴット', 'Lingot de cobalt', 'Kobaltbarren'), 10, False, _ItemPrice(1000, 500)), 450),
+    _ItemRef(_ItemState(('Cobalt Ingot', 'コバルトインゴット', 'Lingot de cobalt', 'Kobaltbarren'), 11, True, _ItemPrice(1010, 900)), None),
+    _ItemRef(_ItemState(('Maple Log', 'メープル材', '', 'Ahorn-Stamm'), 20, False, None), None),
+]
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'cache.snapshot')
+        
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        
+    def test_round_trip(self):
+        snapshot.write(self.path, _ITEM_REFS, _DIGEST, 2000.5)
+        self.assertFalse(os.path.exists(self.path + '.tmp'))
+        (written, high_water, items) = snapshot.read(self.path, _DIGEST)
+        self.assertEqual(high_water, 2000)
+        self.assertEqual(items, [
+            (10, False, ['Cobalt Ingot', 'コバルトインゴット', 'Lingot de cobalt', 'Kobaltbarren'], 1000, 500, 450),
+            (11, True, ['Cobalt Ingot', 'コバルトインゴット', 'Lingot de cobalt', 'Kobaltbarren'], 1010, 900, None),
+            (20, False, ['Maple Log', 'メープル材', '', 'Ahorn-Stamm'], None, None, None),
+        ])
+        
+    def test_replaces_older_snapshots(self):
+        snapshot.write(self.path, _ITEM_REFS, _DIGEST, 2000)
+        snapshot.write(self.path, _ITEM_REFS[2:], _DIGEST, 3000)
+        (written, high_water, items) = snapshot.read(self.path, _DIGEST)
+        self.assertEqual(high_water, 3000)
+        self.assertEqual([item[0] for item in items], [20])
+        
+    def test_catalogue_mismatch(self):
+        snapshot.write(self.path, _ITEM_REFS, _DIGEST, 2000)
+        self.assertIsNone(snapshot.read(self.path, 'e' * 32))
+        
+    def test_missing_or_malformed(self):
+        self.assertIsNone(snapshot.read(self.path, _DIGEST))
+        
+        open(self.path, 'wb').close()
+        self.assertIsNone(snapshot.read(self.path, _DIGEST))
+        
+        with open(self.path, 'wb') as snapshot_file:
+            snapshot_file.write('XXXX' + '\0' * 100)
+        self.assertIsNone(snapshot.read(self.path, _DIGEST))
+        
+    def test_truncated(self):
+        snapshot.write(self.path, _ITEM_REFS, _DIGEST, 2000)
+        with open(self.path, 'rb') as snapshot_file:
+            data = snapshot_file.read()
+        for length in (10, len(data) // 2, len(data) - 1):
+            with open(self.path, 'wb') as snapshot_file:
+                snapshot_file.write(data[:length])
+            self.assertIsNone(snapshot.read(self.path, _DIGEST))
+            
+    def test_other_format_versions(self):
+        snapshot.write(self.path, _ITEM_REFS, _DIGEST, 2000)
+        with open(self.path, 'r+b') as snapshot_file:
+            snapshot_file.seek(4)
+            snapshot_file.write(struct.pack('<H', 99))
+        self.assertIsNone(snapshot.read(self.path, _DIGEST))
+        
+if __name__ == '__main__':
+    unittest.main()
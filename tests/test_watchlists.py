@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import collections
+import random
+import unittest
+
+from ffxiv_market import watchlists
+
+class WatchlistsTest(unittest.TestCase):
+    def setUp(self):
+        self.watchlists = watchlists.Watchlists([(1, 10), (1, 20), (2, 20), (3, 30), (3, 20)])
+        
+    def test_loaded_entries(self):
+        self.assertEqual(self.watchlists.list(1), [10, 20])
+        self.assertEqual(self.watchlists.count(3), 2)
+        self.assertTrue(self.watchlists.is_watching(2, 20))
+        self.assertFalse(self.watchlists.is_watching(2, 10))
+        self.assertEqual(self.watchlists.get_most_watched(), [20, 10, 30])
+        self.assertEqual(self.watchlists.get_most_watched(2), [20, 10])
+        
+    def test_unknown_users(self):
+        self.assertEqual(self.watchlists.list(99), [])
+        self.assertEqual(self.watchlists.count(99), 0)
+        self.assertFalse(self.watchlists.is_watching(99, 10))
+        self.assertFalse(self.watchlists.remove(99, 10))
+        self.watchlists.clear(99)
+        self.assertEqual(self.watchlists.version, 0)
+        
+    def test_add_and_remove(self):
+        self.assertTrue(self.watchlists.add(2, 30))
+        self.assertFalse(self.watchlists.add(2, 30))
+        self.assertEqual(self.watchlists.version, 1)
+        self.assertEqual(self.watchlists.get_most_watched(), [20, 30, 10])
+        
+        self.assertTrue(self.watchlists.remove(1, 10))
+        self.assertFalse(self.watchlists.remove(1, 10))
+        self.assertEqual(self.watchlists.version, 2)
+        self.assertEqual(self.watchlists.list(1), [20])
+        self.assertEqual(self.watchlists.get_most_watched(), [20, 30])
+        
+    def test_clear(self):
+        self.watchlists.clear(3)
+        self.assertEqual(self.watchlists.version, 1)
+        self.assertEqual(self.watchlists.list(3), [])
+        self.assertEqual(self.watchlists.get_most_watched(), [20, 10])
+        
+    def test_ranking_matches_a_recount(self):
+        rng = random.Random(0)
+        items = collections.defaultdict(set, {1: {10, 20}, 2: {20}, 3: {30, 20}})
+        for i in xrange(5000):
+            (user_id, item_id) = (rng.randint(1, 30), rng.randint(1, 40))
+            action = rng.random()
+            if action < 0.6:
+                self.assertEqual(self.watchlists.add(user_id, item_id), item_id not in items[user_id])
+                items[user_id].add(item_id)
+            elif action < 0.98:
+                self.assertEqual(self.watchlists.remove(user_id, item_id), item_id in items[user_id])
+                items[user_id].discard(item_id)
+            else:
+                self.watchlists.clear(user_id)
+                items[user_id].clear()
+                
+        watchers = collections.Counter(item_id for item_ids in items.itervalues() for item_id in item_ids)
+        self.assertEqual(
+            self.watchlists.get_most_watched(),
+            [item_id for (count, item_id) in sorted((-count, item_id) for (item_id, count) in watchers.iteritems())],
+        )
+        for (user_id, item_ids) in items.iteritems():
+            self.assertEqual(self.watchlists.list(user_id), sorted(item_ids))
+            
+if __name__ == '__main__':
+    unittest.main()